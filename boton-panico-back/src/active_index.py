@@ -0,0 +1,180 @@
+"""
+Índice en memoria de la cola de casos activos (estado 'Activo').
+
+La cola es chica y muy consultada: cada mediador la lee en cada poll de
+/search y al abrir /search/stream. Solo la modifican dos escrituras de este
+proceso: crear un reporte (entra a la cola) y auto-asignarlo (sale). El
+índice guarda esas filas, ya con los datos del estudiante y los textos de
+hora, ordenadas por id (FIFO), y pagina igual que queries.fetch_active_tasks
+(mismo cursor, mismos parámetros), así que /search responde sin tocar SQLite.
+
+    generation = index.generation          # antes de leer la cola
+    index.reconcile(rows, generation)      # carga inicial y verificación periódica
+    index.add(task)                        # después de transitions.create_task
+    index.remove(task_id)                  # después de transitions.assign_task
+    rows, cursor = index.fetch(100, after)
+
+Consistencia:
+
+- add()/remove() se llaman solo después de que la transacción hizo COMMIT.
+- Si una asignación se aplica antes que el alta de la misma tarea (las dos
+  corrutinas pueden reanudarse en cualquier orden), el id queda marcado como
+  retirado y el alta tardía se ignora.
+- reconcile() recibe la cola leída del almacenamiento (Storage.all_active_tasks)
+  y la compara fila por fila con el índice; si difieren (escrituras de otro
+  proceso, cambios manuales) corrige el índice y cuenta la diferencia. Si
+  hubo un add/remove desde `generation` (mientras se leía), no aplica esa
+  lectura y espera a la siguiente vuelta. Tras una corrección llama a
+  `on_corrected(diferencias)`: quien haya leído el índice viejo (ETag de
+  /search, clientes del stream) debe enterarse.
+- check() verifica las invariantes internas (orden, ids únicos, estado).
+
+Mientras el índice no está cargado, o si una verificación falló, `ready` es
+False y el llamador debe usar la consulta SQL.
+"""
+from bisect import bisect_right, insort
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+import threading
+import time
+
+from queries import ESTADO_ACTIVO, InvalidCursor, decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+
+class ActiveTaskIndex:
+    def __init__(self, removed_memory: int = 1024, on_corrected: Optional[Callable[[int], None]] = None):
+        self.on_corrected = on_corrected
+        self._lock = threading.Lock()
+        self._ids: List[int] = []  # Ordenados ascendente (FIFO)
+        self._tasks: Dict[int, dict] = {}
+        self._removed: deque = deque(maxlen=removed_memory)  # Ids retirados recientemente
+        self._removed_set = set()
+        self._generation = 0  # Aumenta con cada add/remove
+        self._loaded = False
+        self._healthy = True
+
+        self.reads = 0
+        self.reconciles = 0
+        self.reconciles_skipped = 0
+        self.corrections = 0
+        self.last_reconcile_at: Optional[float] = None
+
+    @property
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return self._loaded and self._healthy
+
+    # --- ESCRITURAS (después del COMMIT) ---
+
+    def add(self, task: dict):
+        task_id = task["id"]
+        with self._lock:
+            self._generation += 1
+            if task.get("estado") != ESTADO_ACTIVO or task_id in self._removed_set:
+                return
+            if task_id not in self._tasks:
+                insort(self._ids, task_id)
+            self._tasks[task_id] = dict(task)
+
+    def remove(self, task_id: int):
+        with self._lock:
+            self._generation += 1
+            if len(self._removed) == self._removed.maxlen:
+                self._removed_set.discard(self._removed[0])
+            self._removed.append(task_id)
+            self._removed_set.add(task_id)
+            if self._tasks.pop(task_id, None) is not None:
+                del self._ids[bisect_right(self._ids, task_id) - 1]
+
+    # --- LECTURA ---
+
+    def fetch(self, limit: int, after: Optional[str] = None, offset: int = 0) -> Tuple[List[dict], Optional[str]]:
+        """Misma firma y resultado que queries.fetch_active_tasks (sin la conexión)."""
+        start_id = None
+        if after:
+            try:
+                start_id = int(decode_cursor("search", after)["id"])
+            except (KeyError, TypeError, ValueError):
+                raise InvalidCursor(after)
+        with self._lock:
+            self.reads += 1
+            start = bisect_right(self._ids, start_id) if start_id is not None else 0
+            start += offset
+            rows = [dict(self._tasks[task_id]) for task_id in self._ids[start:start + limit]]
+        next_cursor = encode_cursor("search", id=rows[-1]["id"]) if len(rows) == limit else None
+        return rows, next_cursor
+
+    # --- VERIFICACIÓN ---
+
+    def reconcile(self, rows: List[dict], generation: int) -> int:
+        """
+        Compara el índice con la cola leída cuando la generación era
+        `generation` y lo corrige. Devuelve cuántas filas difirieron
+        (faltantes, sobrantes o con otro contenido).
+        """
+        fresh = {row["id"]: row for row in rows}
+
+        with self._lock:
+            if self._generation != generation:
+                # Un add/remove ocurrió durante la lectura: no se sabe cuál de los dos es más nuevo
+                self.reconciles_skipped += 1
+                return 0
+            differences = len(self._tasks.keys() - fresh.keys())
+            differences += sum(1 for task_id, row in fresh.items() if self._tasks.get(task_id) != row)
+            was_loaded = self._loaded
+            self._tasks = fresh
+            self._ids = sorted(fresh)
+            self._loaded = True
+            self.reconciles += 1
+            self.last_reconcile_at = time.time()
+            if was_loaded and differences:
+                self.corrections += differences
+
+        if not was_loaded:
+            logger.info(f"Índice de casos activos cargado ({len(fresh)} tareas)")
+        elif differences:
+            logger.warning(f"Índice de casos activos corregido: {differences} tareas no coincidían con la base de datos")
+        self.check()
+        if was_loaded and differences and self.on_corrected:
+            self.on_corrected(differences)
+        return differences if was_loaded else 0
+
+    def check(self) -> List[str]:
+        """Invariantes internas; si alguna falla el índice deja de usarse hasta el próximo reconcile correcto."""
+        with self._lock:
+            problems = []
+            if any(a >= b for a, b in zip(self._ids, self._ids[1:])):
+                problems.append("ids fuera de orden o repetidos")
+            if len(self._ids) != len(self._tasks) or set(self._ids) != self._tasks.keys():
+                problems.append("lista de ids y tareas no coinciden")
+            wrong = [task_id for task_id, task in self._tasks.items() if task.get("estado") != ESTADO_ACTIVO]
+            if wrong:
+                problems.append(f"tareas que no están en estado {ESTADO_ACTIVO}: {wrong[:10]}")
+            self._healthy = not problems
+        for problem in problems:
+            logger.error(f"Índice de casos activos inconsistente: {problem}")
+        return problems
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": self._loaded,
+                "healthy": self._healthy,
+                "size": len(self._ids),
+                "reads": self.reads,
+                "reconciles": self.reconciles,
+                "reconciles_skipped": self.reconciles_skipped,
+                "corrections": self.corrections,
+                "last_reconcile_at": (
+                    time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.last_reconcile_at))
+                    if self.last_reconcile_at else None
+                ),
+            }
@@ -0,0 +1,166 @@
+"""
+Archivo de tareas completadas en la tabla fría `tasks_archivo`.
+
+La tabla `tasks` solo crece, y las filas 'Completado' comparten páginas e
+índices con las pocas tareas vivas que consulta cada poll. El archivador
+mueve las tareas completadas hace más de ARCHIVE_AFTER_DAYS días a
+`tasks_archivo`, en lotes pequeños: cada lote es un INSERT ... SELECT y un
+DELETE dentro de la misma transacción corta, así que una tarea siempre está
+en exactamente una de las dos tablas. Así `tasks` y sus índices quedan del
+tamaño del trabajo reciente, sin importar cuánto historial haya.
+
+El archivo vive en la misma base de datos y no en un archivo adjunto
+(ATTACH): con WAL, una transacción que escribe en dos archivos no es atómica
+entre ellos, y un corte a mitad de lote podría duplicar o perder tareas.
+
+Las lecturas de historial (/my-tasks/, /tasks/{id}) consultan las dos tablas
+(ver queries.py y main.get_task_details).
+
+Después de cada lote se ejecuta `PRAGMA incremental_vacuum` para devolver
+al sistema las páginas liberadas. Requiere auto_vacuum=INCREMENTAL, que las
+bases nuevas activan al crearse; en una base existente se activa una sola
+vez, con la API detenida (hace un VACUUM completo):
+
+    python archive.py status
+    python archive.py run --days 30
+    python archive.py enable-incremental-vacuum
+"""
+from typing import Optional
+import logging
+import sqlite3
+import time
+
+from queries import ARCHIVE_TABLE
+from transitions import ESTADO_COMPLETADO, immediate_transaction
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLUMNS = (
+    "id", "usuario_id", "ubicacion", "estado", "fecha", "hora_creacion",
+    "hora_asignacion", "hora_resolucion", "hora_completado", "mediador_id", "descripcion_final",
+    "created_at", "assigned_at", "resolved_at", "completed_at",
+)
+DAY_MS = 24 * 60 * 60 * 1000
+# Páginas liberadas por lote como máximo: acota el tiempo con el lock tomado
+VACUUM_PAGES_PER_BATCH = 1000
+
+
+def cutoff_ms(older_than_days: float, now_ms: int) -> int:
+    return now_ms - int(older_than_days * DAY_MS)
+
+
+def archive_batch(conn: sqlite3.Connection, cutoff: int, batch_size: int = 500) -> int:
+    """Mueve hasta `batch_size` tareas completadas antes de `cutoff` (ms); devuelve cuántas movió."""
+    columns = ", ".join(ARCHIVE_COLUMNS)
+    with immediate_transaction(conn):
+        # Filas heredadas sin completed_at se archivan según su fecha de creación
+        ids = [
+            row[0] for row in conn.execute(
+                """
+                SELECT id FROM tasks
+                WHERE estado = ? AND COALESCE(completed_at, created_at) < ?
+                ORDER BY id LIMIT ?
+                """,
+                (ESTADO_COMPLETADO, cutoff, batch_size),
+            ).fetchall()
+        ]
+        if not ids:
+            return 0
+        placeholders = ", ".join("?" * len(ids))
+        conn.execute(
+            f"""
+            INSERT INTO {ARCHIVE_TABLE} ({columns}, archived_at)
+            SELECT {columns}, ? FROM tasks WHERE id IN ({placeholders})
+            """,
+            [int(time.time() * 1000), *ids],
+        )
+        conn.execute(f"DELETE FROM tasks WHERE id IN ({placeholders})", ids)
+    return len(ids)
+
+
+def incremental_vacuum(conn: sqlite3.Connection, pages: int = VACUUM_PAGES_PER_BATCH) -> int:
+    """Devuelve hasta `pages` páginas libres al sistema; 0 si la base no usa auto_vacuum=INCREMENTAL."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if not before:
+        return 0
+    # execute() avanza la sentencia un solo paso (= una página); executescript la completa
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def archive_step(conn: sqlite3.Connection, cutoff: int, batch_size: int = 500) -> int:
+    """Un lote más su vacuum incremental: la unidad que ejecuta la tarea de fondo de la API."""
+    moved = archive_batch(conn, cutoff, batch_size)
+    if moved:
+        incremental_vacuum(conn)
+    return moved
+
+
+def archive_old_tasks(
+    conn: sqlite3.Connection,
+    older_than_days: float,
+    batch_size: int = 500,
+    max_batches: Optional[int] = None,
+    pause: float = 0.005,
+) -> int:
+    """Archiva por lotes hasta que no quedan candidatas (o `max_batches`); devuelve el total."""
+    cutoff = cutoff_ms(older_than_days, int(time.time() * 1000))
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_step(conn, cutoff, batch_size)
+        if not moved:
+            break
+        total += moved
+        batches += 1
+        time.sleep(pause)  # Ceder el lock de escritura entre lotes
+    if total:
+        logger.info(f"Archivadas {total} tareas completadas hace más de {older_than_days} días")
+    return total
+
+
+def enable_incremental_vacuum(conn: sqlite3.Connection):
+    """Cambia una base existente a auto_vacuum=INCREMENTAL. Reescribe el archivo completo."""
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def archive_status(conn: sqlite3.Connection) -> dict:
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return {
+        "tasks": conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0],
+        "archived": conn.execute(f"SELECT COUNT(*) FROM {ARCHIVE_TABLE}").fetchone()[0],
+        "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(conn.execute("PRAGMA auto_vacuum").fetchone()[0]),
+        "size_bytes": conn.execute("PRAGMA page_count").fetchone()[0] * page_size,
+        "free_bytes": conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    from dotenv import load_dotenv
+    from database import ConnectionPool
+    from migrations import migrate
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Archivo de tareas completadas")
+    parser.add_argument("command", choices=["status", "run", "enable-incremental-vacuum"])
+    parser.add_argument("--days", type=float, default=float(os.getenv("ARCHIVE_AFTER_DAYS", "30")))
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("ARCHIVE_BATCH_SIZE", "500")))
+    args = parser.parse_args()
+
+    pool = ConnectionPool(os.getenv("DATABASE_URL", "db/isaa.db"), max_size=1)
+    with pool.connection() as conn:
+        migrate(conn)
+        if args.command == "run":
+            archive_old_tasks(conn, args.days, args.batch_size)
+        elif args.command == "enable-incremental-vacuum":
+            enable_incremental_vacuum(conn)
+        print(archive_status(conn))
+    pool.close()
@@ -0,0 +1,168 @@
+"""
+Acceso a la base de datos desde endpoints async.
+
+sqlite3 es bloqueante: una consulta lenta o una espera de lock dentro de un
+`async def` detiene el event loop y con él todas las peticiones del worker.
+AsyncDatabase ejecuta cada consulta en un pool de hilos propio (separado del
+de bcrypt y del executor por defecto), con una conexión del ConnectionPool.
+
+    rows = await db.run(fetch_active_tasks, 100)   # fn(conn, *args)
+
+Cada llamada tiene un tiempo máximo. Si se vence, o si la petición se
+cancela, la consulta en curso se aborta con `Connection.interrupt()` (SQLite
+deshace la sentencia) y la conexión vuelve al pool. Las llamadas que escriben
+deben pasar `timeout=None`: interrumpir justo después del COMMIT reportaría un
+error sobre un cambio que sí se guardó. Esas llamadas tampoco se interrumpen
+si la petición se cancela: la escritura termina en su hilo. Lo que deba
+ocurrir después del COMMIT (publicar el cambio) va en `run_to_completion`.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+
+from database import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT = object()
+
+
+class QueryTimeoutError(Exception):
+    """La consulta no terminó dentro del tiempo máximo y fue interrumpida."""
+
+
+async def run_to_completion(awaitable: Awaitable[Any], on_result: Callable[[Any], None]) -> Any:
+    """
+    Espera `awaitable` protegido de la cancelación del llamador y llama a
+    on_result(resultado) en cuanto termina bien, aunque el llamador ya se haya
+    ido (cliente desconectado, apagado). El callback corre antes de que el
+    llamador reciba el resultado.
+    """
+    future = asyncio.ensure_future(awaitable)
+
+    def done(f: asyncio.Future):
+        if not f.cancelled() and f.exception() is None:
+            on_result(f.result())
+
+    future.add_done_callback(done)
+    return await asyncio.shield(future)
+
+
+class _Call:
+    """Una llamada en curso: permite interrumpir su conexión sin carreras con release()."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conn: Optional[sqlite3.Connection] = None
+        self.cancelled = False
+
+    def interrupt(self) -> bool:
+        with self.lock:
+            self.cancelled = True
+            if self.conn is None:
+                return False
+            self.conn.interrupt()
+            return True
+
+
+class AsyncDatabase:
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        max_workers: int = 10,
+        timeout: Optional[float] = 5.0,
+        on_query: Optional[Callable[[str, float], None]] = None,
+    ):
+        if max_workers < 1:
+            raise ValueError("Se requiere max_workers >= 1")
+        self.pool = pool
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.on_query = on_query  # Recibe (nombre de la función, segundos) de cada llamada (métricas)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        self._lock = threading.Lock()
+        self._running = 0
+
+        self.completed = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    async def run(self, fn: Callable[..., Any], *args, timeout: Any = _DEFAULT) -> Any:
+        """Ejecuta fn(conn, *args) en el executor y devuelve su resultado."""
+        if timeout is _DEFAULT:
+            timeout = self.timeout
+        call = _Call()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, self._execute, call, fn, args)
+        if timeout is None:
+            try:
+                # Escritura: si el llamador se cancela, la llamada sigue (ni se descarta de la cola ni se interrumpe)
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                with self._lock:
+                    self.cancelled += 1
+                raise
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            call.interrupt()
+            with self._lock:
+                self.timeouts += 1
+            logger.warning(f"Consulta {getattr(fn, '__name__', fn)} interrumpida tras {timeout} s")
+            raise QueryTimeoutError(f"{getattr(fn, '__name__', fn)}: más de {timeout} s")
+        except asyncio.CancelledError:
+            # El cliente se fue o el servidor se está apagando
+            call.interrupt()
+            with self._lock:
+                self.cancelled += 1
+            raise
+
+    def _execute(self, call: _Call, fn: Callable[..., Any], args: tuple) -> Any:
+        if call.cancelled:
+            raise QueryTimeoutError("cancelada antes de empezar")
+        conn = self.pool.acquire()
+        with call.lock:
+            call.conn = conn
+        with self._lock:
+            self._running += 1
+        start = time.perf_counter()
+        try:
+            if call.cancelled:
+                raise QueryTimeoutError("cancelada antes de empezar")
+            return fn(conn, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            with call.lock:
+                call.conn = None
+            # release() deshace cualquier transacción que haya quedado abierta
+            self.pool.release(conn)
+            with self._lock:
+                self._running -= 1
+                self.completed += 1
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+            if self.on_query:
+                self.on_query(getattr(fn, "__name__", "desconocida"), elapsed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "timeout_seconds": self.timeout,
+                "running": self._running,
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+                "cancelled": self.cancelled,
+                "avg_ms": round(self.total_seconds * 1000 / self.completed, 3) if self.completed else 0.0,
+                "max_ms": round(self.max_seconds * 1000, 3),
+            }
+
+    def shutdown(self):
+        # Las escrituras en cola o en curso terminan; las lecturas canceladas ya se interrumpieron
+        self._executor.shutdown(wait=True)
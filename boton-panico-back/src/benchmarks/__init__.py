@@ -0,0 +1 @@
+"""Herramientas de medición de rendimiento (no se importan desde la API)."""
@@ -0,0 +1,214 @@
+"""
+Generador de datos sintéticos para medir consultas a volúmenes reales.
+
+Desde boton-panico-back/src:
+
+    python -m benchmarks.dataset --users 100000 --tasks 2000000 --output benchmarks/data/grande.db
+
+Crea el esquema con las migraciones de la API y llena `usuarios` y `tasks`
+respetando sus invariantes:
+
+- Los reportes por estudiante siguen una distribución sesgada: pocos
+  estudiantes concentran muchos reportes y la mayoría tiene uno o ninguno.
+- Casi todas las tareas históricas están 'Completado'; una fracción quedó en
+  'Pendiente Formulario' (el estudiante nunca llenó el formulario).
+- Las tareas más recientes son los casos abiertos: `--active` en 'Activo' y
+  `--pending` en 'Pendiente' (uno por mediador), con `caso_activo = 1`.
+- created_at crece con el id y los textos fecha/hora_* se derivan de él, igual
+  que en las transiciones de la API.
+
+El generador es determinista para una misma semilla.
+"""
+from typing import Iterator, List
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from migrations import migrate  # noqa: E402
+from timestamps import format_local  # noqa: E402
+import transitions  # noqa: E402
+
+PASSWORD = "bench"
+BATCH_SIZE = 50000
+MINUTE_MS = 60 * 1000
+
+UBICACIONES = [f"Edificio {letra}" for letra in "ABCDEFGHJK"] + ["Biblioteca", "Cafetería", "Canchas", "Estacionamiento"]
+
+
+def _user_rows(users: int, mediators: int, password_hash: str) -> Iterator[tuple]:
+    for i in range(mediators):
+        yield (f"med{i:05d}", f"med{i:05d}@bench.test", password_hash, "mediador", "Mediador", f"{i}", 0)
+    for i in range(users):
+        yield (f"{200000000 + i}", f"est{i:06d}@bench.test", password_hash, "usuario", "Estudiante", f"{i}", 0)
+
+
+def _skewed_index(rng: random.Random, n: int) -> int:
+    # rng.random() ** 3 concentra la masa cerca de 0: pocos índices muy repetidos
+    return int(n * rng.random() ** 3)
+
+
+def _task_row(rng: random.Random, usuario_id: int, mediador_id, estado: str, created: int) -> tuple:
+    fecha, hora_creacion = format_local(created)
+    assigned = resolved = completed = None
+    hora_asignacion = hora_resolucion = hora_completado = None
+    descripcion = None
+    if estado != transitions.ESTADO_ACTIVO:
+        assigned = created + rng.randint(1, 10) * MINUTE_MS
+        hora_asignacion = format_local(assigned)[1]
+    if estado in (transitions.ESTADO_PENDIENTE_FORMULARIO, transitions.ESTADO_COMPLETADO):
+        resolved = assigned + rng.randint(5, 60) * MINUTE_MS
+        hora_resolucion = format_local(resolved)[1]
+    if estado == transitions.ESTADO_COMPLETADO:
+        completed = resolved + rng.randint(1, 120) * MINUTE_MS
+        hora_completado = format_local(completed)[1]
+        descripcion = "Atendido"
+    return (
+        usuario_id, rng.choice(UBICACIONES), estado, fecha, hora_creacion,
+        hora_asignacion, hora_resolucion, hora_completado, mediador_id, descripcion,
+        created, assigned, resolved, completed,
+    )
+
+
+def generate(
+    path: str,
+    users: int,
+    tasks: int,
+    mediators: int,
+    active: int,
+    pending: int,
+    pending_formulario: float,
+    days: int,
+    seed: int,
+) -> dict:
+    from passlib.context import CryptContext
+
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")  # Solo durante la carga; la API usa NORMAL
+    migrate(conn)
+    if conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]:
+        raise SystemExit(f"{path} ya tiene tareas; use otro --output")
+
+    password_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash(PASSWORD)
+    conn.executemany(
+        """
+        INSERT INTO usuarios (codigo, correo, contrasena, rol, nombre, apellido, caso_activo)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        _user_rows(users, mediators, password_hash),
+    )
+    conn.commit()
+    mediator_ids = [r[0] for r in conn.execute("SELECT id FROM usuarios WHERE rol = 'mediador' ORDER BY id")]
+    student_ids = [r[0] for r in conn.execute("SELECT id FROM usuarios WHERE rol = 'usuario' ORDER BY id")]
+
+    # Casos abiertos: los más recientes, un estudiante distinto por caso
+    pending = min(pending, len(mediator_ids))
+    open_total = min(active + pending, tasks, len(student_ids))
+    open_students = rng.sample(student_ids, open_total)
+    historic = tasks - open_total
+
+    now = int(time.time() * 1000)
+    span = days * 24 * 60 * MINUTE_MS
+    step = span / max(1, tasks)
+    sql = """
+        INSERT INTO tasks (
+            usuario_id, ubicacion, estado, fecha, hora_creacion,
+            hora_asignacion, hora_resolucion, hora_completado, mediador_id, descripcion_final,
+            created_at, assigned_at, resolved_at, completed_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+    batch: List[tuple] = []
+    counts = {estado: 0 for estado in (
+        transitions.ESTADO_ACTIVO, transitions.ESTADO_PENDIENTE,
+        transitions.ESTADO_PENDIENTE_FORMULARIO, transitions.ESTADO_COMPLETADO,
+    )}
+
+    def flush():
+        conn.executemany(sql, batch)
+        conn.commit()
+        batch.clear()
+
+    for i in range(tasks):
+        created = now - span + int(i * step)
+        if i < historic:
+            usuario_id = student_ids[_skewed_index(rng, len(student_ids))]
+            mediador_id = mediator_ids[_skewed_index(rng, len(mediator_ids))] if mediator_ids else None
+            estado = (
+                transitions.ESTADO_PENDIENTE_FORMULARIO
+                if rng.random() < pending_formulario else transitions.ESTADO_COMPLETADO
+            )
+        else:
+            j = i - historic
+            usuario_id = open_students[j]
+            if j < pending:
+                mediador_id, estado = mediator_ids[j], transitions.ESTADO_PENDIENTE
+            else:
+                mediador_id, estado = None, transitions.ESTADO_ACTIVO
+        counts[estado] += 1
+        batch.append(_task_row(rng, usuario_id, mediador_id, estado, created))
+        if len(batch) >= BATCH_SIZE:
+            flush()
+            print(f"  {i + 1}/{tasks} tareas", file=sys.stderr)
+    if batch:
+        flush()
+
+    # Flags de caso activo coherentes con los casos abiertos
+    conn.execute(
+        """
+        UPDATE usuarios SET caso_activo = 1 WHERE id IN (
+            SELECT usuario_id FROM tasks WHERE estado IN (?, ?)
+            UNION SELECT mediador_id FROM tasks WHERE estado = ?
+        )
+        """,
+        (transitions.ESTADO_ACTIVO, transitions.ESTADO_PENDIENTE, transitions.ESTADO_PENDIENTE),
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    return {
+        "path": path,
+        "users": len(student_ids),
+        "mediators": len(mediator_ids),
+        "tasks": tasks,
+        "estados": counts,
+        "seconds": round(time.perf_counter() - start, 1),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Genera una base de datos sintética grande")
+    parser.add_argument("--users", type=int, default=100000, help="Estudiantes")
+    parser.add_argument("--mediators", type=int, default=200)
+    parser.add_argument("--tasks", type=int, default=2000000)
+    parser.add_argument("--active", type=int, default=150, help="Casos en estado 'Activo'")
+    parser.add_argument("--pending", type=int, default=50, help="Casos en estado 'Pendiente' (uno por mediador)")
+    parser.add_argument("--pending-formulario", type=float, default=0.03,
+                        help="Fracción de tareas históricas que quedaron en 'Pendiente Formulario'")
+    parser.add_argument("--days", type=int, default=730, help="Días de historia")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=os.path.join("benchmarks", "data", "bench.db"))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    summary = generate(
+        args.output, args.users, args.tasks, args.mediators, args.active, args.pending,
+        args.pending_formulario, args.days, args.seed,
+    )
+    print(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+"""
+Prueba de carga con estudiantes y mediadores simulados contra la API real.
+
+Desde boton-panico-back/src:
+
+    python -m benchmarks.loadtest --students 200 --mediators 10 --duration 60
+    python -m benchmarks.loadtest --mode uvicorn --port 8900
+
+Cada estudiante consulta /my-tasks/ cada --poll-interval segundos (con
+If-None-Match, como el frontend), reporta un caso con POST /my-tasks/ cuando
+no tiene uno abierto y completa el formulario cuando su caso se resuelve.
+Cada mediador consulta /search con el mismo intervalo, compite por los casos
+con PUT /tasks/{id}/asignar y los resuelve tras un tiempo de atención.
+
+La base de datos es un archivo temporal nuevo en cada corrida; los usuarios se
+insertan directamente (con un solo hash bcrypt compartido) para que la
+preparación no domine la medición. Con --storage memory (solo en modo
+inprocess) la API usa el almacenamiento en memoria (storage/memory.py): la
+diferencia con la corrida en SQLite es el costo de la base de datos.
+
+El resultado se escribe en JSON (benchmarks/results/ por defecto) con el
+commit actual, para comparar corridas entre versiones.
+"""
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(SRC_DIR, "benchmarks", "results")
+PASSWORD = "carga"
+
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+
+# --- REGISTRO DE MUESTRAS ---
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.workflow = Counter()
+
+    def record(self, route: str, status, seconds: float):
+        self.latencies[route].append(seconds)
+        self.statuses[route][str(status)] += 1
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Rango más cercano: el menor valor con al menos pct% de las muestras a su izquierda
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[max(0, rank - 1)]
+
+
+async def call(client: httpx.AsyncClient, recorder: Recorder, method: str, route: str, url: str, **kwargs):
+    """Una petición medida; se agrupa por método y plantilla de ruta."""
+    key = f"{method} {route}"
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+    except httpx.HTTPError as e:
+        recorder.record(key, type(e).__name__, time.perf_counter() - start)
+        return None
+    recorder.record(key, response.status_code, time.perf_counter() - start)
+    return response
+
+
+async def login(client: httpx.AsyncClient, recorder: Recorder, codigo: str, attempts: int = 10) -> Optional[dict]:
+    for _ in range(attempts):
+        response = await call(
+            client, recorder, "POST", "/token", "/token", data={"username": codigo, "password": PASSWORD}
+        )
+        if response is not None and response.status_code == 200:
+            return {"Authorization": f"Bearer {response.json()['access_token']}"}
+        if response is None or response.status_code not in (429, 503):
+            return None
+        # Cola de bcrypt llena: reintentar como lo haría el cliente
+        await asyncio.sleep(float(response.headers.get("retry-after", "1")))
+    return None
+
+
+async def pause(stop: asyncio.Event, seconds: float):
+    try:
+        await asyncio.wait_for(stop.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+# --- ACTORES SIMULADOS ---
+
+async def student(client, recorder: Recorder, codigo: str, stop: asyncio.Event, args, rng: random.Random):
+    headers = await login(client, recorder, codigo)
+    if headers is None:
+        recorder.workflow["login_failed"] += 1
+        return
+    etag = None
+    tasks: List[dict] = []
+    await pause(stop, rng.uniform(0, args.poll_interval))  # Desfasar los polls
+    while not stop.is_set():
+        open_case = any(t["estado"] in ("Activo", "Pendiente") for t in tasks)
+        if not open_case and rng.random() < args.report_probability:
+            response = await call(
+                client, recorder, "POST", "/my-tasks/", "/my-tasks/",
+                headers=headers, json={"ubicacion": f"Edificio {rng.choice('ABCDEFG')}"},
+            )
+            if response is not None and response.status_code == 201:
+                recorder.workflow["created"] += 1
+
+        poll_headers = dict(headers, **({"If-None-Match": etag} if etag else {}))
+        response = await call(
+            client, recorder, "GET", "/my-tasks/", "/my-tasks/", headers=poll_headers, params={"limit": 20}
+        )
+        if response is not None and response.status_code == 200:
+            etag = response.headers.get("etag")
+            tasks = response.json()
+
+        for task in tasks:
+            if task["estado"] == "Pendiente Formulario":
+                response = await call(
+                    client, recorder, "POST", "/my-tasks/{id}/completar", f"/my-tasks/{task['id']}/completar",
+                    headers=headers, json={"descripcion_final": "Atendido"},
+                )
+                if response is not None and response.status_code == 200:
+                    recorder.workflow["completed"] += 1
+                    task["estado"] = "Completado"
+        await pause(stop, args.poll_interval)
+
+
+async def mediator(client, recorder: Recorder, codigo: str, stop: asyncio.Event, args, rng: random.Random):
+    headers = await login(client, recorder, codigo)
+    if headers is None:
+        recorder.workflow["login_failed"] += 1
+        return
+    etag = None
+    queue: List[dict] = []
+    current = None
+    resolve_at = 0.0
+    await pause(stop, rng.uniform(0, args.poll_interval))
+    while not stop.is_set():
+        if current is None:
+            poll_headers = dict(headers, **({"If-None-Match": etag} if etag else {}))
+            response = await call(
+                client, recorder, "GET", "/search", "/search", headers=poll_headers, params={"limit": 20}
+            )
+            if response is not None and response.status_code == 200:
+                etag = response.headers.get("etag")
+                queue = response.json()
+            if queue:
+                # Varios mediadores ven la misma cola: se toma uno de los primeros
+                task = rng.choice(queue[:3])
+                response = await call(
+                    client, recorder, "PUT", "/tasks/{id}/asignar", f"/tasks/{task['id']}/asignar", headers=headers
+                )
+                if response is not None and response.status_code == 200:
+                    recorder.workflow["assigned"] += 1
+                    current = task["id"]
+                    resolve_at = time.monotonic() + rng.uniform(*args.attention_seconds)
+                else:
+                    recorder.workflow["race_lost"] += 1
+                    queue = [t for t in queue if t["id"] != task["id"]]
+                continue
+        elif time.monotonic() >= resolve_at:
+            response = await call(
+                client, recorder, "PUT", "/tasks/{id}/resolver", f"/tasks/{current}/resolver", headers=headers
+            )
+            if response is not None and response.status_code == 200:
+                recorder.workflow["resolved"] += 1
+            current = None
+            continue
+        await pause(stop, args.poll_interval)
+
+
+# --- PREPARACIÓN DE LA BASE Y DEL SERVIDOR ---
+
+def load_users(students: int, mediators: int, bcrypt_rounds: int) -> list:
+    """Usuarios de la prueba como filas de importación, con un solo hash bcrypt compartido."""
+    from passlib.context import CryptContext
+    from user_import import ImportRow
+
+    password_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=bcrypt_rounds).hash(PASSWORD)
+    specs = [(f"est{i:06d}", "usuario", "Estudiante", str(i)) for i in range(students)]
+    specs += [(f"med{i:04d}", "mediador", "Mediador", str(i)) for i in range(mediators)]
+    return [
+        ImportRow(line=0, codigo=codigo, correo=f"{codigo}@carga.test", contrasena=PASSWORD,
+                  nombre=nombre, apellido=apellido, rol=rol, hash=password_hash)
+        for codigo, rol, nombre, apellido in specs
+    ]
+
+
+def seed_database(path: str, users: list):
+    from migrations import migrate
+
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    migrate(conn)
+    conn.executemany(
+        "INSERT INTO usuarios (codigo, correo, contrasena, rol, nombre, apellido, caso_activo) VALUES (?, ?, ?, ?, ?, ?, 0)",
+        [(u.codigo, u.correo, u.hash, u.rol, u.nombre, u.apellido) for u in users],
+    )
+    conn.commit()
+    conn.close()
+
+
+def server_env(args, db_path: str) -> dict:
+    return {
+        "DATABASE_URL": db_path,
+        "SECRET_KEY": os.getenv("SECRET_KEY") or "prueba-de-carga-" + "x" * 32,
+        "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+        "SEED_DEMO_USERS": "0",
+        "STORAGE_BACKEND": args.storage,
+    }
+
+
+class InProcessServer:
+    """La app de FastAPI en este mismo proceso, vía httpx.ASGITransport."""
+
+    def __init__(self, env: dict, users: Optional[list] = None):
+        os.environ.update(env)
+        import main
+        self.main = main
+        self.users = users  # Se cargan por la API al arrancar (almacenamiento en memoria)
+
+    async def __aenter__(self) -> httpx.AsyncClient:
+        await self.main.app.router.startup()
+        if self.users:
+            await self.main.storage.insert_users(self.users)
+        transport = httpx.ASGITransport(app=self.main.app)
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://carga", timeout=30)
+        return self.client
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+        await self.main.app.router.shutdown()
+
+
+class UvicornServer:
+    """Un proceso uvicorn local, para medir también el costo de HTTP real."""
+
+    def __init__(self, env: dict, port: int, limit: int):
+        self.env = dict(os.environ, **env)
+        self.port = port
+        self.limit = limit
+
+    async def __aenter__(self) -> httpx.AsyncClient:
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(self.port), "--log-level", "warning"],
+            cwd=SRC_DIR, env=self.env,
+        )
+        limits = httpx.Limits(max_connections=self.limit, max_keepalive_connections=self.limit)
+        self.client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{self.port}", timeout=30, limits=limits)
+        for _ in range(100):
+            try:
+                if (await self.client.get("/health")).status_code == 200:
+                    return self.client
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.1)
+        raise RuntimeError("uvicorn no respondió en /health")
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+        self.process.terminate()
+        self.process.wait(timeout=10)
+
+
+# --- REPORTE ---
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(recorder: Recorder, elapsed: float, stats_before: dict, stats_after: dict) -> dict:
+    routes = {}
+    total = 0
+    for route, samples in sorted(recorder.latencies.items()):
+        samples = sorted(samples)
+        statuses = recorder.statuses[route]
+        count = len(samples)
+        total += count
+        errors = sum(n for s, n in statuses.items() if not s.isdigit() or s.startswith("5"))
+        conflicts = statuses.get("404", 0) + statuses.get("409", 0)
+        routes[route] = {
+            "count": count,
+            "rps": round(count / elapsed, 2),
+            "status": dict(sorted(statuses.items())),
+            "error_rate": round(errors / count, 4),
+            "conflict_rate": round(conflicts / count, 4),
+            "latency_ms": {
+                "mean": round(sum(samples) * 1000 / count, 3),
+                "p50": round(percentile(samples, 50) * 1000, 3),
+                "p90": round(percentile(samples, 90) * 1000, 3),
+                "p95": round(percentile(samples, 95) * 1000, 3),
+                "p99": round(percentile(samples, 99) * 1000, 3),
+                "max": round(samples[-1] * 1000, 3),
+            },
+        }
+
+    pool_before, pool_after = stats_before.get("db_pool", {}), stats_after.get("db_pool", {})
+    executor_before, executor_after = stats_before.get("db_executor", {}), stats_after.get("db_executor", {})
+    waits = pool_after.get("waits", 0) - pool_before.get("waits", 0)
+    return {
+        "elapsed_seconds": round(elapsed, 3),
+        "requests": total,
+        "rps": round(total / elapsed, 2),
+        "routes": routes,
+        "workflow": dict(recorder.workflow),
+        "db": {
+            # Esperas por una conexión libre y consultas que se pasaron del tiempo máximo
+            # (incluye las que esperaban el lock de escritura de SQLite)
+            "pool_waits": waits,
+            "pool_timeouts": pool_after.get("timeouts", 0) - pool_before.get("timeouts", 0),
+            "pool_max_wait_ms": pool_after.get("max_wait_ms"),
+            "pool_peak_in_use": pool_after.get("peak_in_use"),
+            "query_timeouts": executor_after.get("timeouts", 0) - executor_before.get("timeouts", 0),
+            "query_avg_ms": executor_after.get("avg_ms"),
+            "query_max_ms": executor_after.get("max_ms"),
+        },
+    }
+
+
+def print_summary(result: dict):
+    print(f"{result['requests']} peticiones en {result['elapsed_seconds']} s ({result['rps']} req/s)")
+    print(f"{'ruta':<32}{'n':>7}{'req/s':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'err%':>7}{'404/409%':>10}")
+    for route, data in result["routes"].items():
+        lat = data["latency_ms"]
+        print(
+            f"{route:<32}{data['count']:>7}{data['rps']:>8}{lat['p50']:>9}{lat['p95']:>9}{lat['p99']:>9}"
+            f"{lat['max']:>9}{data['error_rate'] * 100:>7.2f}{data['conflict_rate'] * 100:>10.2f}"
+        )
+    print(f"flujo: {result['workflow']}")
+    print(f"db: {result['db']}")
+
+
+# --- EJECUCIÓN ---
+
+async def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="isaa-carga-")
+    db_path = os.path.join(workdir, "carga.db")
+    users = load_users(args.students, args.mediators, args.bcrypt_rounds)
+    if args.storage == "sqlite":
+        seed_database(db_path, users)
+    env = server_env(args, db_path)
+    server = (
+        UvicornServer(env, args.port, args.students + args.mediators)
+        if args.mode == "uvicorn" else InProcessServer(env, users if args.storage == "memory" else None)
+    )
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    async with server as client:
+        stats_before = (await client.get("/health/stats")).json()
+        stop = asyncio.Event()
+        actors = [
+            student(client, recorder, f"est{i:06d}", stop, args, random.Random(rng.random()))
+            for i in range(args.students)
+        ] + [
+            mediator(client, recorder, f"med{i:04d}", stop, args, random.Random(rng.random()))
+            for i in range(args.mediators)
+        ]
+        tasks = [asyncio.create_task(actor) for actor in actors]
+        start = time.perf_counter()
+        await pause(stop, args.duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        stats_after = (await client.get("/health/stats")).json()
+
+    result = summarize(recorder, elapsed, stats_before, stats_after)
+    result["meta"] = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "sqlite": sqlite3.sqlite_version,
+        "params": {k: v for k, v in vars(args).items() if k != "output"},
+    }
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API ISAA")
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--port", type=int, default=8900, help="Puerto de uvicorn (modo uvicorn)")
+    parser.add_argument("--storage", choices=["sqlite", "memory"], default="sqlite",
+                        help="Almacenamiento de la API (memory solo en modo inprocess)")
+    parser.add_argument("--students", type=int, default=100)
+    parser.add_argument("--mediators", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=30.0, help="Segundos de carga")
+    parser.add_argument("--poll-interval", type=float, default=3.0, help="Intervalo de polling (el frontend usa 3 s)")
+    parser.add_argument("--report-probability", type=float, default=0.2,
+                        help="Probabilidad por poll de que un estudiante sin caso abierto reporte uno")
+    parser.add_argument("--attention-seconds", type=float, nargs=2, default=(2.0, 6.0),
+                        help="Rango de segundos que un mediador tarda en resolver un caso")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4,
+                        help="Costo bcrypt del servidor (bajo para que el login no domine la medición)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Archivo JSON de resultados (por defecto benchmarks/results/)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.storage == "memory" and args.mode != "inprocess":
+        raise SystemExit("--storage memory requiere --mode inprocess: los datos viven en el proceso de la API")
+    result = asyncio.run(run(args))
+    print_summary(result)
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        name = f"loadtest-{result['meta']['commit'] or 'local'}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        output = os.path.join(RESULTS_DIR, name)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"Resultados en {output}")
+
+
+if __name__ == "__main__":
+    main()
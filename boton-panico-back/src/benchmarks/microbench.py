@@ -0,0 +1,204 @@
+"""
+Microbenchmarks de las consultas de la API sobre una base grande.
+
+Desde boton-panico-back/src:
+
+    python -m benchmarks.dataset --output benchmarks/data/bench.db
+    python -m benchmarks.microbench --db benchmarks/data/bench.db
+    python -m benchmarks.microbench --db benchmarks/data/bench.db --baseline benchmarks/results/micro-abc123.json
+
+Llama a las mismas funciones que usa SQLiteStorage (select_user,
+get_task_details, fetch_active_tasks, fetch_user_tasks, ...) con una conexión
+del pool de la API, y reporta latencia por llamada. Incluye los casos que
+estresan los índices: el estudiante con más reportes, páginas profundas por
+offset y por cursor, filtros por estado y el mediador con más casos.
+
+También verifica los planes de ejecución (queries.check_query_plans) con las
+estadísticas de ANALYZE de la base grande.
+
+Con --baseline compara contra una corrida anterior y termina con error si
+alguna mediana empeoró más de --tolerance veces.
+"""
+from typing import Callable, Dict, List, Tuple
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(SRC_DIR, "benchmarks", "results")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[max(0, rank - 1)]
+
+
+def measure(fn: Callable[[random.Random], object], seconds: float, min_calls: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    for _ in range(min(10, min_calls)):
+        fn(rng)  # Calentar caché de páginas y de sentencias
+    samples = []
+    deadline = time.perf_counter() + seconds
+    while len(samples) < min_calls or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        fn(rng)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "calls": len(samples),
+        "ops_per_second": round(len(samples) / sum(samples), 1),
+        "mean_us": round(sum(samples) * 1e6 / len(samples), 1),
+        "p50_us": round(percentile(samples, 50) * 1e6, 1),
+        "p95_us": round(percentile(samples, 95) * 1e6, 1),
+        "p99_us": round(percentile(samples, 99) * 1e6, 1),
+        "max_us": round(samples[-1] * 1e6, 1),
+    }
+
+
+def build_benchmarks(conn: sqlite3.Connection) -> List[Tuple[str, Callable]]:
+    from queries import fetch_active_tasks, fetch_user_tasks
+    from storage.sqlite import get_mediator_active_task, get_task_details, select_user
+    import transitions
+
+    max_task_id = conn.execute("SELECT MAX(id) FROM tasks").fetchone()[0]
+    codigos = [r[0] for r in conn.execute("SELECT codigo FROM usuarios")]
+    student_ids = [r[0] for r in conn.execute("SELECT id FROM usuarios WHERE rol = 'usuario'")]
+    heavy_student = conn.execute(
+        "SELECT usuario_id FROM tasks GROUP BY usuario_id ORDER BY COUNT(*) DESC LIMIT 1"
+    ).fetchone()[0]
+    heavy_mediator = conn.execute(
+        "SELECT mediador_id FROM tasks WHERE mediador_id IS NOT NULL GROUP BY mediador_id ORDER BY COUNT(*) DESC LIMIT 1"
+    ).fetchone()[0]
+    busy_mediator = conn.execute(
+        "SELECT mediador_id FROM tasks WHERE estado = ? LIMIT 1", (transitions.ESTADO_PENDIENTE,)
+    ).fetchone()
+    busy_mediator = busy_mediator[0] if busy_mediator else heavy_mediator
+
+    # Cursores de páginas profundas, obtenidos una sola vez
+    _, search_cursor = fetch_active_tasks(conn, 50)
+    deep_cursor = None
+    after = None
+    for _ in range(50):
+        _, after = fetch_user_tasks(conn, heavy_student, 100, after=after)
+        if after is None:
+            break
+        deep_cursor = after
+
+    return [
+        ("get_user", lambda rng: select_user(conn, rng.choice(codigos))),
+        ("get_task_details", lambda rng: get_task_details(conn, rng.randint(1, max_task_id))),
+        ("search_active_tasks", lambda rng: fetch_active_tasks(conn, 100)),
+        ("search_active_tasks_after", lambda rng: fetch_active_tasks(conn, 100, after=search_cursor)),
+        ("read_my_tasks", lambda rng: fetch_user_tasks(conn, rng.choice(student_ids), 100)),
+        ("read_my_tasks_heavy_user", lambda rng: fetch_user_tasks(conn, heavy_student, 100)),
+        ("read_my_tasks_heavy_offset_5000", lambda rng: fetch_user_tasks(conn, heavy_student, 100, offset=5000)),
+        ("read_my_tasks_heavy_after_deep", lambda rng: fetch_user_tasks(conn, heavy_student, 100, after=deep_cursor)),
+        ("read_my_tasks_heavy_estado", lambda rng: fetch_user_tasks(
+            conn, heavy_student, 100, estado=transitions.ESTADO_PENDIENTE_FORMULARIO)),
+        ("mediator_active_case", lambda rng: get_mediator_active_task(conn, busy_mediator)),
+        ("mediator_active_case_heavy", lambda rng: get_mediator_active_task(conn, heavy_mediator)),
+    ]
+
+
+def dataset_summary(conn: sqlite3.Connection) -> dict:
+    return {
+        "usuarios": conn.execute("SELECT COUNT(*) FROM usuarios").fetchone()[0],
+        "tasks": conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0],
+        "estados": dict(conn.execute("SELECT estado, COUNT(*) FROM tasks GROUP BY estado").fetchall()),
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    regressions = []
+    for name, data in results.items():
+        old = baseline.get(name)
+        if not old or not old.get("p50_us"):
+            continue
+        ratio = data["p50_us"] / old["p50_us"]
+        data["p50_vs_baseline"] = round(ratio, 2)
+        if ratio > tolerance:
+            regressions.append(f"{name}: p50 {old['p50_us']} -> {data['p50_us']} us (x{ratio:.2f})")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks de consultas")
+    parser.add_argument("--db", default=os.path.join("benchmarks", "data", "bench.db"))
+    parser.add_argument("--seconds", type=float, default=1.0, help="Tiempo mínimo por benchmark")
+    parser.add_argument("--min-calls", type=int, default=20)
+    parser.add_argument("--only", nargs="*", help="Nombres de benchmarks a correr")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", help="JSON de una corrida anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Empeoramiento máximo de la mediana")
+    parser.add_argument("--output", help="Archivo JSON de resultados (por defecto benchmarks/results/)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(args.db):
+        raise SystemExit(f"No existe {args.db}; genérela con `python -m benchmarks.dataset --output {args.db}`")
+
+    os.environ["DATABASE_URL"] = args.db
+    os.environ.setdefault("SECRET_KEY", "microbench-" + "x" * 32)
+    import main as api
+    from benchmarks.loadtest import git_commit
+    from migrations import migrate
+    from queries import check_query_plans
+
+    results: Dict[str, dict] = {}
+    with api.db_pool.connection() as conn:
+        migrate(conn)
+        dataset = dataset_summary(conn)
+        print(f"Datos: {dataset}")
+        plan_problems = check_query_plans(conn)
+        for name, fn in build_benchmarks(conn):
+            if args.only and name not in args.only:
+                continue
+            results[name] = measure(fn, args.seconds, args.min_calls, args.seed)
+            r = results[name]
+            print(f"{name:<34}{r['calls']:>8} llamadas  p50 {r['p50_us']:>10} us  p99 {r['p99_us']:>10} us")
+    api.db_pool.close()
+
+    for problem in plan_problems:
+        print(f"PLAN {problem}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["benchmarks"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESIÓN {regression}")
+
+    output = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version.split()[0],
+            "sqlite": sqlite3.sqlite_version,
+            "dataset": dataset,
+            "params": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "plan_problems": plan_problems,
+        "benchmarks": results,
+        "regressions": regressions,
+    }
+    path = args.output
+    if not path:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"micro-{output['meta']['commit'] or 'local'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump(output, f, indent=2, ensure_ascii=False)
+    print(f"Resultados en {path}")
+    sys.exit(1 if regressions or plan_problems else 0)
+
+
+if __name__ == "__main__":
+    main()
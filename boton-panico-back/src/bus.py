@@ -0,0 +1,206 @@
+"""
+Bus de cambios entre workers sobre la misma base SQLite (tabla change_log).
+
+Con varios workers (serve.py) cada proceso tiene su propia caché de
+usuarios, sus contadores de ETag, su índice de casos activos, su despachador
+y sus suscriptores de /search/stream. Lo que cambia en un worker tiene que
+llegar a los demás:
+
+- publish() agrega el cambio a una cola local y despierta al bucle, que lo
+  escribe en change_log en una transacción corta (varios cambios juntos si
+  llegaron a la vez).
+- Cada worker lee las filas nuevas (id > último visto) y aplica las de otros
+  orígenes con el handler registrado para su tipo. Antes de consultar mira
+  `PRAGMA data_version`, que solo cambia cuando otra conexión hizo COMMIT,
+  así que un worker sin tráfico no consulta la tabla.
+- Los ids de change_log son consecutivos (AUTOINCREMENT, un escritor a la
+  vez), así que un salto entre el último id visto y el siguiente significa
+  que se borraron filas sin leerlas (un worker detenido más que la
+  retención). En ese caso se llama a `on_gap` para descartar el estado local.
+- Las filas más viejas que `retention_seconds` se borran periódicamente.
+
+La entrega es eventual: un cambio llega a los otros workers en unos
+`poll_interval` segundos. Lo que garantiza la consistencia sigue siendo
+SQLite (las guardas de transitions.py); el bus solo mantiene al día las
+copias en memoria.
+"""
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[Dict[str, Any]], None]
+
+
+class ChangeBus:
+    def __init__(
+        self,
+        database: str,
+        poll_interval: float = 0.05,
+        retention_seconds: float = 300.0,
+        busy_timeout_ms: int = 5000,
+        on_gap: Optional[Callable[[], None]] = None,
+    ):
+        self.database = database
+        self.origin = f"{socket.gethostname()}-{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.retention_ms = int(retention_seconds * 1000)
+        self.busy_timeout_ms = busy_timeout_ms
+        self.on_gap = on_gap
+        self._handlers: Dict[str, Handler] = {}
+        self._outbox: deque = deque()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._last_id = 0
+        self._data_version: Optional[int] = None
+        self._last_purge = 0.0
+
+        self.published = 0
+        self.received = 0
+        self.gaps = 0
+        self.errors = 0
+        self.last_lag_ms: Optional[int] = None
+
+    def on(self, kind: str, handler: Handler):
+        self._handlers[kind] = handler
+
+    # --- PUBLICACIÓN ---
+
+    def publish(self, kind: str, payload: Dict[str, Any]):
+        """Encola un cambio para los demás workers; es seguro llamarlo desde cualquier hilo."""
+        with self._lock:
+            self._outbox.append((kind, json.dumps(payload, separators=(",", ":"))))
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    # --- SINCRONIZACIÓN (en un hilo, con conexión propia) ---
+
+    def open(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False, isolation_level=None)
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Solo interesan los cambios posteriores al arranque: el estado inicial sale de SQLite
+        self._last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM change_log").fetchone()[0]
+        self._data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        self._conn = conn
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._flush()
+            except sqlite3.Error as e:
+                logger.warning(f"No se pudieron publicar los últimos cambios: {e}")
+            self._conn.close()
+            self._conn = None
+
+    def _flush(self):
+        with self._lock:
+            pending = list(self._outbox)
+            self._outbox.clear()
+        if not pending:
+            return
+        now = int(time.time() * 1000)
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany(
+                "INSERT INTO change_log (origin, kind, payload, created_at) VALUES (?, ?, ?, ?)",
+                [(self.origin, kind, payload, now) for kind, payload in pending],
+            )
+            self._conn.execute("COMMIT")
+        except sqlite3.Error:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            with self._lock:
+                self._outbox.extendleft(reversed(pending))  # Se reintenta en la próxima vuelta
+            raise
+        self.published += len(pending)
+
+    def _purge(self):
+        cutoff = int(time.time() * 1000) - self.retention_ms
+        self._conn.execute("DELETE FROM change_log WHERE created_at < ?", (cutoff,))
+
+    def sync(self) -> Tuple[List[Tuple[str, Dict[str, Any]]], bool]:
+        """Publica lo pendiente y lee lo nuevo; devuelve (cambios de otros workers, hubo salto)."""
+        self._flush()
+        if time.monotonic() - self._last_purge > self.retention_ms / 1000 / 2:
+            self._last_purge = time.monotonic()
+            self._purge()
+
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return [], False  # Ninguna otra conexión escribió desde la última vuelta
+        self._data_version = data_version
+
+        rows = self._conn.execute(
+            "SELECT id, origin, kind, payload, created_at FROM change_log WHERE id > ? ORDER BY id",
+            (self._last_id,),
+        ).fetchall()
+        if not rows:
+            return [], False
+        gap = rows[0][0] != self._last_id + 1
+        self._last_id = rows[-1][0]
+        changes = [(kind, json.loads(payload)) for _, origin, kind, payload, _ in rows if origin != self.origin]
+        if changes:
+            self.last_lag_ms = int(time.time() * 1000) - rows[-1][4]
+        return changes, gap
+
+    # --- BUCLE ---
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                changes, gap = await asyncio.to_thread(self.sync)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error al sincronizar cambios entre workers: {e}")
+                await asyncio.sleep(1)
+                continue
+            if gap:
+                self.gaps += 1
+                logger.warning("Se perdieron cambios de otros workers; se descarta el estado en memoria")
+                if self.on_gap:
+                    self.on_gap()
+            for kind, payload in changes:
+                self.received += 1
+                handler = self._handlers.get(kind)
+                if handler is None:
+                    continue  # Tipo de otra versión del código (despliegue escalonado)
+                try:
+                    handler(payload)
+                except Exception as e:
+                    self.errors += 1
+                    logger.error(f"Error al aplicar el cambio '{kind}' de otro worker: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._outbox)
+        return {
+            "origin": self.origin,
+            "last_id": self._last_id,
+            "pending": pending,
+            "published": self.published,
+            "received": self.received,
+            "gaps": self.gaps,
+            "errors": self.errors,
+            "last_lag_ms": self.last_lag_ms,
+        }
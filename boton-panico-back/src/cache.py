@@ -0,0 +1,130 @@
+"""
+Caché en memoria con expiración (TTL) y desalojo LRU.
+
+Se usa para los usuarios autenticados: evita un SELECT por petición en
+get_current_user. Los endpoints que modifican un usuario deben invalidarlo.
+
+Una lectura que empezó antes de una invalidación y termina después traería
+la fila vieja: quien llena la caché tras un fallo toma `generation()` antes
+de leer y la pasa a `set`, que descarta el valor si su alias se invalidó
+entretanto.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+import threading
+import time
+
+
+class TTLCache:
+    def __init__(self, max_size: int = 1024, ttl: float = 30.0):
+        if max_size < 1:
+            raise ValueError("El tamaño de la caché debe ser al menos 1")
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # clave -> (valor, expira, alias)
+        self._aliases: Dict[Hashable, Hashable] = {}  # alias -> clave
+        self._generation = 0  # Crece con cada invalidate_alias
+        self._invalidated_at: Dict[Hashable, int] = {}  # alias -> generación de su última invalidación
+        self._cleared_at = 0  # Generación del último clear(): invalida todos los alias
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_sets = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, _ = entry
+            if expires_at <= now:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def set(
+        self, key: Hashable, value: Any, alias: Optional[Hashable] = None, generation: Optional[int] = None
+    ) -> bool:
+        """
+        Guarda `value`; `alias` permite invalidarlo también por otra clave (p. ej. el id).
+        Con `generation` (la de antes de leer `value`) no guarda nada si el alias se
+        invalidó después; devuelve si se guardó.
+        """
+        with self._lock:
+            if generation is not None and (
+                self._cleared_at > generation
+                or (alias is not None and self._invalidated_at.get(alias, 0) > generation)
+            ):
+                self.stale_sets += 1
+                return False
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, time.monotonic() + self.ttl, alias)
+            if alias is not None:
+                self._aliases[alias] = key
+            while len(self._data) > self.max_size:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            if self._remove(key):
+                self.invalidations += 1
+
+    def invalidate_alias(self, alias: Hashable):
+        with self._lock:
+            # Un dato por alias invalidado (los ids de usuario están acotados)
+            self._generation += 1
+            self._invalidated_at[alias] = self._generation
+            key = self._aliases.get(alias)
+            if key is not None and self._remove(key):
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._aliases.clear()
+            self._generation += 1
+            self._cleared_at = self._generation
+            self._invalidated_at.clear()
+
+    def _remove(self, key: Hashable) -> bool:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return False
+        alias = entry[2]
+        if alias is not None and self._aliases.get(alias) == key:
+            del self._aliases[alias]
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_sets": self.stale_sets,
+            }
@@ -0,0 +1,221 @@
+"""
+Pool de conexiones SQLite.
+
+Mantiene un número acotado de conexiones abiertas y configuradas una sola vez
+(WAL, synchronous=NORMAL, busy_timeout, foreign_keys), en lugar de abrir y
+cerrar una conexión por cada consulta.
+"""
+from contextlib import contextmanager
+from collections import deque
+from typing import Callable, Optional
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """No se obtuvo una conexión libre dentro del tiempo de espera."""
+
+
+class PoolClosedError(PoolTimeoutError):
+    """El pool ya se cerró (apagado); para el llamador equivale a no obtener conexión."""
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        database: str,
+        max_size: int = 10,
+        timeout: float = 5.0,
+        busy_timeout_ms: int = 5000,
+        health_check_interval: float = 30.0,
+        on_acquire: Optional[Callable[[float], None]] = None,
+        factory: type = sqlite3.Connection,
+    ):
+        if max_size < 1:
+            raise ValueError("El tamaño del pool debe ser al menos 1")
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.health_check_interval = health_check_interval
+        self.on_acquire = on_acquire  # Recibe los segundos que tardó cada préstamo (métricas)
+        self.factory = factory  # Clase de conexión (p. ej. la instrumentada de slowlog.py)
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conexión, momento de su última devolución)
+        self._open = 0
+        self._in_use = 0
+        self._closed = False
+
+        # Contadores para dimensionar el pool
+        self._acquisitions = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._health_check_failures = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._peak_in_use = 0
+
+    # --- CREACIÓN Y VERIFICACIÓN DE CONEXIONES ---
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,  # La conexión viaja entre hilos, pero nunca se comparte a la vez
+            factory=self.factory,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            logger.warning(f"Conexión del pool descartada por health check: {e}")
+            return False
+
+    def _close_quietly(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    # --- PRÉSTAMO Y DEVOLUCIÓN ---
+
+    def acquire(self) -> sqlite3.Connection:
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+
+        while True:
+            with self._cond:
+                while not self._closed and not self._idle and self._open >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"Sin conexiones libres tras {self.timeout}s (máximo {self.max_size})"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+                if self._closed:
+                    raise PoolClosedError("El pool de conexiones está cerrado")
+                if self._idle:
+                    conn, last_used = self._idle.pop()  # LIFO: reutiliza la conexión más caliente
+                    needs_check = time.monotonic() - last_used > self.health_check_interval
+                else:
+                    conn, needs_check = None, False
+                    self._open += 1
+                self._in_use += 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._forget()
+                    raise
+                with self._cond:
+                    self._created += 1
+            elif needs_check and not self._is_healthy(conn):
+                self._close_quietly(conn)
+                with self._cond:
+                    self._health_check_failures += 1
+                self._forget()
+                continue
+
+            elapsed = time.monotonic() - start
+            with self._cond:
+                self._acquisitions += 1
+                if waited:
+                    self._waits += 1
+                self._total_wait += elapsed
+                self._max_wait = max(self._max_wait, elapsed)
+                self._peak_in_use = max(self._peak_in_use, self._in_use)
+            if self.on_acquire:
+                self.on_acquire(elapsed)
+            return conn
+
+    def _forget(self):
+        """Libera el hueco de una conexión que se cerró o nunca llegó a abrirse."""
+        with self._cond:
+            self._open -= 1
+            self._in_use -= 1
+            self._discarded += 1
+            self._cond.notify()
+
+    def release(self, conn: sqlite3.Connection, discard: bool = False):
+        if not discard:
+            try:
+                # Nunca devolver al pool una transacción a medias
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error as e:
+                logger.warning(f"No se pudo limpiar la conexión antes de devolverla: {e}")
+                discard = True
+
+        if discard:
+            self._close_quietly(conn)
+            self._forget()
+            return
+
+        with self._cond:
+            if not self._closed:
+                self._in_use -= 1
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+                return
+            # Pool cerrado: la conexión prestada se cierra en lugar de volver a la cola
+            self._in_use -= 1
+            self._open -= 1
+        self._close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    # --- ADMINISTRACIÓN ---
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "peak_in_use": self._peak_in_use,
+                "acquisitions": self._acquisitions,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "discarded": self._discarded,
+                "health_check_failures": self._health_check_failures,
+                "avg_wait_ms": round(self._total_wait * 1000 / self._acquisitions, 3) if self._acquisitions else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 3),
+            }
+
+    def close(self):
+        """Cierra las conexiones libres; las prestadas se cierran al devolverse y acquire() falla desde ahora."""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
@@ -0,0 +1,132 @@
+"""
+Asignación automática de casos activos a mediadores libres (DISPATCH_MODE=auto).
+
+En modo manual cada mediador consulta /search y compite por asignarse un
+caso; la tarea espera al siguiente poll y varios mediadores se lanzan sobre
+la misma fila. En modo automático este despachador empareja los dos lados
+en cuanto cualquiera de ellos está disponible:
+
+- Mediadores libres: los conectados a /search/stream (el panel solo abre el
+  stream cuando el mediador no tiene caso), en orden de llegada; el que lleva
+  más tiempo esperando recibe el siguiente caso.
+- Casos: la cola de tareas 'Activo' en SQLite, la más antigua primero
+  (transitions.dispatch_next). No hay un campo de prioridad; el orden se
+  define en esa única consulta.
+
+Cada emparejamiento es una sola transacción (BEGIN IMMEDIATE) que toma la
+tarea más antigua y marca al mediador con caso_activo = 1, con las mismas
+guardas que la auto-asignación: si el mediador ya tiene caso sale de la
+cola, y una asignación manual simultánea no puede duplicar el caso.
+
+El despachador despierta al crearse un reporte, al resolverse un caso y al
+conectarse un mediador, y además cada `sweep_seconds` para recoger tareas
+creadas por otro proceso. El mediador recibe el caso por su stream
+(evento 'task_dispatched'); los demás ven el 'task_assigned' de siempre.
+"""
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable, Optional
+import asyncio
+import logging
+import time
+
+from async_db import run_to_completion
+from transitions import ActorBusy
+
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    def __init__(
+        self,
+        assign_next: Callable[[int], Awaitable[Optional[dict]]],
+        on_assigned: Callable[[dict], None],
+        sweep_seconds: float = 5.0,
+    ):
+        self.assign_next = assign_next  # mediador_id -> tarea asignada, o None si no hay casos
+        self.on_assigned = on_assigned  # Notificaciones y cachés después del COMMIT (aunque se cancele run())
+        self.sweep_seconds = sweep_seconds
+        self._connections: Counter = Counter()  # Streams abiertos por mediador (varias pestañas)
+        self._free: "OrderedDict[int, float]" = OrderedDict()  # mediador -> desde cuándo espera
+        self._wake = asyncio.Event()
+
+        self.dispatched = 0
+        self.busy_skips = 0
+        self.errors = 0
+        self.last_dispatch_at: Optional[float] = None
+
+    # --- DISPONIBILIDAD DE MEDIADORES ---
+
+    def connect(self, mediador_id: int):
+        self._connections[mediador_id] += 1
+        self.mark_free(mediador_id)
+
+    def disconnect(self, mediador_id: int):
+        self._connections[mediador_id] -= 1
+        if self._connections[mediador_id] <= 0:
+            del self._connections[mediador_id]
+            self._free.pop(mediador_id, None)
+
+    def mark_free(self, mediador_id: int):
+        """El mediador quedó sin caso; solo entra a la cola si tiene el panel abierto."""
+        if mediador_id in self._connections and mediador_id not in self._free:
+            self._free[mediador_id] = time.monotonic()
+            self._wake.set()
+
+    def mark_busy(self, mediador_id: int):
+        self._free.pop(mediador_id, None)
+
+    def task_available(self):
+        self._wake.set()
+
+    # --- EMPAREJAMIENTO ---
+
+    async def dispatch_pending(self) -> int:
+        """Empareja mientras haya mediadores libres y casos; devuelve cuántos asignó."""
+        assigned = 0
+        while self._free:
+            mediador_id = next(iter(self._free))
+            try:
+                task = await run_to_completion(self.assign_next(mediador_id), self._notify)
+            except ActorBusy:
+                # Ya tiene caso (se asignó a mano o en otro proceso): vuelve al resolverlo
+                self._free.pop(mediador_id, None)
+                self.busy_skips += 1
+                continue
+            if task is None:
+                break  # No hay casos en espera
+            self._free.pop(mediador_id, None)
+            self.dispatched += 1
+            self.last_dispatch_at = time.time()
+            assigned += 1
+        return assigned
+
+    def _notify(self, task: Optional[dict]):
+        if task is not None:
+            self.on_assigned(task)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.sweep_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.dispatch_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error en la asignación automática: {e}")
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "connected_mediators": len(self._connections),
+            "free_mediators": len(self._free),
+            "longest_wait_seconds": round(now - next(iter(self._free.values())), 1) if self._free else 0.0,
+            "dispatched": self.dispatched,
+            "busy_skips": self.busy_skips,
+            "errors": self.errors,
+            "last_dispatch_at": self.last_dispatch_at,
+        }
@@ -0,0 +1,162 @@
+"""
+Bus de eventos en memoria para las notificaciones push (Server-Sent Events).
+
+Los endpoints de escritura publican deltas (tarea creada, tarea asignada) y cada
+suscriptor los recibe en su propia cola asyncio. Se guarda un historial corto
+para que un cliente que se reconecta con Last-Event-ID reciba solo lo que se
+perdió; si el hueco ya no está en el historial, debe pedir un snapshot completo.
+"""
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Event:
+    seq: int
+    type: str
+    data: Dict[str, Any]
+    epoch: str
+
+    @property
+    def id(self) -> str:
+        return f"{self.epoch}-{self.seq}"
+
+    def encode(self) -> str:
+        return encode_event(self.id, self.type, self.data)
+
+
+@dataclass
+class Subscription:
+    loop: asyncio.AbstractEventLoop
+    queue: asyncio.Queue
+    overflowed: bool = False
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+    async def get(self, timeout: float) -> Optional[Event]:
+        """Devuelve el siguiente evento, o None si venció el timeout."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBroker:
+    def __init__(self, history_size: int = 1000, queue_size: int = 256):
+        # El epoch distingue ids de procesos anteriores tras un reinicio y de
+        # otros workers: un cliente que reconecta a otro worker recibe un snapshot
+        self.epoch = f"{int(time.time() * 1000):x}{os.getpid():x}"
+        self.queue_size = queue_size
+        self._history: deque = deque(maxlen=history_size)
+        self._seq = 0
+        self._subscribers: List[Subscription] = []
+        self._resync_seq = -1  # Un Last-Event-ID de antes de resync_all() no puede reanudarse
+        self._lock = threading.Lock()
+
+    @property
+    def last_seq(self) -> int:
+        with self._lock:
+            return self._seq
+
+    def parse_id(self, event_id: Optional[str]) -> Optional[int]:
+        """Convierte un Last-Event-ID en secuencia local, o None si no es de este proceso."""
+        if not event_id:
+            return None
+        epoch, _, seq = event_id.strip().rpartition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def format_id(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+    def publish(self, type: str, data: Dict[str, Any]) -> Event:
+        """Publica un evento; es seguro llamarlo desde cualquier hilo."""
+        with self._lock:
+            self._seq += 1
+            event = Event(seq=self._seq, type=type, data=data, epoch=self.epoch)
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            try:
+                sub.loop.call_soon_threadsafe(self._deliver, sub, event)
+            except RuntimeError:
+                # El loop del suscriptor ya se cerró
+                self.unsubscribe(sub)
+        return event
+
+    def _deliver(self, sub: Subscription, event: Event):
+        try:
+            sub.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Cliente lento: se descartan sus deltas y se le enviará un snapshot
+            sub.overflowed = True
+
+    def events_since(self, seq: int) -> Optional[List[Event]]:
+        """Eventos posteriores a `seq`, o None si ya no están todos en el historial."""
+        with self._lock:
+            if seq > self._seq or seq <= self._resync_seq:
+                return None
+            if seq == self._seq:
+                return []
+            if not self._history or self._history[0].seq > seq + 1:
+                return None
+            return [e for e in self._history if e.seq > seq]
+
+    def resync_all(self):
+        """
+        Los deltas ya enviados no bastan (p. ej. se corrigió el índice de casos
+        activos): cada suscriptor recibe un snapshot nuevo, como si su cola se
+        hubiera desbordado. Es seguro llamarlo desde cualquier hilo.
+        """
+        with self._lock:
+            self._resync_seq = self._seq
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            try:
+                sub.loop.call_soon_threadsafe(self._force_resync, sub)
+            except RuntimeError:
+                self.unsubscribe(sub)
+
+    def _force_resync(self, sub: Subscription):
+        sub.overflowed = True
+        try:
+            sub.queue.put_nowait(None)  # Despierta al stream; el marcador se descarta con la cola
+        except asyncio.QueueFull:
+            pass
+
+    def subscribe(self, **metadata) -> Subscription:
+        sub = Subscription(
+            loop=asyncio.get_running_loop(),
+            queue=asyncio.Queue(maxsize=self.queue_size),
+            metadata=metadata,
+        )
+        with self._lock:
+            self._subscribers.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+
+def encode_event(event_id: str, type: str, data: Dict[str, Any]) -> str:
+    payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    return f"id: {event_id}\nevent: {type}\ndata: {payload}\n\n"
+
+
+def encode_comment(text: str) -> str:
+    return f": {text}\n\n"
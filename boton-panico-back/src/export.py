@@ -0,0 +1,143 @@
+"""
+Exportación del historial de tareas (tasks + tasks_archivo) para auditoría.
+
+Cada fila lleva los datos del estudiante y del mediador, el estado, la
+descripción final y los cuatro instantes del caso en ISO 8601 (hora local,
+con segundos, a diferencia de las horas HH:MM de la API).
+
+Las filas se leen por páginas cortas ordenadas por id (ver
+queries.fetch_export_page) y se codifican página por página: la memoria no
+depende del tamaño del resultado y ninguna lectura retiene un snapshot
+durante toda la descarga. Con gzip, cada página se comprime y se envía sin
+esperar al resto.
+
+    python export.py --format csv --desde 2024-01-01 --hasta 2024-06-30 > tareas.csv
+    python export.py --estado Completado --gzip > tareas.ndjson.gz
+
+La API expone lo mismo en GET /export/tasks (ver main.py).
+"""
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional
+import csv
+import io
+import json
+import sqlite3
+import zlib
+
+from queries import fetch_export_page
+from timestamps import LOCAL_TZ
+
+FORMATS = ("ndjson", "csv")
+CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+PAGE_SIZE = 1000
+
+COLUMNS = (
+    "id", "usuario_id", "codigo_estudiante", "correo_estudiante", "nombre_estudiante", "apellido_estudiante",
+    "ubicacion", "estado", "descripcion_final",
+    "mediador_id", "codigo_mediador", "correo_mediador", "mediador_nombre", "mediador_apellido",
+    "created_at", "assigned_at", "resolved_at", "completed_at", "archivada",
+)
+TIME_COLUMNS = ("created_at", "assigned_at", "resolved_at", "completed_at")
+
+
+def _iso(ms: Optional[int]) -> Optional[str]:
+    # created_at = 0 marca filas heredadas con fecha ilegible
+    if not ms:
+        return None
+    return datetime.fromtimestamp(ms / 1000, LOCAL_TZ).isoformat(timespec="seconds")
+
+
+def render_row(row: dict) -> dict:
+    for column in TIME_COLUMNS:
+        row[column] = _iso(row[column])
+    row["archivada"] = bool(row["archivada"])
+    return row
+
+
+# --- CODIFICACIÓN ---
+
+def encode_header(fmt: str) -> str:
+    if fmt == "csv":
+        return encode_rows(fmt, [dict(zip(COLUMNS, COLUMNS))])
+    return ""
+
+
+def _csv_value(value):
+    # Los booleanos (archivada) van como 0/1, igual que en la base, y no True/False
+    return int(value) if isinstance(value, bool) else value
+
+
+def encode_rows(fmt: str, rows: Iterable[dict]) -> str:
+    if fmt == "ndjson":
+        return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerows([_csv_value(row[column]) for column in COLUMNS] for row in rows)
+    return buffer.getvalue()
+
+
+class GzipStream:
+    """Compresor gzip incremental: cada bloque comprimido se puede enviar de inmediato."""
+
+    def __init__(self, level: int = 6):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, text: str) -> bytes:
+        # Z_SYNC_FLUSH: el cliente puede descomprimir lo recibido sin esperar al final
+        return self._compressor.compress(text.encode()) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def iter_export(
+    conn: sqlite3.Connection,
+    fmt: str,
+    estado: Optional[str] = None,
+    start_ms: Optional[int] = None,
+    end_ms: Optional[int] = None,
+    page_size: int = PAGE_SIZE,
+) -> Iterator[str]:
+    """Encabezado y páginas ya codificadas; la versión síncrona de GET /export/tasks."""
+    yield encode_header(fmt)
+    after_id = 0
+    while True:
+        rows: List[dict] = fetch_export_page(conn, after_id, page_size, estado, start_ms, end_ms)
+        if not rows:
+            return
+        after_id = rows[-1]["id"]
+        yield encode_rows(fmt, (render_row(row) for row in rows))
+        if len(rows) < page_size:
+            return
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
+    from datetime import date, timedelta
+    from dotenv import load_dotenv
+    from database import ConnectionPool
+    from timestamps import local_date_start
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Exportación del historial de tareas")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--estado")
+    parser.add_argument("--desde", type=date.fromisoformat, help="Fecha local de creación, inclusive")
+    parser.add_argument("--hasta", type=date.fromisoformat, help="Fecha local de creación, inclusive")
+    parser.add_argument("--gzip", action="store_true")
+    args = parser.parse_args()
+
+    start_ms = local_date_start(args.desde) if args.desde else None
+    end_ms = local_date_start(args.hasta + timedelta(days=1)) if args.hasta else None
+    pool = ConnectionPool(os.getenv("DATABASE_URL", "db/isaa.db"), max_size=1)
+    gzip = GzipStream() if args.gzip else None
+    out = sys.stdout.buffer
+    with pool.connection() as conn:
+        for chunk in iter_export(conn, args.format, args.estado, start_ms, end_ms):
+            out.write(gzip.compress(chunk) if gzip else chunk.encode())
+    if gzip:
+        out.write(gzip.close())
+    out.flush()
+    pool.close()
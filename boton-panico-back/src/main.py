@@ -1,21 +1,45 @@
 from typing import List, Optional, Dict, Any, Union, Annotated
-from contextlib import contextmanager
-from fastapi import FastAPI, HTTPException, Query, Depends, status, Response, Form
+from fastapi import FastAPI, HTTPException, Query, Depends, status, Response, Form, Request, Header
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel, validator, Field, EmailStr
+from pydantic import BaseModel, field_validator, Field, EmailStr, TypeAdapter
 import sqlite3
 import os
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import zoneinfo
 import jwt
 from passlib.context import CryptContext
 import logging
 from enum import Enum
 import json
+import io
+import tempfile
+import asyncio
 import uvicorn
 import zoneinfo
+from database import ConnectionPool, PoolTimeoutError
+from async_db import AsyncDatabase, QueryTimeoutError, run_to_completion
+from metrics import Registry, MetricsMiddleware, FAST_BUCKETS
+from slowlog import SlowQueryLog, connection_factory
+from events import EventBroker, encode_comment, encode_event
+from versions import ChangeTracker, etag_matches
+from cache import TTLCache
+from workers import BoundedWorkerPool, WorkerPoolSaturated
+from ratelimit import ConcurrencyLimiter, RateLimitMiddleware, TokenBucketLimiter
+import transitions
+from queries import InvalidCursor
+from timestamps import LOCAL_TZ, now_ms, local_date_start
+from active_index import ActiveTaskIndex
+from dispatcher import Dispatcher
+from bus import ChangeBus
+from storage import BACKENDS, DuplicateUser, MemoryStorage, SQLiteStorage
+import archive
+import export
+import refresh_tokens
+import rollups
+import user_import
 
 # CONFIGURACIÓN INICIAL Y CONSTANTES
 logging.basicConfig(
@@ -29,15 +53,201 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+# Vigencia de la sesión sin actividad; cada renovación la extiende (ver refresh_tokens.py)
+REFRESH_TOKEN_EXPIRE_DAYS = float(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+REFRESH_REUSE_GRACE_SECONDS = float(os.getenv("REFRESH_REUSE_GRACE_SECONDS", "10"))
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")  # sqlite | memory (ver storage/)
 DATABASE_URL = os.getenv("DATABASE_URL", "db/isaa.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_POOL_HEALTH_CHECK_SECONDS = float(os.getenv("DB_POOL_HEALTH_CHECK_SECONDS", "30"))
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", str(DB_POOL_SIZE)))
+DB_QUERY_TIMEOUT_SECONDS = float(os.getenv("DB_QUERY_TIMEOUT_SECONDS", "5"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))  # 0 = desactivado
+SLOW_QUERY_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_SAMPLE_RATE", "1"))
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+ACTIVE_INDEX_ENABLED = os.getenv("ACTIVE_INDEX_ENABLED", "1") == "1"
+ACTIVE_INDEX_RECONCILE_SECONDS = float(os.getenv("ACTIVE_INDEX_RECONCILE_SECONDS", "30"))
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))  # 0 = no archivar
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "600"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", "2"))
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", "32"))
+SEED_DEMO_USERS = os.getenv("SEED_DEMO_USERS", "0") == "1"
+DISPATCH_MODE = os.getenv("DISPATCH_MODE", "manual")  # manual | auto (ver dispatcher.py)
+DISPATCH_SWEEP_SECONDS = float(os.getenv("DISPATCH_SWEEP_SECONDS", "5"))
+WORKERS = int(os.getenv("WORKERS", "1"))  # Lo fija serve.py; con más de uno se activa el bus de cambios
+CHANGE_BUS_POLL_MS = float(os.getenv("CHANGE_BUS_POLL_MS", "50"))
+CHANGE_BUS_RETENTION_SECONDS = float(os.getenv("CHANGE_BUS_RETENTION_SECONDS", "300"))
+IMPORT_HASH_WORKERS = int(os.getenv("IMPORT_HASH_WORKERS", "0")) or os.cpu_count() or 1  # 0 = un proceso por núcleo
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+# Costo bcrypt de los usuarios importados; si es menor, se re-hashean con BCRYPT_ROUNDS al iniciar sesión
+IMPORT_BCRYPT_ROUNDS = int(os.getenv("IMPORT_BCRYPT_ROUNDS", "0")) or BCRYPT_ROUNDS
+IMPORT_SPOOL_MAX_MEMORY = 8 * 1024 * 1024  # Cuerpos más grandes se copian a disco
+# Fichas por segundo y ráfaga por usuario (sub del JWT); 0 = sin límite (ver ratelimit.py)
+RATE_LIMIT_READ_PER_SECOND = float(os.getenv("RATE_LIMIT_READ_PER_SECOND", "2"))
+RATE_LIMIT_READ_BURST = float(os.getenv("RATE_LIMIT_READ_BURST", "20"))
+RATE_LIMIT_WRITE_PER_SECOND = float(os.getenv("RATE_LIMIT_WRITE_PER_SECOND", "0.5"))
+RATE_LIMIT_WRITE_BURST = float(os.getenv("RATE_LIMIT_WRITE_BURST", "10"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", str(4 * DB_POOL_SIZE)))  # 0 = sin tope
 
 if not SECRET_KEY:
     raise ValueError("SECRET_KEY no configurada en .env")
+if DISPATCH_MODE not in ("manual", "auto"):
+    raise ValueError("DISPATCH_MODE debe ser 'manual' o 'auto'")
+if STORAGE_BACKEND not in BACKENDS:
+    raise ValueError(f"STORAGE_BACKEND debe ser uno de: {', '.join(BACKENDS)}")
+if STORAGE_BACKEND == "memory" and WORKERS > 1:
+    raise ValueError("STORAGE_BACKEND=memory no se comparte entre procesos: use WORKERS=1")
 
 # CONFIGURACIÓN DE SEGURIDAD
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Los hashes con un costo distinto a BCRYPT_ROUNDS se re-hashean al iniciar sesión
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# MÉTRICAS (GET /metrics, formato de texto de Prometheus)
+metrics = Registry()
+http_requests = metrics.counter(
+    "isaa_http_requests_total", "Peticiones HTTP atendidas", ["method", "route", "status"]
+)
+http_latency = metrics.histogram(
+    "isaa_http_request_duration_seconds", "Latencia hasta enviar los encabezados, por ruta", ["method", "route"]
+)
+http_in_flight = metrics.gauge("isaa_http_requests_in_flight", "Peticiones (y streams) en curso")
+db_acquire_seconds = metrics.histogram(
+    "isaa_db_connection_acquire_seconds", "Tiempo para obtener una conexión del pool", buckets=FAST_BUCKETS
+)
+db_query_seconds = metrics.histogram(
+    "isaa_db_query_duration_seconds", "Tiempo de ejecución por consulta nombrada", ["query"], buckets=FAST_BUCKETS
+)
+password_seconds = metrics.histogram(
+    "isaa_password_hash_seconds", "Tiempo de bcrypt por operación", ["operation"]
+)
+task_queue = metrics.gauge("isaa_tasks", "Tareas abiertas por estado (leído en cada scrape)", ["estado"])
+busy_mediators = metrics.gauge("isaa_busy_mediators", "Mediadores con un caso asignado (leído en cada scrape)")
+
+# bcrypt bloquea decenas de ms: se ejecuta fuera del event loop, con cola acotada
+password_pool = BoundedWorkerPool(
+    max_workers=PASSWORD_WORKERS,
+    max_pending=PASSWORD_MAX_PENDING,
+    name="bcrypt",
+    on_complete=lambda operation, seconds: password_seconds.observe(seconds, operation=operation),
+)
+
+# REGISTRO DE CONSULTAS LENTAS (opt-in con SLOW_QUERY_MS > 0)
+slow_query_log = SlowQueryLog(SLOW_QUERY_MS, sample_rate=SLOW_QUERY_SAMPLE_RATE) if SLOW_QUERY_MS > 0 else None
+
+# POOL DE CONEXIONES (las conexiones se abren bajo demanda hasta DB_POOL_SIZE)
+db_pool = ConnectionPool(
+    DATABASE_URL,
+    max_size=DB_POOL_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    busy_timeout_ms=DB_BUSY_TIMEOUT_MS,
+    health_check_interval=DB_POOL_HEALTH_CHECK_SECONDS,
+    on_acquire=lambda seconds: db_acquire_seconds.observe(seconds),
+    factory=connection_factory(slow_query_log) if slow_query_log else sqlite3.Connection,
+)
+
+# CONSULTAS DESDE ENDPOINTS ASYNC (hilos propios, tiempo máximo por consulta)
+db = AsyncDatabase(
+    db_pool,
+    max_workers=DB_EXECUTOR_WORKERS,
+    timeout=DB_QUERY_TIMEOUT_SECONDS,
+    on_query=lambda query, seconds: db_query_seconds.observe(seconds, query=query),
+)
+
+# ALMACENAMIENTO (los endpoints no escriben SQL; ver storage/)
+storage = SQLiteStorage(db) if STORAGE_BACKEND == "sqlite" else MemoryStorage()
+
+# BUS DE EVENTOS PARA EL STREAM DE CASOS ACTIVOS
+task_events = EventBroker()
+
+# VERSIONES DE LA TABLA DE TAREAS (ETag de los endpoints de lectura)
+task_versions = ChangeTracker()
+
+# COLA DE CASOS ACTIVOS EN MEMORIA (/search y snapshot del stream sin consultar SQLite)
+def on_active_index_corrected(differences: int):
+    """El índice difería del almacenamiento: el ETag de /search y los clientes del stream mostraban la cola vieja."""
+    task_versions.bump()
+    task_events.resync_all()
+
+active_index = ActiveTaskIndex(on_corrected=on_active_index_corrected)
+active_index_task: Optional[asyncio.Task] = None
+
+# ARCHIVO DE TAREAS COMPLETADAS (tarea de fondo, ver archive.py)
+archiver_task: Optional[asyncio.Task] = None
+archiver_stats: Dict[str, Any] = {"archived": 0, "runs": 0, "last_run_at": None}
+tasks_archived = metrics.counter("isaa_tasks_archived_total", "Tareas movidas a tasks_archivo")
+
+# ASIGNACIÓN AUTOMÁTICA (DISPATCH_MODE=auto, ver dispatcher.py); se crea más abajo
+dispatcher: Optional[Dispatcher] = None
+dispatcher_task: Optional[asyncio.Task] = None
+tasks_dispatched = metrics.counter("isaa_tasks_dispatched_total", "Tareas asignadas por el despachador automático")
+
+# CAMBIOS ENTRE WORKERS (WORKERS > 1, ver bus.py); los handlers se registran más abajo
+change_bus: Optional[ChangeBus] = None
+change_bus_task: Optional[asyncio.Task] = None
+change_gap_task: Optional[asyncio.Task] = None  # Recuperación tras perder cambios (on_change_gap)
+
+# TOKENS DE RENOVACIÓN (POST /token/refresh, ver refresh_tokens.py)
+refresh_purge_task: Optional[asyncio.Task] = None
+token_refreshes = metrics.counter(
+    "isaa_token_refresh_total", "Renovaciones de access token por resultado", ["result"]
+)
+
+# CACHÉ DE USUARIOS AUTENTICADOS (por 'codigo', invalidable también por 'id')
+user_cache = TTLCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+# LÍMITES DE CARGA (cubetas por usuario y tope de peticiones en curso; el middleware se registra más abajo)
+read_limiter = (
+    TokenBucketLimiter(RATE_LIMIT_READ_PER_SECOND, RATE_LIMIT_READ_BURST, max_keys=RATE_LIMIT_MAX_KEYS)
+    if RATE_LIMIT_READ_PER_SECOND > 0 else None
+)
+write_limiter = (
+    TokenBucketLimiter(RATE_LIMIT_WRITE_PER_SECOND, RATE_LIMIT_WRITE_BURST, max_keys=RATE_LIMIT_MAX_KEYS)
+    if RATE_LIMIT_WRITE_PER_SECOND > 0 else None
+)
+request_limiter = ConcurrencyLimiter(MAX_CONCURRENT_REQUESTS) if MAX_CONCURRENT_REQUESTS > 0 else None
+
+# Contadores que ya llevan los componentes: se leen al renderizar /metrics
+metrics.callback("isaa_db_pool_connections", "Conexiones del pool por estado",
+                 lambda: {("in_use",): db_pool.stats()["in_use"], ("idle",): db_pool.stats()["idle"]},
+                 labelnames=["state"])
+metrics.callback("isaa_db_pool_timeouts_total", "Préstamos que agotaron DB_POOL_TIMEOUT",
+                 lambda: db_pool.stats()["timeouts"], kind="counter")
+metrics.callback("isaa_db_queries_running", "Consultas ejecutándose en el executor de base de datos",
+                 lambda: db.stats()["running"])
+metrics.callback("isaa_db_query_timeouts_total", "Consultas interrumpidas por DB_QUERY_TIMEOUT_SECONDS",
+                 lambda: db.stats()["timeouts"], kind="counter")
+metrics.callback("isaa_password_queue_pending", "Operaciones bcrypt en cola o ejecutándose",
+                 lambda: password_pool.pending)
+metrics.callback("isaa_password_queue_rejected_total", "Operaciones bcrypt rechazadas por cola llena",
+                 lambda: password_pool.stats()["rejected"], kind="counter")
+metrics.callback("isaa_sse_subscribers", "Clientes conectados a /search/stream",
+                 lambda: task_events.subscriber_count())
+metrics.callback("isaa_user_cache_requests_total", "Consultas a la caché de usuarios por resultado",
+                 lambda: {("hit",): user_cache.stats()["hits"], ("miss",): user_cache.stats()["misses"]},
+                 kind="counter", labelnames=["result"])
+metrics.callback("isaa_active_index_tasks", "Tareas en el índice en memoria de casos activos",
+                 lambda: active_index.stats()["size"])
+metrics.callback("isaa_dispatch_free_mediators", "Mediadores conectados y sin caso esperando asignación",
+                 lambda: dispatcher.stats()["free_mediators"] if dispatcher else 0)
+metrics.callback("isaa_rate_limited_total", "Peticiones rechazadas con 429 por agotar la cubeta del usuario",
+                 lambda: {(budget,): limiter.stats()["limited"]
+                          for budget, limiter in (("read", read_limiter), ("write", write_limiter)) if limiter},
+                 kind="counter", labelnames=["budget"])
+metrics.callback("isaa_requests_shed_total", "Peticiones rechazadas con 503 por MAX_CONCURRENT_REQUESTS",
+                 lambda: request_limiter.stats()["rejected"] if request_limiter else 0, kind="counter")
+metrics.callback("isaa_requests_admitted_in_flight", "Peticiones en curso que cuentan para MAX_CONCURRENT_REQUESTS",
+                 lambda: request_limiter.in_flight if request_limiter else 0)
+metrics.callback("isaa_active_index_corrections_total", "Tareas corregidas en el índice al verificarlo contra SQLite",
+                 lambda: active_index.stats()["corrections"], kind="counter")
+
 # --- ENUMERACIONES Y TIPOS DE DATOS ---
 class EstadoTarea(str, Enum):
     ACTIVO = "Activo"
@@ -56,13 +266,15 @@ class Usuario(BaseModel):
     apellido: Optional[str] = None 
     caso_activo: int = 0  # <-- Añadir esta línea
     
-    @validator('codigo')
+    @field_validator('codigo')
+    @classmethod
     def codigo_no_vacio(cls, v):
         if not v or not v.strip():
             raise ValueError('El código no puede estar vacío')
         return v.strip()
     
-    @validator('correo')
+    @field_validator('correo')
+    @classmethod
     def correo_valido(cls, v):
         if not v or not v.strip():
             raise ValueError('El formato del correo no es válido')
@@ -90,7 +302,8 @@ class Task(BaseModel):
     mediador_id: Optional[int] = None 
     descripcion_final: Optional[str] = None
     
-    @validator('ubicacion')
+    @field_validator('ubicacion')
+    @classmethod
     def ubicacion_no_vacia(cls, v):
         if v is not None and not v.strip():
             raise ValueError('La ubicación no puede estar vacía')
@@ -115,9 +328,16 @@ class TaskResponse(BaseModel):
     mediador_nombre: Optional[str] = None
     mediador_apellido: Optional[str] = None
 
+# Validador/serializador compilado una sola vez para las listas de tareas
+task_list_adapter = TypeAdapter(List[TaskResponse])
+
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str = Field(..., min_length=1, max_length=256)
 
 class TokenData(BaseModel):
     codigo: Optional[str] = None
@@ -133,38 +353,70 @@ class HealthCheck(BaseModel):
 
 # --- FUNCIONES DE UTILIDAD Y HELPERS ---
 
-@contextmanager
-def get_db_connection():
-    conn = None
+async def run_db(fn, *args):
+    """
+    Llama a un método de `storage` y traduce los errores de la base de datos
+    a HTTPException (503 si está ocupada, 500 si falló).
+    """
     try:
-        conn = sqlite3.connect(DATABASE_URL)
-        conn.row_factory = sqlite3.Row
-        yield conn
+        return await fn(*args)
+    except PoolTimeoutError as e:
+        logger.error(f"Pool de conexiones agotado: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Base de datos ocupada, intente de nuevo",
+            headers={"Retry-After": "1"},
+        )
+    except QueryTimeoutError as e:
+        logger.error(f"Consulta interrumpida por tiempo: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Base de datos ocupada, intente de nuevo",
+            headers={"Retry-After": "1"},
+        )
     except sqlite3.Error as e:
         logger.error(f"Error de base de datos: {e}")
-        if conn:
-            conn.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error de conexión a la base de datos"
         )
-    finally:
-        if conn:
-            conn.close()
 
-def get_current_local_date_time():
-    try:
-        tz = zoneinfo.ZoneInfo("America/Mexico_City")
-        now = datetime.now(tz)
-        fecha = now.strftime("%d/%m/%Y")
-        hora = now.strftime("%H:%M")
-        return fecha, hora
-    except Exception as e:
-        logger.warning(f"Error al obtener fecha con ZoneInfo (fallback a UTC-6): {e}")
-        mexico_time = datetime.utcnow() - timedelta(hours=6)
-        fecha = mexico_time.strftime("%d/%m/%Y")
-        hora = mexico_time.strftime("%H:%M")
-        return fecha, hora
+def conditional_response(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """
+    Fija el ETag de la respuesta. Si el cliente ya tiene esa versión devuelve
+    un 304 listo para retornar; si no, None y el endpoint sigue normalmente.
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
+
+def check_pagination(offset: int, after: Optional[str]):
+    if after and offset:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use 'after' u 'offset', no ambos"
+        )
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]):
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+
+def task_list_response(rows: List[dict], response: Response) -> Response:
+    """
+    Lista de tareas serializada directo a JSON: valida las filas una sola vez
+    con task_list_adapter y escribe los bytes, sin que FastAPI vuelva a validar
+    contra response_model ni pase por jsonable_encoder + json.dumps. La salida
+    es idéntica byte a byte (compacta, UTF-8 sin escapar).
+    """
+    # Al devolver un Response propio FastAPI ignora el `response` inyectado:
+    # se copian sus cabeceras (ETag, Cache-Control, X-Next-Cursor).
+    return Response(
+        content=task_list_adapter.dump_json(task_list_adapter.validate_python(rows)),
+        media_type="application/json",
+        headers=dict(response.headers),
+    )
 
 # --- FUNCIONES DE AUTENTICACIÓN Y SEGURIDAD ---
 
@@ -177,25 +429,75 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def get_user(codigo: str):
+def verify_and_update_password(plain_password, hashed_password):
+    """Devuelve (válida, hash_nuevo); hash_nuevo no es None si el hash debe actualizarse."""
+    try:
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+    except Exception:
+        return False, None
+
+async def run_password_task(fn, *args):
+    try:
+        return await password_pool.run(fn, *args)
+    except WorkerPoolSaturated as e:
+        logger.warning(f"Pool de contraseñas saturado: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Demasiadas solicitudes en este momento, intente de nuevo en unos segundos",
+            headers={"Retry-After": "1"},
+        )
+
+async def get_user(codigo: str):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM usuarios WHERE codigo = ?", (codigo,))
-            user = cursor.fetchone()
-            return dict(user) if user else None
+        return await run_db(storage.get_user_by_codigo, codigo)
+    except HTTPException:
+        # Base de datos ocupada: mejor 503 que un 401 engañoso
+        raise
     except Exception as e:
         logger.error(f"Error al obtener usuario: {e}")
         return None
 
-def authenticate_user(codigo: str, password: str):
-    user = get_user(codigo)
+async def get_cached_user(codigo: str):
+    user = user_cache.get(codigo)
+    if user is None:
+        # Si una transición invalida al usuario durante la lectura, la fila no se guarda
+        generation = user_cache.generation()
+        user = await get_user(codigo)
+        if user is not None:
+            user_cache.set(codigo, user, alias=user["id"], generation=generation)
+    return user
+
+def invalidate_cached_users(*usuario_ids: int):
+    """Debe llamarse tras cambiar 'caso_activo' o datos de perfil de un usuario."""
+    for usuario_id in usuario_ids:
+        user_cache.invalidate_alias(usuario_id)
+
+async def update_password_hash(usuario_id: int, new_hash: str):
+    await run_db(storage.update_password_hash, usuario_id, new_hash)
+    invalidate_cached_users(usuario_id)
+
+async def authenticate_user(codigo: str, password: str):
+    user = await get_user(codigo)
     if not user:
         return False
-    if not verify_password(password, user["contrasena"]):
+    valid, new_hash = await run_password_task(verify_and_update_password, password, user["contrasena"])
+    if not valid:
         return False
+    if new_hash:
+        # Re-hash transparente (p. ej. tras cambiar BCRYPT_ROUNDS)
+        try:
+            await update_password_hash(user["id"], new_hash)
+        except Exception as e:
+            logger.warning(f"No se pudo actualizar el hash del usuario {user['id']}: {e}")
     return user
 
+def token_subject(token: str) -> Optional[str]:
+    """`sub` de un access token válido, o None (para las cubetas de RateLimitMiddleware)."""
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except jwt.PyJWTError:
+        return None
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -229,7 +531,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         logger.error(f"Error decodificando token: {e}")
         raise credentials_exception
     
-    user = get_user(codigo=token_data.codigo)
+    user = await get_cached_user(token_data.codigo)
     if user is None:
         raise credentials_exception
     return user
@@ -242,179 +544,33 @@ def get_current_mediador(current_user: dict = Depends(get_current_user)):
         )
     return current_user
 
-def get_task_details(db_conn: sqlite3.Connection, task_id: int) -> Optional[dict]:
-    """
-    Helper function to retrieve detailed task information, including user and mediator details.
+def get_current_admin(current_user: dict = Depends(get_current_user)):
+    if current_user.get("rol") != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Acceso restringido a administradores"
+        )
+    return current_user
+
+def get_current_staff(current_user: dict = Depends(get_current_user)):
+    if current_user.get("rol") not in ("mediador", "admin"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Acceso restringido a mediadores y administradores"
+        )
+    return current_user
+
+# --- INICIALIZACIÓN DE BASE DE DATOS ---
+async def init_db():
     """
-    query = """
-        SELECT 
-            t.id, t.usuario_id, 
-            u.codigo as codigo_estudiante, u.correo as correo_estudiante,
-            u.nombre as nombre_estudiante, u.apellido as apellido_estudiante,
-            t.ubicacion, t.estado, t.fecha, t.hora_creacion, 
-            t.hora_asignacion, t.hora_resolucion, t.hora_completado,
-            t.mediador_id, t.descripcion_final,
-            m.correo as mediador_correo
-        FROM tasks t
-        JOIN usuarios u ON t.usuario_id = u.id
-        LEFT JOIN usuarios m ON t.mediador_id = m.id
-        WHERE t.id = ?
+    Prepara el almacenamiento: en SQLite aplica las migraciones pendientes
+    (ver migrations.py); si el esquema está al día solo cuesta una consulta.
+    Los usuarios de prueba se crean solo con SEED_DEMO_USERS=1 o con
+    `python migrations.py seed`.
     """
-    cursor = db_conn.cursor()
-    cursor.execute(query, (task_id,))
-    task_data = cursor.fetchone()
-    
-    if task_data:
-        return dict(task_data)
-    return None
-
-# --- INICIALIZACIÓN DE BASE DE DATOS (MODIFICADA) ---
-def init_db():
     try:
-        os.makedirs("db", exist_ok=True)
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-
-            # Tabla de usuarios
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='usuarios'")
-            users_table_exists = cursor.fetchone()
-            if not users_table_exists:
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS usuarios (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        rol TEXT DEFAULT 'usuario',
-                        codigo TEXT UNIQUE NOT NULL,
-                        correo TEXT NOT NULL,
-                        contrasena TEXT NOT NULL,
-                        nombre TEXT, 
-                        apellido TEXT,
-                        caso_activo INTEGER NOT NULL DEFAULT 0
-                    )
-                """)
-                logger.info("Tabla 'usuarios' creada")
-            else:
-                # Migración: Añadir nombre y apellido si no existen
-                cursor.execute("PRAGMA table_info(usuarios)")
-                columns = [column[1] for column in cursor.fetchall()]
-                if 'nombre' not in columns:
-                    cursor.execute("ALTER TABLE usuarios ADD COLUMN nombre TEXT")
-                    logger.info("Columna 'nombre' agregada a usuarios")
-                if 'apellido' not in columns:
-                    cursor.execute("ALTER TABLE usuarios ADD COLUMN apellido TEXT")
-                    logger.info("Columna 'apellido' agregada a usuarios")
-
-            # --- Bloque de Reseteo y Creación de Usuarios (CON NOMBRES) ---
-            common_pass_hash = get_password_hash("a") 
-
-            # 2. Mediador 1 (Apoyo)
-            cursor.execute(
-                '''
-                INSERT OR REPLACE INTO usuarios (id, rol, codigo, correo, contrasena, nombre, apellido) 
-                VALUES (
-                    (SELECT id FROM usuarios WHERE codigo = 'mediador1'),
-                    'mediador', 'mediador1', 'mediador1@isaa.com', ?, 'Mediador', 'Saul'
-                )
-                ''',
-                (common_pass_hash,)
-            )
-            logger.info("Usuario 'mediador1' restablecido.")
-            
-            # 3. Mediador 2 (Otro Apoyo para probar el dropdown)
-            cursor.execute(
-                '''
-                INSERT OR REPLACE INTO usuarios (id, rol, codigo, correo, contrasena, nombre, apellido) 
-                VALUES (
-                    (SELECT id FROM usuarios WHERE codigo = 'mediador2'),
-                    'mediador', 'mediador2', 'mediador2@isaa.com', ?, 'Mediador', 'Juan'
-                )
-                ''',
-                (common_pass_hash,)
-            )
-            logger.info("Usuario 'mediador2' (nuevo) creado.")
-
-            # 4. Usuario Estudiante
-            cursor.execute(
-                '''
-                INSERT OR REPLACE INTO usuarios (id, rol, codigo, correo, contrasena, nombre, apellido) 
-                VALUES (
-                    (SELECT id FROM usuarios WHERE codigo = '222000000'),
-                    'usuario', '222000000', 'alberich@alumno.com', ?, 'Alberich', 'Leal'
-                )
-                ''',
-                (common_pass_hash,)
-            )
-            logger.info("Usuario 'estudiante' restablecido.")
-            
-            # 5. Admin (Futuro, sin uso actual)
-            cursor.execute(
-                '''
-                INSERT OR REPLACE INTO usuarios (id, rol, codigo, correo, contrasena, nombre, apellido) 
-                VALUES (
-                    (SELECT id FROM usuarios WHERE codigo = 'admin'),
-                    'admin', 'admin', 'admin@isaa.com', ?, 'Admin', 'ISAA'
-                )
-                ''',
-                (common_pass_hash,)
-            )
-            logger.info("Usuario 'admin' (futuro) (re)establecido.")
-            
-            # --- FIN DEL BLOQUE DE RESISTENCIA ---
-
-            # Tabla de tareas/reportes (MODIFICADA)
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='tasks'")
-            tasks_table_exists = cursor.fetchone()
-
-            if not tasks_table_exists:
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS tasks (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        usuario_id INTEGER NOT NULL,
-                        ubicacion TEXT NOT NULL,
-                        estado TEXT NOT NULL,
-                        fecha TEXT NOT NULL,
-                        hora_creacion TEXT NOT NULL, -- Renombrada desde 'hora'
-                        hora_asignacion TEXT,
-                        hora_resolucion TEXT,        -- ¡NUEVA COLUMNA!
-                        hora_completado TEXT,
-                        mediador_id INTEGER,
-                        descripcion_final TEXT,
-                        FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
-                        FOREIGN KEY (mediador_id) REFERENCES usuarios (id)
-                    );
-                """)
-                logger.info("Tabla 'tasks' creada con el nuevo esquema")
-            else:
-                # Script de migración (Añadir columnas si no existen)
-                cursor.execute("PRAGMA table_info(tasks)")
-                columns = [column[1] for column in cursor.fetchall()]
-                
-                if 'ubicacion' not in columns:
-                    cursor.execute("ALTER TABLE tasks ADD COLUMN ubicacion TEXT")
-                if 'hora_asignacion' not in columns:
-                    cursor.execute("ALTER TABLE tasks ADD COLUMN hora_asignacion TEXT")
-                if 'hora_completado' not in columns:
-                    cursor.execute("ALTER TABLE tasks ADD COLUMN hora_completado TEXT")
-                if 'mediador_id' not in columns:
-                    cursor.execute("ALTER TABLE tasks ADD COLUMN mediador_id INTEGER REFERENCES usuarios(id)")
-                if 'descripcion_final' not in columns:
-                    cursor.execute("ALTER TABLE tasks ADD COLUMN descripcion_final TEXT")
-
-            # Crear índices para optimizar rendimiento
-            indices = [
-                ("idx_tasks_usuario_id", "CREATE INDEX IF NOT EXISTS idx_tasks_usuario_id ON tasks(usuario_id)"),
-                ("idx_usuarios_codigo", "CREATE INDEX IF NOT EXISTS idx_usuarios_codigo ON usuarios(codigo)"),
-                ("idx_usuarios_correo", "CREATE INDEX IF NOT EXISTS idx_usuarios_correo ON usuarios(correo)"),
-                ("idx_tasks_mediador_id", "CREATE INDEX IF NOT EXISTS idx_tasks_mediador_id ON tasks(mediador_id)"),
-                ("idx_tasks_estado", "CREATE INDEX IF NOT EXISTS idx_tasks_estado ON tasks(estado)")
-            ]
-            
-            for index_name, create_sql in indices:
-                cursor.execute(f"SELECT name FROM sqlite_master WHERE type='index' AND name='{index_name}'")
-                if not cursor.fetchone():
-                    cursor.execute(create_sql)
-            
-            conn.commit()
-            logger.info("Base de datos inicializada correctamente")
+        summary = await storage.initialize(get_password_hash if SEED_DEMO_USERS else None)
+        logger.info(f"Almacenamiento {storage.name} inicializado correctamente ({summary})")
     except Exception as e:
         logger.error(f"Error al inicializar la base de datos: {e}")
         raise HTTPException(
@@ -425,20 +581,217 @@ def init_db():
 # --- INICIALIZACIÓN DE FASTAPI ---
 app = FastAPI(title="ISAA API - Task Manager", version="2.0.0")
 
+# Dentro de CORS (los 429/503 llevan sus encabezados) y de las métricas (se cuentan por estado)
+app.add_middleware(
+    RateLimitMiddleware,
+    identify=token_subject,
+    read_limiter=read_limiter,
+    write_limiter=write_limiter,
+    concurrency=request_limiter,
+    never_shed=[("POST", "/my-tasks/")],  # El botón de pánico
+    exclude=["/health", "/health/stats", "/metrics"],
+    uncounted=["/search/stream", "/token"],  # /token ya se limita con PASSWORD_MAX_PENDING
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
+app.add_middleware(
+    MetricsMiddleware,
+    requests=http_requests,
+    latency=http_latency,
+    in_flight=http_in_flight,
+    exclude=["/metrics"],
+)
+
+async def reconcile_active_index() -> int:
+    generation = active_index.generation
+    return active_index.reconcile(await storage.all_active_tasks(), generation)
+
+async def reconcile_active_index_loop():
+    """Verifica el índice de casos activos contra el almacenamiento cada ACTIVE_INDEX_RECONCILE_SECONDS."""
+    while True:
+        await asyncio.sleep(ACTIVE_INDEX_RECONCILE_SECONDS)
+        try:
+            await reconcile_active_index()
+        except Exception as e:
+            logger.error(f"Error al verificar el índice de casos activos: {e}")
+
+async def archive_loop():
+    """Cada ARCHIVE_INTERVAL_SECONDS mueve por lotes las tareas completadas hace más de ARCHIVE_AFTER_DAYS."""
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+        cutoff = archive.cutoff_ms(ARCHIVE_AFTER_DAYS, now_ms())
+        total = 0
+        try:
+            while True:
+                moved = await storage.archive_completed(cutoff, ARCHIVE_BATCH_SIZE)
+                if not moved:
+                    break
+                total += moved
+                tasks_archived.inc(moved)
+                await asyncio.sleep(0.01)
+        except Exception as e:
+            logger.error(f"Error al archivar tareas completadas: {e}")
+        archiver_stats["archived"] += total
+        archiver_stats["runs"] += 1
+        archiver_stats["last_run_at"] = datetime.now().isoformat(timespec="seconds")
+        if total:
+            logger.info(f"Archivadas {total} tareas completadas hace más de {ARCHIVE_AFTER_DAYS} días")
+
+async def purge_refresh_tokens_loop():
+    """Borra cada hora los tokens de renovación vencidos."""
+    while True:
+        try:
+            purged = await storage.purge_refresh_tokens(now_ms())
+            if purged:
+                logger.info(f"Borrados {purged} tokens de renovación vencidos")
+        except Exception as e:
+            logger.error(f"Error al borrar tokens de renovación vencidos: {e}")
+        await asyncio.sleep(3600)
+
+async def dispatch_next(mediador_id: int) -> Optional[dict]:
+    return await storage.dispatch_next(mediador_id, now_ms())
+
+def notify_dispatched(task_data: dict):
+    """Lo mismo que hace assign_task_to_self después del COMMIT, más el aviso al mediador."""
+    tasks_dispatched.inc()
+    publish_change("task_dispatched", task_data)
+
+if DISPATCH_MODE == "auto":
+    dispatcher = Dispatcher(dispatch_next, notify_dispatched, DISPATCH_SWEEP_SECONDS)
+
+# --- CAMBIOS DE TAREAS (ESTE WORKER Y LOS DEMÁS) ---
+# Cada escritura, después del COMMIT, llama a publish_change con la fila de
+# la tarea (run_transition, aunque la petición se cancele). El handler actualiza cachés, índice, ETags, stream y despachador
+# de este proceso; con varios workers el bus lo repite en los demás.
+
+def on_task_created(task_data: dict):
+    invalidate_cached_users(task_data["usuario_id"])
+    active_index.add(task_data)
+    task_versions.bump(task_data["usuario_id"])
+    task_events.publish("task_created", TaskResponse(**task_data).model_dump(mode="json"))
+    if dispatcher:
+        dispatcher.task_available()
+
+def on_task_assigned(task_data: dict):
+    mediador_id = task_data["mediador_id"]
+    invalidate_cached_users(mediador_id)
+    active_index.remove(task_data["id"])
+    if dispatcher:
+        dispatcher.mark_busy(mediador_id)
+    task_versions.bump(task_data["usuario_id"], mediador_id)
+    task_events.publish("task_assigned", {"id": task_data["id"], "mediador_id": mediador_id})
+
+def on_task_dispatched(task_data: dict):
+    on_task_assigned(task_data)
+    task_events.publish("task_dispatched", TaskResponse(**task_data).model_dump(mode="json"))
+
+def on_task_resolved(task_data: dict):
+    invalidate_cached_users(task_data["usuario_id"], task_data["mediador_id"])
+    task_versions.bump(task_data["usuario_id"], task_data["mediador_id"])
+    if dispatcher:
+        dispatcher.mark_free(task_data["mediador_id"])
+
+def on_task_completed(task_data: dict):
+    task_versions.bump(task_data["usuario_id"])
+
+CHANGE_HANDLERS = {
+    "task_created": on_task_created,
+    "task_assigned": on_task_assigned,
+    "task_dispatched": on_task_dispatched,
+    "task_resolved": on_task_resolved,
+    "task_completed": on_task_completed,
+}
+
+def publish_change(kind: str, task_data: dict):
+    CHANGE_HANDLERS[kind](task_data)
+    if change_bus:
+        change_bus.publish(kind, task_data)
+
+async def run_transition(kind: str, fn, *args) -> dict:
+    """
+    Ejecuta una transición de `storage` (run_db) y publica el cambio en cuanto
+    hace COMMIT, aunque la petición se cancele mientras tanto: la escritura no
+    se interrumpe y el índice, los ETag, el stream y el despachador se enteran.
+    """
+    return await run_to_completion(run_db(fn, *args), lambda task_data: publish_change(kind, task_data))
+
+async def recover_from_change_gap():
+    """
+    Primero reconstruye el índice de casos activos y solo después invalida los
+    ETag y fuerza un snapshot en los streams: si se invalidaran antes, un
+    cliente que consulte mientras se verifica el índice recibiría un ETag
+    nuevo para datos todavía desfasados y luego 304 con esos mismos datos.
+    """
+    if ACTIVE_INDEX_ENABLED:
+        try:
+            await reconcile_active_index()
+        except Exception as e:
+            logger.error(f"Error al verificar el índice de casos activos tras perder cambios: {e}")
+    task_versions.reset()
+    task_events.resync_all()
+    if dispatcher:
+        dispatcher.task_available()
+
+def on_change_gap():
+    """Se perdieron cambios de otros workers: todo lo que hay en memoria puede estar desfasado."""
+    global change_gap_task
+    user_cache.clear()
+    change_gap_task = asyncio.create_task(recover_from_change_gap())
+
+if WORKERS > 1:
+    change_bus = ChangeBus(
+        DATABASE_URL,
+        poll_interval=CHANGE_BUS_POLL_MS / 1000,
+        retention_seconds=CHANGE_BUS_RETENTION_SECONDS,
+        busy_timeout_ms=DB_BUSY_TIMEOUT_MS,
+        on_gap=on_change_gap,
+    )
+    for kind, handler in CHANGE_HANDLERS.items():
+        change_bus.on(kind, handler)
+
 @app.on_event("startup")
 async def startup_event():
+    global active_index_task, archiver_task, dispatcher_task, refresh_purge_task, change_bus_task
     try:
-        init_db()
+        await init_db()
     except Exception as e:
         logger.critical(f"Error crítico al iniciar la aplicación: {e}")
+    if change_bus:
+        # Antes de cargar el índice: lo que cambie desde aquí llega por el bus
+        try:
+            change_bus.open()
+            change_bus_task = asyncio.create_task(change_bus.run())
+        except Exception as e:
+            logger.critical(f"No se pudo abrir el bus de cambios entre workers: {e}")
+    if ACTIVE_INDEX_ENABLED:
+        try:
+            await reconcile_active_index()
+        except Exception as e:
+            # /search usa el almacenamiento hasta que la verificación periódica logre cargarlo
+            logger.error(f"No se pudo cargar el índice de casos activos: {e}")
+        active_index_task = asyncio.create_task(reconcile_active_index_loop())
+    if ARCHIVE_AFTER_DAYS > 0:
+        archiver_task = asyncio.create_task(archive_loop())
+    if dispatcher:
+        dispatcher_task = asyncio.create_task(dispatcher.run())
+    refresh_purge_task = asyncio.create_task(purge_refresh_tokens_loop())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in (active_index_task, archiver_task, dispatcher_task, refresh_purge_task, change_bus_task, change_gap_task):
+        if task:
+            task.cancel()
+    if change_bus:
+        change_bus.close()
+    storage.close()
 
 # --- ENDPOINTS DE AUTENTICACIÓN ---=
 @app.post("/usuarios/", response_model=UsuarioResponse, status_code=status.HTTP_201_CREATED)
@@ -449,57 +802,137 @@ async def create_user(user: Usuario):
     El rol se asigna por defecto como 'usuario'.
     """
     # Hashear la contraseña antes de guardarla
-    hashed_password = get_password_hash(user.contrasena)
+    hashed_password = await run_password_task(get_password_hash, user.contrasena)
     
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO usuarios (codigo, correo, contrasena, rol, nombre, apellido, caso_activo)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,  # <-- CAMBIO: Añadido caso_activo
-                (user.codigo, user.correo, hashed_password, 'usuario', user.nombre, user.apellido, 0)  # <-- CAMBIO: Añadido valor 0
-            )
-            conn.commit()
-            
-            # Obtener el ID del usuario recién creado
-            new_user_id = cursor.lastrowid
-            
-            # Devolver los datos del usuario creado (sin la contraseña)
-            return UsuarioResponse(
-                id=new_user_id,
-                codigo=user.codigo,
-                correo=user.correo,
-                rol='usuario',
-                nombre=user.nombre,
-                apellido=user.apellido,
-                caso_activo=0
-            )
-
-    except sqlite3.IntegrityError as e:
-        # Esto maneja el caso de que el 'codigo' (o 'correo') ya exista
-        if "UNIQUE constraint failed: usuarios.codigo" in str(e):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="El código de usuario ya está registrado."
-            )
-        elif "UNIQUE constraint failed: usuarios.correo" in str(e):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="El correo electrónico ya está registrado."
-            )
-        logger.error(f"Error de integridad de base de datos: {e}")
+        new_user_id = await run_db(
+            storage.create_user, user.codigo, user.correo, hashed_password, 'usuario', user.nombre, user.apellido
+        )
+    except DuplicateUser as e:
+        # El 'codigo' (o 'correo') ya existe
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Error en los datos proporcionados. Es posible que el código o correo ya existan."
+            detail="El código de usuario ya está registrado." if e.field == "codigo" else "El correo electrónico ya está registrado."
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error al crear usuario: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error interno del servidor al crear el usuario."
         )
+    user_cache.invalidate(user.codigo)
+
+    # Devolver los datos del usuario creado (sin la contraseña)
+    return UsuarioResponse(
+        id=new_user_id,
+        codigo=user.codigo,
+        correo=user.correo,
+        rol='usuario',
+        nombre=user.nombre,
+        apellido=user.apellido,
+        caso_activo=0
+    )
+
+# --- IMPORTACIÓN MASIVA DE USUARIOS ---
+
+# Una importación a la vez: el pool de bcrypt ya ocupa todos los núcleos
+import_lock = asyncio.Lock()
+
+class ImportFormat(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+def _import_line(event: str, **data) -> str:
+    return json.dumps({"event": event, **data}, ensure_ascii=False) + "\n"
+
+@app.post("/admin/usuarios/import", tags=["admin"], summary="Importación masiva de usuarios (CSV o NDJSON)")
+async def import_users(
+    request: Request,
+    format: Optional[ImportFormat] = None,
+    current_user: dict = Depends(get_current_admin)
+):
+    """
+    Recibe CSV con encabezado o NDJSON (por defecto según Content-Type) y
+    responde NDJSON a medida que avanza: una línea "error"
+    por registro rechazado (con su número de línea), una "progress" por lote
+    y un "summary" al final. Un registro inválido o duplicado no aborta el
+    lote. Ver user_import.py.
+    """
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = ImportFormat.NDJSON if "ndjson" in content_type or "jsonl" in content_type else ImportFormat.CSV
+    if import_lock.locked():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Ya hay una importación en curso"
+        )
+
+    # El cuerpo se copia primero a un archivo temporal: StreamingResponse escucha
+    # la desconexión con receive() y se quedaría con trozos del cuerpo si se
+    # siguiera leyendo mientras responde
+    upload = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_MAX_MEMORY)
+    async for chunk in request.stream():
+        upload.write(chunk)
+    upload.seek(0)
+    source = io.TextIOWrapper(upload, encoding="utf-8-sig", errors="replace", newline="")
+
+    importer = user_import.UserImporter(format.value)
+    records = []
+    # Leer hasta el encabezado para poder responder 400 antes de empezar el stream
+    try:
+        while not importer.ready:
+            line = source.readline()
+            if not line:
+                source.close()
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="El archivo está vacío")
+            records.extend(importer.feed(line.rstrip("\n")))
+    except user_import.ImportFormatError as e:
+        source.close()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    async def process(executor, batch):
+        rows, errors = importer.prepare(batch)
+        rows, existing = await storage.find_existing_users(rows)
+        await asyncio.to_thread(user_import.hash_passwords, executor, rows, IMPORT_BCRYPT_ROUNDS, IMPORT_HASH_WORKERS)
+        inserted, duplicated = await storage.insert_users(rows)
+        for row in inserted:
+            user_cache.invalidate(row.codigo)
+        errors += existing + duplicated
+        importer.count(len(inserted), len(errors))
+        return "".join(_import_line("error", **error) for error in errors) + _import_line("progress", **importer.stats.as_dict())
+
+    async def generate():
+        nonlocal records
+        if import_lock.locked():
+            source.close()
+            yield _import_line("aborted", error="Ya hay una importación en curso")
+            return
+        async with import_lock:
+            executor = user_import.create_hash_executor(IMPORT_HASH_WORKERS)
+            try:
+                for line in source:
+                    records.extend(importer.feed(line.rstrip("\n")))
+                    if len(records) >= IMPORT_BATCH_SIZE:
+                        batch, records = records, []
+                        yield await process(executor, batch)
+                records.extend(importer.finish())
+                if records:
+                    yield await process(executor, records)
+            except Exception as e:
+                # La respuesta ya empezó: el error va en el stream; lo insertado hasta aquí queda
+                logger.error(f"Importación de usuarios interrumpida: {e}")
+                yield _import_line("aborted", error=str(e), **importer.stats.as_dict())
+                return
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+                source.close()
+            summary = importer.stats.as_dict()
+            logger.info(f"Importación de usuarios por {current_user['codigo']}: {summary}")
+            yield _import_line("summary", **summary)
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
     
 # --- ENDPOINTS DE AUTENTICACIÓN ---
 @app.post("/token", response_model=Token)
@@ -508,7 +941,7 @@ async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends()
 ):
     try:
-        user = authenticate_user(form_data.username, form_data.password)
+        user = await authenticate_user(form_data.username, form_data.password)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -521,8 +954,9 @@ async def login_for_access_token(
             data={"sub": user["codigo"], "rol": user["rol"]},
             expires_delta=access_token_expires
         )
+        refresh_token = await run_db(storage.issue_refresh_token, user["id"], now_ms(), _refresh_ttl_ms())
         response.headers["Cache-Control"] = "no-store"
-        return {"access_token": access_token, "token_type": "bearer"}
+        return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
     except HTTPException:
         raise
     except Exception as e:
@@ -532,6 +966,49 @@ async def login_for_access_token(
             detail="Error interno del servidor al procesar la solicitud de login"
         )
 
+def _refresh_ttl_ms() -> int:
+    return int(REFRESH_TOKEN_EXPIRE_DAYS * refresh_tokens.DAY_MS)
+
+@app.post("/token/refresh", response_model=Token)
+async def refresh_access_token(body: RefreshRequest, response: Response):
+    """
+    Cambia un token de renovación por un access token nuevo y el siguiente
+    token de renovación, sin bcrypt. El token presentado deja de servir:
+    volver a usarlo revoca la sesión completa.
+    """
+    try:
+        user, refresh_token = await run_db(
+            storage.rotate_refresh_token, body.refresh_token, now_ms(), _refresh_ttl_ms(),
+            int(REFRESH_REUSE_GRACE_SECONDS * 1000),
+        )
+    except refresh_tokens.RefreshRaced:
+        # Otra pestaña lo acaba de renovar: el cliente debe tomar el token que ésta guardó
+        token_refreshes.inc(result="raced")
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="El token de renovación ya se usó hace un momento",
+        )
+    except refresh_tokens.RefreshTokenError as e:
+        token_refreshes.inc(result="reused" if isinstance(e, refresh_tokens.RefreshTokenReused) else "invalid")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Sesión expirada, inicie sesión nuevamente",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    token_refreshes.inc(result="ok")
+    access_token = create_access_token(
+        data={"sub": user["codigo"], "rol": user["rol"]},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    response.headers["Cache-Control"] = "no-store"
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+@app.post("/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_refresh_token(body: RefreshRequest):
+    """Cierra la sesión: el token y los que se emitieron a partir del mismo login dejan de servir."""
+    await run_db(storage.revoke_refresh_token, body.refresh_token, now_ms())
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
 @app.get("/me")
 async def get_me(current_user: dict = Depends(get_current_user)):
     return {
@@ -546,48 +1023,38 @@ async def get_me(current_user: dict = Depends(get_current_user)):
 
 @app.get("/my-tasks/", response_model=List[TaskResponse])
 async def read_my_tasks(
+    request: Request,
+    response: Response,
     estado: Optional[EstadoTarea] = None,
     limit: int = Query(100, ge=1, le=500),
     offset: int = Query(0, ge=0),
+    after: Optional[str] = Query(None, description="Cursor de X-Next-Cursor de la página anterior"),
     current_user: dict = Depends(get_current_user)
 ):
-    """Obtiene las tareas del usuario actual."""
+    """
+    Obtiene las tareas del usuario actual, de la más reciente a la más antigua.
+    Si hay más páginas, la cabecera X-Next-Cursor trae el valor para ?after=.
+    """
+    check_pagination(offset, after)
+    # La versión se toma antes de leer: si hay una escritura en medio, el
+    # siguiente poll verá una versión nueva y volverá a consultar.
+    version = task_versions.user_version(current_user["id"])
+    etag = task_versions.etag(f"u{current_user['id']}", version, estado, limit, offset, after)
+    not_modified = conditional_response(request, response, etag)
+    if not_modified:
+        return not_modified
+
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # --- INICIO DE LA MODIFICACIÓN ---
-            # Unimos (LEFT JOIN) la tabla de usuarios por segunda vez (como 'm')
-            # para obtener el nombre y apellido del mediador.
-            query = """
-                SELECT t.id, t.usuario_id, 
-                       u.codigo as codigo_estudiante, u.correo as correo_estudiante, 
-                       u.nombre as nombre_estudiante, u.apellido as apellido_estudiante,
-                       t.ubicacion, t.estado, t.fecha, 
-                       t.hora_creacion, -- (o 't.hora' si no lo has renombrado)
-                       t.hora_asignacion, t.hora_resolucion, t.hora_completado,
-                       t.mediador_id, t.descripcion_final,
-                       m.nombre as mediador_nombre,    -- <-- LÍNEA AÑADIDA
-                       m.apellido as mediador_apellido -- <-- LÍNEA AÑADIDA
-                FROM tasks t
-                JOIN usuarios u ON t.usuario_id = u.id
-                LEFT JOIN usuarios m ON t.mediador_id = m.id -- <-- LÍNEA AÑADIDA
-                WHERE t.usuario_id = ?
-            """
-            # --- FIN DE LA MODIFICACIÓN ---
-
-            params = [current_user["id"]]
-            
-            if estado:
-                query += " AND t.estado = ?"
-                params.append(estado.value)
-            
-            query += " ORDER BY t.fecha DESC, t.hora_creacion DESC LIMIT ? OFFSET ?" # (Ajusta 'hora_creacion' si es necesario)
-            params.extend([limit, offset])
-            
-            cursor.execute(query, tuple(params))
-            tasks = cursor.fetchall()
-            return [TaskResponse(**dict(task)) for task in tasks]
+        tasks, next_cursor = await run_db(
+            storage.list_user_tasks, current_user["id"], limit,
+            estado.value if estado else None, after, offset,
+        )
+        set_next_cursor(response, next_cursor)
+        return task_list_response(tasks, response)
+    except HTTPException:
+        raise
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor de paginación inválido")
     except Exception as e:
         logger.error(f"Error al obtener tareas del usuario: {e}")
         raise HTTPException(
@@ -598,15 +1065,14 @@ async def read_my_tasks(
 @app.get("/tasks/{task_id}", response_model=TaskResponse)
 async def read_task(task_id: int, current_user: dict = Depends(get_current_mediador)):
     try:
-        with get_db_connection() as conn:
-            task_data = get_task_details(conn, task_id)
-            
-            if task_data is None:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, 
-                    detail="Tarea no encontrada"
-                )
-            return TaskResponse(**task_data)
+        task_data = await run_db(storage.get_task, task_id)
+
+        if task_data is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, 
+                detail="Tarea no encontrada"
+            )
+        return TaskResponse(**task_data)
     except HTTPException:
         raise
     except Exception as e:
@@ -616,99 +1082,42 @@ async def read_task(task_id: int, current_user: dict = Depends(get_current_media
             detail="Error al recuperar la tarea"
         )
 
-@app.get("/my-tasks/", response_model=List[TaskResponse])
-async def read_my_tasks(
-    estado: Optional[EstadoTarea] = None,
-    limit: int = Query(100, ge=1, le=500),
-    offset: int = Query(0, ge=0),
-    current_user: dict = Depends(get_current_user)
-):
-    """Obtiene las tareas del usuario actual."""
-    try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            query = """
-                SELECT t.id, t.usuario_id, u.codigo as codigo_estudiante, u.correo as correo_estudiante, 
-                       u.nombre as nombre_estudiante, u.apellido as apellido_estudiante,
-                       t.ubicacion, t.estado, t.fecha, 
-                       t.hora_creacion,
-                       t.hora_asignacion, t.hora_completado,
-                       t.mediador_id, t.descripcion_final,
-                       m.correo as mediador_correo
-                FROM tasks t
-                JOIN usuarios u ON t.usuario_id = u.id
-                LEFT JOIN usuarios m ON t.mediador_id = m.id
-                WHERE t.usuario_id = ?
-            """
-            params = [current_user["id"]]
-            
-            if estado:
-                query += " AND t.estado = ?"
-                params.append(estado.value)
-            
-            query += " ORDER BY t.fecha DESC, t.hora_creacion DESC LIMIT ? OFFSET ?" # <-- MODIFICADO
-            params.extend([limit, offset])
-            
-            cursor.execute(query, params)
-            tasks = cursor.fetchall()
-            return [TaskResponse(**dict(task)) for task in tasks]
-    except Exception as e:
-        logger.error(f"Error al obtener tareas del usuario: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Error al recuperar las tareas del usuario"
-        )
-
 @app.get("/mediadores/", response_model=List[UsuarioResponse])
 async def get_mediadores(current_user: dict = Depends(get_current_mediador)):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT id, codigo, correo, rol, nombre, apellido, caso_activo FROM usuarios WHERE rol = 'mediador'"
-            )
-            mediadores = cursor.fetchall()
-            return [UsuarioResponse(**dict(m)) for m in mediadores]
+        mediadores = await run_db(storage.list_mediators)
+        return [UsuarioResponse(**m) for m in mediadores]
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error al obtener mediadores: {e}")
         raise HTTPException(status_code=500, detail="Error al obtener lista de mediadores")
 
 @app.get("/search", response_model=List[TaskResponse])
 async def search_active_tasks(
+  request: Request,
+  response: Response,
   limit: int = Query(100, ge=1, le=500),
   offset: int = Query(0, ge=0),
+  after: Optional[str] = Query(None, description="Cursor de X-Next-Cursor de la página anterior"),
   current_user: dict = Depends(get_current_mediador)
 ):
+    check_pagination(offset, after)
+    etag = task_versions.etag("search", task_versions.global_version, limit, offset, after)
+    not_modified = conditional_response(request, response, etag)
+    if not_modified:
+        return not_modified
+
     try:
-        base_query = """
-            SELECT t.id, t.usuario_id, u.codigo as codigo_estudiante, u.correo as correo_estudiante, 
-                   u.nombre as nombre_estudiante, u.apellido as apellido_estudiante,
-                   t.ubicacion, t.estado, t.fecha, 
-                   t.hora_creacion, -- <-- MODIFICADO
-                   t.hora_asignacion, 
-                   t.hora_resolucion, -- <-- AÑADIDO
-                   t.hora_completado,
-                   t.mediador_id, t.descripcion_final,
-                   m.correo as mediador_correo
-            FROM tasks t
-            JOIN usuarios u ON t.usuario_id = u.id
-            LEFT JOIN usuarios m ON t.mediador_id = m.id
-            WHERE t.estado = ?
-        """
-        valores = [EstadoTarea.ACTIVO.value]
-        
         # FIFO: Más antiguo primero
-        query = base_query + " ORDER BY t.id ASC LIMIT ? OFFSET ?" 
-        valores.extend([limit, offset])
-        
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, valores)
-            rows = cursor.fetchall()
-            return [TaskResponse(**dict(row)) for row in rows]
+        rows, next_cursor = await read_active_tasks(limit, after, offset)
+        set_next_cursor(response, next_cursor)
+        return task_list_response(rows, response)
             
     except HTTPException:
         raise
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor de paginación inválido")
     except Exception as e:
         logger.error(f"Error en búsqueda de activos: {e}")
         raise HTTPException(
@@ -716,48 +1125,138 @@ async def search_active_tasks(
             detail="Error al procesar la búsqueda de casos activos"
         )
 
+async def read_active_tasks(limit: int, after: Optional[str] = None, offset: int = 0):
+    """Página de la cola de casos activos: desde el índice si está listo, si no desde el almacenamiento."""
+    if ACTIVE_INDEX_ENABLED and active_index.ready:
+        return active_index.fetch(limit, after, offset)
+    return await run_db(storage.list_active_tasks, limit, after, offset)
+
+async def _active_queue_snapshot() -> List[dict]:
+    rows, _ = await read_active_tasks(500)
+    return task_list_adapter.dump_python(task_list_adapter.validate_python(rows), mode="json")
+
+async def _snapshot_event() -> str:
+    # La secuencia se toma antes de leer: los deltas posteriores se reenvían y son idempotentes
+    seq = task_events.last_seq
+    tasks = await _active_queue_snapshot()
+    return encode_event(task_events.format_id(seq), "snapshot", {"tasks": tasks})
+
+async def _resync_events(mediador_id: int) -> List[str]:
+    """
+    Snapshot para un cliente que perdió deltas (cola desbordada o Last-Event-ID
+    fuera del historial). Con DISPATCH_MODE=auto el 'task_dispatched' de este
+    mediador pudo estar entre lo perdido: si ya tiene un caso 'Pendiente', se
+    reenvía, porque el despachador no volverá a asignárselo.
+    """
+    seq = task_events.last_seq
+    events = [await _snapshot_event()]
+    if dispatcher:
+        task_data = await run_db(storage.get_mediator_active_task, mediador_id)
+        if task_data:
+            events.append(encode_event(
+                task_events.format_id(seq), "task_dispatched", TaskResponse(**task_data).model_dump(mode="json")
+            ))
+    return events
+
+@app.get("/search/stream")
+async def stream_active_tasks(
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_mediador)
+):
+    """
+    Stream SSE de la cola de casos activos.
+
+    Envía un evento 'snapshot' con la cola completa y después solo deltas:
+    'task_created' (la tarea completa) y 'task_assigned' ({id, mediador_id}).
+    Los deltas son idempotentes: el cliente agrega o quita por id.
+    Con DISPATCH_MODE=auto, el mediador conectado queda disponible para la
+    asignación automática y recibe 'task_dispatched' (la tarea completa)
+    cuando se le asigna un caso; ese evento no llega a los demás.
+    Si el cliente reconecta con Last-Event-ID y el hueco sigue en el historial,
+    solo recibe los eventos perdidos; si no, recibe un snapshot nuevo (y, en
+    modo auto, el 'task_dispatched' de su caso si ya tiene uno).
+    Cada SSE_HEARTBEAT_SECONDS sin eventos se envía un comentario ': ping'.
+    """
+    resume_from = task_events.parse_id(last_event_id or request.query_params.get("last_event_id"))
+    mediador_id = current_user["id"]
+
+    def visible(event) -> bool:
+        return event.type != "task_dispatched" or event.data["mediador_id"] == mediador_id
+
+    async def event_stream():
+        # Suscribirse antes de leer el snapshot para no perder deltas intermedios
+        sub = task_events.subscribe(usuario_id=mediador_id)
+        if dispatcher:
+            dispatcher.connect(mediador_id)
+        try:
+            yield "retry: 3000\n\n"
+            backlog = task_events.events_since(resume_from) if resume_from is not None else None
+            if backlog is None:
+                # Sin Last-Event-ID: lo que el despachador asigne desde connect() llega por la suscripción
+                if resume_from is None:
+                    yield await _snapshot_event()
+                else:
+                    for message in await _resync_events(mediador_id):
+                        yield message
+            else:
+                for event in backlog:
+                    if visible(event):
+                        yield event.encode()
+
+            while True:
+                event = await sub.get(timeout=SSE_HEARTBEAT_SECONDS)
+                if sub.overflowed:
+                    # El cliente se atrasó demasiado o hubo que corregir la cola: descartar deltas y reenviar snapshot
+                    sub.overflowed = False
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()
+                    for message in await _resync_events(mediador_id):
+                        yield message
+                    continue
+                if event is None:
+                    yield encode_comment("ping")
+                    continue
+                if visible(event):
+                    yield event.encode()
+        finally:
+            task_events.unsubscribe(sub)
+            if dispatcher:
+                dispatcher.disconnect(mediador_id)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # --- ENDPOINTS DE ESCRITURA Y ACTUALIZACIÓN ---
 
 @app.post("/my-tasks/", response_model=TaskResponse, status_code=201)
 async def create_my_task(task: Task, current_user: dict = Depends(get_current_user)):
     """Crea una nueva tarea para el usuario actual."""
     try:
-
-        if current_user.get("caso_activo", 0) == 1:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Ya tienes un caso activo. No puedes crear uno nuevo hasta que se resuelva."
-            )
-
+        # Sin comprobar 'caso_activo' del usuario en caché: create_task lo hace en la transacción (ActorBusy)
         if not task.ubicacion:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="La ubicación es obligatoria"
             )
         
-        fecha, hora = get_current_local_date_time()
         usuario_id = current_user["id"]
         
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO tasks (usuario_id, ubicacion, estado, fecha, hora_creacion) VALUES (?, ?, ?, ?, ?)",
-                (usuario_id, task.ubicacion, EstadoTarea.ACTIVO, fecha, hora)
-            )
-            task_id = cursor.lastrowid
-            cursor.execute(
-                "UPDATE usuarios SET caso_activo = 1 WHERE id = ?",
-                (usuario_id,)
+        # INSERT ... RETURNING y caso_activo = 1 en la misma transacción.
+        # La guarda 'caso_activo = 0' evita dos casos simultáneos del mismo usuario.
+        try:
+            task_data = await run_transition("task_created", storage.create_task, usuario_id, task.ubicacion, now_ms())
+        except transitions.ActorBusy:
+            invalidate_cached_users(usuario_id)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Ya tienes un caso activo. No puedes crear uno nuevo hasta que se resuelva."
             )
-            conn.commit()
-            
-            # 💡 LLAMADA CORREGIDA: Llama a la función de lectura que ya está definida
-            task_data = get_task_details(conn, task_id)
-            
-            if not task_data:
-                 raise HTTPException(status_code=500, detail="Error al crear la tarea.")
 
-            return TaskResponse(**task_data)
+        return TaskResponse(**task_data)
 
     except HTTPException:
         raise
@@ -776,34 +1275,17 @@ async def complete_task(
 ):
     """Permite al usuario 'completar' un reporte (estado Pendiente -> Completado)."""
     try:
-        fecha, hora_completado = get_current_local_date_time()
-        
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                "SELECT id FROM tasks WHERE id = ? AND usuario_id = ? AND estado = ?",
-                (task_id, current_user["id"], EstadoTarea.PENDIENTE_FORMULARIO)
+        try:
+            task_data = await run_transition(
+                "task_completed", storage.complete_task, task_id, current_user["id"], now_ms(), request.descripcion_final
             )
-            task = cursor.fetchone()
-            
-            if not task:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="No se encontró un reporte pendiente para completar"
-                )
-            
-            cursor.execute(
-                "UPDATE tasks SET estado = ?, hora_completado = ?, descripcion_final = ? WHERE id = ?",
-                (EstadoTarea.COMPLETADO, hora_completado, request.descripcion_final, task_id)
+        except transitions.TaskNotInState:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No se encontró un reporte pendiente para completar"
             )
-            conn.commit()
-            
-            task_data = get_task_details(conn, task_id)
-            if not task_data:
-                raise HTTPException(status_code=404, detail="Error al recuperar la tarea actualizada.")
-                
-            return TaskResponse(**task_data)
+
+        return TaskResponse(**task_data)
             
     except HTTPException:
         raise
@@ -811,65 +1293,40 @@ async def complete_task(
         logger.error(f"Error al completar tarea {task_id}: {e}")
         raise HTTPException(status_code=500, detail="Error al completar la tarea")
 
-# --- REEMPLAZA TU FUNCIÓN 'assign_task' EXISTENTE POR ESTA ---
-
 @app.put("/tasks/{task_id}/asignar", response_model=TaskResponse)
-async def assign_task_to_self(  # (He cambiado el nombre de la función para más claridad)
+async def assign_task_to_self(
     task_id: int,
-    current_user: dict = Depends(get_current_mediador) # <-- ¡Ya no se recibe 'request: AsignarRequest'!
+    current_user: dict = Depends(get_current_mediador)
 ):
     """
     (Mediador) Se auto-asigna una tarea.
     La tarea debe estar en estado 'Activo'.
-    El mediador debe estar en estado 'caso_activo = 0'.
+    El mediador debe estar en estado 'caso_activo = 0' (assign_task lo
+    comprueba en la misma transacción; el usuario en caché puede estar atrasado).
     """
-    
-    # Verificar si el mediador ya tiene un caso activo
-    if current_user.get("caso_activo", 0) == 1:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Ya tienes un caso asignado. Resuelve tu caso actual primero."
-        )
-    
     try:
-        fecha, hora_asignacion = get_current_local_date_time()
-        
         # Obtenemos el ID del mediador directamente del token
         mediador_id_asignado = current_user["id"]
         
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # 1. Verificar que la tarea esté 'Activa'
-            cursor.execute("SELECT id, usuario_id FROM tasks WHERE id = ? AND estado = ?", (task_id, EstadoTarea.ACTIVO))
-            task = cursor.fetchone()
-            
-            if not task:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="No se encontró un reporte activo con ese ID. Es posible que otro mediador ya lo haya tomado."
-                )
-            
-            # 2. Asignar la tarea
-            cursor.execute(
-                "UPDATE tasks SET estado = ?, mediador_id = ?, hora_asignacion = ? WHERE id = ?",
-                (EstadoTarea.PENDIENTE, mediador_id_asignado, hora_asignacion, task_id)
+        # Un solo UPDATE condicionado a estado = 'Activo': si otro mediador
+        # lo tomó primero, no afecta filas y la transacción se deshace.
+        try:
+            task_data = await run_transition(
+                "task_assigned", storage.assign_task, task_id, mediador_id_asignado, now_ms()
             )
-            
-            # 3. Marcar al mediador como ocupado
-            cursor.execute(
-                "UPDATE usuarios SET caso_activo = 1 WHERE id = ?",
-                (mediador_id_asignado,)
+        except transitions.ActorBusy:
+            invalidate_cached_users(mediador_id_asignado)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Ya tienes un caso asignado. Resuelve tu caso actual primero."
             )
-            
-            conn.commit()
-            
-            # Devolver la tarea actualizada usando nuestra función helper
-            task_data = get_task_details(conn, task_id)
-            if not task_data:
-                raise HTTPException(status_code=404, detail="Error al recuperar la tarea actualizada.")
-            
-            return TaskResponse(**task_data)
+        except transitions.TaskNotInState:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No se encontró un reporte activo con ese ID. Es posible que otro mediador ya lo haya tomado."
+            )
+
+        return TaskResponse(**task_data)
             
     except HTTPException:
         raise
@@ -889,52 +1346,17 @@ async def resolve_task(
     Libera el estado 'caso_activo' tanto del mediador como del usuario.
     """
     try:
-        fecha, hora_resolucion = get_current_local_date_time()
-        
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Verificar que la tarea existe, está 'Pendiente' y pertenece a este mediador
-            cursor.execute(
-                "SELECT id, usuario_id FROM tasks WHERE id = ? AND mediador_id = ? AND estado = ?",
-                (task_id, current_user["id"], EstadoTarea.PENDIENTE)
-            )
-            task = cursor.fetchone()
-            
-            if not task:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="No se encontró una tarea pendiente asignada a usted con ese ID."
-                )
-            
-            usuario_id = task["usuario_id"]
-
-            # Actualizar la tarea
-            cursor.execute(
-                "UPDATE tasks SET estado = ?, hora_resolucion = ? WHERE id = ?",
-                (EstadoTarea.PENDIENTE_FORMULARIO, hora_resolucion, task_id)
+        try:
+            task_data = await run_transition(
+                "task_resolved", storage.resolve_task, task_id, current_user["id"], now_ms()
             )
-            
-            # Liberar al mediador
-            cursor.execute(
-                "UPDATE usuarios SET caso_activo = 0 WHERE id = ?",
-                (current_user["id"],)
-            )
-            
-            # Liberar al usuario
-            cursor.execute(
-                "UPDATE usuarios SET caso_activo = 0 WHERE id = ?",
-                (usuario_id,)
+        except transitions.TaskNotInState:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No se encontró una tarea pendiente asignada a usted con ese ID."
             )
-            
-            conn.commit()
-            
-            # Devolver la tarea actualizada
-            task_data = get_task_details(conn, task_id)
-            if not task_data:
-                raise HTTPException(status_code=404, detail="Error al recuperar la tarea actualizada.")
-                
-            return TaskResponse(**task_data)
+
+        return TaskResponse(**task_data)
             
     except HTTPException:
         raise
@@ -944,6 +1366,8 @@ async def resolve_task(
 
 @app.get("/mediator/my-active-case", response_model=TaskResponse)
 async def get_my_active_case_mediator(
+    request: Request,
+    response: Response,
     current_user: dict = Depends(get_current_mediador)
 ):
     """
@@ -963,36 +1387,25 @@ async def get_my_active_case_mediator(
             detail="No tiene ningún caso activo asignado."
         )
 
+    version = task_versions.user_version(current_user["id"])
+    etag = task_versions.etag(f"m{current_user['id']}", version)
+    not_modified = conditional_response(request, response, etag)
+    if not_modified:
+        return not_modified
+
     try:
-        with get_db_connection() as conn:
-            # Buscamos la tarea que está en "Pendiente" y asignada a este mediador.
-            # Esta es, por definición, su tarea activa.
-            cursor = conn.cursor()
-            query = """
-                SELECT t.id
-                FROM tasks t
-                WHERE t.mediador_id = ? AND t.estado = ?
-            """
-            cursor.execute(query, (current_user["id"], EstadoTarea.PENDIENTE))
-            task_row = cursor.fetchone()
-
-            if not task_row:
-                # Esto es un estado inconsistente (flag=1 pero sin tarea).
-                # Podríamos forzar la corrección del flag aquí, pero por ahora...
-                logger.warning(f"Inconsistencia: Mediador {current_user['id']} tiene caso_activo=1 pero no se encontró tarea 'Pendiente'.")
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, 
-                    detail="No se encontró un caso 'Pendiente' activo."
-                )
-            
-            # Usamos la función helper que ya creamos para obtener todos los detalles
-            task_details = get_task_details(conn, task_row["id"])
+        task_details = await run_db(storage.get_mediator_active_task, current_user["id"])
 
-            if not task_details:
-                # Esto no debería pasar si la línea anterior tuvo éxito
-                raise HTTPException(status_code=404, detail="Error al recuperar detalles del caso.")
+        if not task_details:
+            # Esto es un estado inconsistente (flag=1 pero sin tarea).
+            # Podríamos forzar la corrección del flag aquí, pero por ahora...
+            logger.warning(f"Inconsistencia: Mediador {current_user['id']} tiene caso_activo=1 pero no se encontró tarea 'Pendiente'.")
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, 
+                detail="No se encontró un caso 'Pendiente' activo."
+            )
 
-            return TaskResponse(**task_details)
+        return TaskResponse(**task_details)
             
     except HTTPException:
         raise
@@ -1023,6 +1436,197 @@ def get_health() -> HealthCheck:
         HealthCheck: Returns a JSON response with the health status
     """
     return HealthCheck(status="OK")
+
+@app.get("/metrics", tags=["healthcheck"], summary="Métricas en formato de texto de Prometheus")
+async def get_metrics():
+    try:
+        queues = await run_db(storage.count_open_queues)
+        for estado, count in queues["tasks"].items():
+            task_queue.set(count, estado=estado)
+        busy_mediators.set(queues["busy_mediators"])
+    except HTTPException:
+        pass  # Base de datos ocupada: se reportan los últimos valores leídos
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# --- ENDPOINTS DE ADMINISTRACIÓN ---
+
+class SlowQueryOrder(str, Enum):
+    MAX = "max"
+    TOTAL = "total"
+    COUNT = "count"
+
+@app.get("/admin/slow-queries", tags=["admin"], summary="Sentencias más lentas desde el arranque")
+def get_slow_queries(
+    limit: int = Query(20, ge=1, le=500),
+    order_by: SlowQueryOrder = SlowQueryOrder.MAX,
+    current_user: dict = Depends(get_current_admin)
+) -> Dict[str, Any]:
+    """
+    Top-N de sentencias que superaron SLOW_QUERY_MS, agrupadas por SQL
+    normalizado, con la forma de sus parámetros y su plan de ejecución.
+    """
+    if slow_query_log is None:
+        return {"enabled": False, "statements": []}
+    return {
+        "enabled": True,
+        **slow_query_log.stats(),
+        "statements": slow_query_log.top(limit, order_by.value),
+    }
+
+# --- TIEMPOS DE RESPUESTA (KPIs desde los rollups) ---
+
+class StatsMetric(str, Enum):
+    ASIGNACION = "asignacion"  # creación -> asignación
+    RESOLUCION = "resolucion"  # asignación -> resolución
+    FORMULARIO = "formulario"  # resolución -> completado
+
+class StatsGranularity(str, Enum):
+    HORA = "hora"
+    DIA = "dia"
+
+STATS_PERCENTILES = (0.5, 0.9, 0.99)
+STATS_MAX_DAYS = {StatsGranularity.HORA: 31, StatsGranularity.DIA: 366}
+
+def _period_label(period_start: int) -> str:
+    return datetime.fromtimestamp(period_start / 1000, LOCAL_TZ).isoformat()
+
+@app.get("/stats", tags=["admin"], summary="Tiempos de respuesta por hora o día")
+async def get_response_time_stats(
+    metric: StatsMetric = StatsMetric.ASIGNACION,
+    granularity: StatsGranularity = StatsGranularity.DIA,
+    desde: Optional[date] = Query(None, description="Primer día (hora local); por defecto, 6 días antes de 'hasta'"),
+    hasta: Optional[date] = Query(None, description="Último día incluido (hora local); por defecto, hoy"),
+    mediador_id: Optional[int] = None,
+    por_mediador: bool = False,
+    current_user: dict = Depends(get_current_admin)
+) -> Dict[str, Any]:
+    """
+    Conteo, promedio y percentiles (p50, p90, p99) del tiempo de respuesta,
+    en total y por periodo; con por_mediador=true también por mediador.
+    Se calcula desde los rollups (rollups.py), sin recorrer la tabla de tareas.
+
+    Los percentiles salen de histogramas con buckets de 1, 2, 5, 10... s: se
+    interpolan dentro del bucket ajustándose a la media observada en él, así
+    que su resolución es la del bucket (tiempos de menos de 1 s no se
+    distinguen entre sí más allá de su media). Promedio y percentiles se
+    redondean a 0.1 s.
+    """
+    hasta = hasta or datetime.now(LOCAL_TZ).date()
+    desde = desde or hasta - timedelta(days=6)
+    days = (hasta - desde).days + 1
+    if days < 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'desde' debe ser anterior a 'hasta'")
+    if days > STATS_MAX_DAYS[granularity]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Rango máximo por {granularity.value}: {STATS_MAX_DAYS[granularity]} días"
+        )
+
+    rows = await run_db(
+        storage.response_time_rollups, metric.value, granularity.value,
+        local_date_start(desde), local_date_start(hasta + timedelta(days=1)), mediador_id,
+    )
+    total = rollups.aggregate(rows, None).get(None, ([], []))
+    result = {
+        "metric": metric.value,
+        "granularity": granularity.value,
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "mediador_id": mediador_id,
+        "total": rollups.summarize(*total, STATS_PERCENTILES),
+        "series": [
+            {"period_start": _period_label(period), **rollups.summarize(counts, sums_ms, STATS_PERCENTILES)}
+            for period, (counts, sums_ms) in rollups.aggregate(rows, "period_start").items()
+        ],
+    }
+    if por_mediador:
+        result["mediadores"] = [
+            {"mediador_id": mediador, **rollups.summarize(counts, sums_ms, STATS_PERCENTILES)}
+            for mediador, (counts, sums_ms) in rollups.aggregate(rows, "mediador_id").items()
+        ]
+    return result
+
+# --- EXPORTACIÓN DEL HISTORIAL ---
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+@app.get("/export/tasks", tags=["admin"], summary="Historial completo de tareas en NDJSON o CSV")
+async def export_tasks(
+    request: Request,
+    format: ExportFormat = ExportFormat.NDJSON,
+    estado: Optional[EstadoTarea] = None,
+    desde: Optional[date] = Query(None, description="Primer día de creación (hora local)"),
+    hasta: Optional[date] = Query(None, description="Último día de creación incluido (hora local)"),
+    current_user: dict = Depends(get_current_staff)
+):
+    """
+    Tareas activas y archivadas con los datos del estudiante y del mediador,
+    en orden de id. La respuesta se envía por partes (chunked) a medida que
+    se lee, página por página, sin retener una transacción abierta; con
+    Accept-Encoding: gzip se comprime al vuelo. Ver export.py.
+    """
+    if desde and hasta and hasta < desde:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'desde' debe ser anterior a 'hasta'")
+    start_ms = local_date_start(desde) if desde else None
+    end_ms = local_date_start(hasta + timedelta(days=1)) if hasta else None
+    estado_value = estado.value if estado else None
+    gzip = export.GzipStream() if "gzip" in request.headers.get("accept-encoding", "") else None
+
+    async def generate():
+        def encode(text: str) -> bytes:
+            return gzip.compress(text) if gzip else text.encode()
+
+        header = export.encode_header(format.value)
+        if header:
+            yield encode(header)
+        after_id = 0
+        exported = 0
+        while True:
+            try:
+                rows = await storage.export_page(after_id, export.PAGE_SIZE, estado_value, start_ms, end_ms)
+            except Exception as e:
+                # Ya se enviaron los encabezados: cortar la conexión para que el cliente vea la respuesta incompleta
+                logger.error(f"Exportación interrumpida tras {exported} tareas: {e}")
+                raise
+            if rows:
+                after_id = rows[-1]["id"]
+                exported += len(rows)
+                yield encode(export.encode_rows(format.value, (export.render_row(row) for row in rows)))
+            if len(rows) < export.PAGE_SIZE:
+                break
+        if gzip:
+            yield gzip.close()
+        logger.info(f"Exportación de {exported} tareas ({format.value}) por {current_user['codigo']}")
+
+    filename = f"tareas-{datetime.now(LOCAL_TZ):%Y%m%d-%H%M}.{format.value}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "Vary": "Accept-Encoding"}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(generate(), media_type=export.CONTENT_TYPES[format.value], headers=headers)
+
+@app.get("/health/stats", tags=["healthcheck"], summary="Estadísticas internas")
+def get_health_stats() -> Dict[str, Any]:
+    """Contadores de uso del pool de conexiones, útiles para dimensionarlo."""
+    return {
+        "storage": storage.stats(),
+        "db_pool": db_pool.stats(),
+        "db_executor": db.stats(),
+        "event_stream": {"subscribers": task_events.subscriber_count(), "last_seq": task_events.last_seq},
+        "task_versions": {"global": task_versions.global_version},
+        "user_cache": user_cache.stats(),
+        "active_index": active_index.stats(),
+        "archiver": {"after_days": ARCHIVE_AFTER_DAYS, **archiver_stats},
+        "dispatcher": {"mode": DISPATCH_MODE, **(dispatcher.stats() if dispatcher else {})},
+        "change_bus": {"workers": WORKERS, **(change_bus.stats() if change_bus else {})},
+        "password_pool": password_pool.stats(),
+        "rate_limit": {
+            "read": read_limiter.stats() if read_limiter else None,
+            "write": write_limiter.stats() if write_limiter else None,
+            "concurrency": request_limiter.stats() if request_limiter else None,
+        },
+    }
 # --- ENDPOINTS DE GESTIÓN DE USUARIOS (Se omiten create/read por brevedad) ---
 # ... (Si necesitas crear/leer usuarios, esos endpoints se pueden añadir aquí) ...
 
@@ -0,0 +1,426 @@
+"""
+Migraciones versionadas del esquema SQLite.
+
+La tabla `schema_version` registra qué pasos ya se aplicaron. Al arrancar,
+migrate() hace una sola consulta y, si el esquema está al día, termina ahí.
+Si faltan pasos, aplica cada uno dentro de BEGIN IMMEDIATE, de modo que
+varios workers que arrancan a la vez no los ejecutan dos veces.
+
+Los pasos marcados `batched` (rellenos de datos) corren fuera de esa
+transacción y hacen commit por lotes para no bloquear la tabla mucho tiempo;
+deben ser idempotentes, porque otro worker puede ejecutarlos a la vez.
+
+El alta de usuarios de prueba ya no ocurre en cada arranque: es un comando
+aparte.
+
+    python migrations.py migrate   # aplica migraciones pendientes
+    python migrations.py status    # muestra la versión actual
+    python migrations.py seed      # (re)establece los usuarios de prueba
+"""
+from dataclasses import dataclass
+from typing import Callable, List
+import logging
+import sqlite3
+import time
+
+from timestamps import parse_legacy
+import rollups
+
+logger = logging.getLogger(__name__)
+
+# Tiempo máximo que un worker espera a que otro termine de migrar
+MIGRATION_LOCK_TIMEOUT_MS = 60000
+
+# Filas por transacción en los pasos por lotes
+BACKFILL_BATCH_SIZE = 500
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Connection], None]
+    batched: bool = False
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+# --- PASOS DE MIGRACIÓN ---
+
+def _001_esquema_base(conn: sqlite3.Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            rol TEXT DEFAULT 'usuario',
+            codigo TEXT UNIQUE NOT NULL,
+            correo TEXT NOT NULL,
+            contrasena TEXT NOT NULL,
+            nombre TEXT,
+            apellido TEXT,
+            caso_activo INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            ubicacion TEXT NOT NULL,
+            estado TEXT NOT NULL,
+            fecha TEXT NOT NULL,
+            hora_creacion TEXT NOT NULL,
+            hora_asignacion TEXT,
+            hora_resolucion TEXT,
+            hora_completado TEXT,
+            mediador_id INTEGER,
+            descripcion_final TEXT,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
+            FOREIGN KEY (mediador_id) REFERENCES usuarios (id)
+        )
+    """)
+
+    # Bases creadas antes de las migraciones versionadas pueden no tener estas columnas
+    columns = _columns(conn, "usuarios")
+    for column in ("nombre", "apellido"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE usuarios ADD COLUMN {column} TEXT")
+    if "caso_activo" not in columns:
+        conn.execute("ALTER TABLE usuarios ADD COLUMN caso_activo INTEGER NOT NULL DEFAULT 0")
+
+    columns = _columns(conn, "tasks")
+    for column in ("ubicacion", "hora_asignacion", "hora_resolucion", "hora_completado", "descripcion_final"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE tasks ADD COLUMN {column} TEXT")
+    if "mediador_id" not in columns:
+        conn.execute("ALTER TABLE tasks ADD COLUMN mediador_id INTEGER REFERENCES usuarios(id)")
+
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_usuario_id ON tasks(usuario_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_usuarios_codigo ON usuarios(codigo)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_usuarios_correo ON usuarios(correo)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_mediador_id ON tasks(mediador_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_estado ON tasks(estado)")
+
+
+def _002_indices_keyset(conn: sqlite3.Connection):
+    # Índices compuestos para la paginación por cursor de /search y /my-tasks/.
+    # Reemplazan a los de una sola columna, que son prefijo de estos.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_estado_id ON tasks(estado, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_usuario_id_id ON tasks(usuario_id, id)")
+    conn.execute("DROP INDEX IF EXISTS idx_tasks_estado")
+    conn.execute("DROP INDEX IF EXISTS idx_tasks_usuario_id")
+
+
+def _003_columnas_epoch(conn: sqlite3.Connection):
+    # Milisegundos desde epoch (UTC): ordenables e indexables, a diferencia de
+    # 'fecha' (dd/mm/YYYY) y las horas HH:MM.
+    columns = _columns(conn, "tasks")
+    for column in ("created_at", "assigned_at", "resolved_at", "completed_at"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE tasks ADD COLUMN {column} INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_usuario_created ON tasks(usuario_id, created_at)")
+    conn.execute("DROP INDEX IF EXISTS idx_tasks_usuario_id_id")
+    # Índice parcial: solo contiene filas sin rellenar, así que queda vacío tras el relleno
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_sin_created_at ON tasks(id) WHERE created_at IS NULL")
+
+
+def _next_day_if_before(ms, reference):
+    # Solo se guardó la fecha de creación: una hora menor a la de creación
+    # significa que el evento ocurrió después de medianoche.
+    if ms is not None and reference is not None and ms < reference:
+        return ms + 24 * 60 * 60 * 1000
+    return ms
+
+
+def _004_rellenar_epoch(conn: sqlite3.Connection):
+    total = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                """
+                SELECT id, fecha, hora_creacion, hora_asignacion, hora_resolucion, hora_completado
+                FROM tasks WHERE created_at IS NULL ORDER BY id LIMIT ?
+                """,
+                (BACKFILL_BATCH_SIZE,),
+            ).fetchall()
+            updates = []
+            for row in rows:
+                created = parse_legacy(row["fecha"], row["hora_creacion"])
+                if created is None:
+                    logger.warning(f"Tarea {row['id']}: fecha/hora ilegibles, created_at = 0")
+                    created = 0
+                assigned = _next_day_if_before(parse_legacy(row["fecha"], row["hora_asignacion"]), created)
+                resolved = _next_day_if_before(parse_legacy(row["fecha"], row["hora_resolucion"]), assigned or created)
+                completed = _next_day_if_before(parse_legacy(row["fecha"], row["hora_completado"]), resolved or created)
+                updates.append((created, assigned, resolved, completed, row["id"]))
+            conn.executemany(
+                "UPDATE tasks SET created_at = ?, assigned_at = ?, resolved_at = ?, completed_at = ? WHERE id = ?",
+                updates,
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if not rows:
+            break
+        total += len(rows)
+        logger.info(f"Relleno de marcas de tiempo: {total} tareas")
+        time.sleep(0.005)  # Ceder el lock de escritura entre lotes
+
+
+def _005_tabla_archivo(conn: sqlite3.Connection):
+    # Tareas completadas hace tiempo (ver archive.py). Mismas columnas que
+    # tasks; el id se copia, no se genera.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tasks_archivo (
+            id INTEGER PRIMARY KEY,
+            usuario_id INTEGER NOT NULL,
+            ubicacion TEXT NOT NULL,
+            estado TEXT NOT NULL,
+            fecha TEXT NOT NULL,
+            hora_creacion TEXT NOT NULL,
+            hora_asignacion TEXT,
+            hora_resolucion TEXT,
+            hora_completado TEXT,
+            mediador_id INTEGER,
+            descripcion_final TEXT,
+            created_at INTEGER,
+            assigned_at INTEGER,
+            resolved_at INTEGER,
+            completed_at INTEGER,
+            archived_at INTEGER NOT NULL,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
+            FOREIGN KEY (mediador_id) REFERENCES usuarios (id)
+        )
+    """)
+    # Historial de /my-tasks/: se mezcla con el de tasks en orden (created_at, id)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_tasks_archivo_usuario_created ON tasks_archivo(usuario_id, created_at)"
+    )
+
+
+def _006_tablas_rollup(conn: sqlite3.Connection):
+    # Histogramas de tiempos de respuesta por (métrica, hora o día, mediador), ver rollups.py
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS task_rollups (
+            metric TEXT NOT NULL,
+            granularity TEXT NOT NULL,
+            period_start INTEGER NOT NULL,
+            mediador_id INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            sum_ms INTEGER NOT NULL,
+            PRIMARY KEY (metric, granularity, period_start, mediador_id, bucket)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_estado (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            backfill_hasta INTEGER NOT NULL,
+            completo INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO rollup_estado (id, backfill_hasta, completo) VALUES (1, 0, 0)")
+
+
+def _008_refresh_tokens(conn: sqlite3.Connection):
+    # Tokens de renovación rotativos, guardados como SHA-256 (ver refresh_tokens.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS refresh_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            token_hash TEXT NOT NULL UNIQUE,
+            usuario_id INTEGER NOT NULL,
+            family_id TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL,
+            used_at INTEGER,
+            revoked_at INTEGER,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_refresh_tokens_family ON refresh_tokens(family_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_refresh_tokens_expires ON refresh_tokens(expires_at)")
+
+
+def _009_change_log(conn: sqlite3.Connection):
+    # Cambios publicados por cada worker para los demás (ver bus.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS change_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            origin TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+    """)
+
+
+# Agregar nuevos pasos al final, con versión consecutiva. Nunca modificar uno ya publicado.
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Esquema base: usuarios, tasks e índices", _001_esquema_base),
+    Migration(2, "Índices compuestos para paginación por cursor", _002_indices_keyset),
+    Migration(3, "Columnas epoch de tiempos de tareas e índice (usuario_id, created_at)", _003_columnas_epoch),
+    Migration(4, "Relleno por lotes de las columnas epoch", _004_rellenar_epoch, batched=True),
+    Migration(5, "Tabla de archivo para tareas completadas", _005_tabla_archivo),
+    Migration(6, "Tablas de rollups de tiempos de respuesta", _006_tablas_rollup),
+    Migration(7, "Relleno por lotes de los rollups", rollups.backfill, batched=True),
+    Migration(8, "Tabla de tokens de renovación", _008_refresh_tokens),
+    Migration(9, "Registro de cambios entre workers", _009_change_log),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+# --- MOTOR ---
+
+def current_version(conn: sqlite3.Connection) -> int:
+    try:
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0  # La tabla aún no existe
+    return row[0] or 0
+
+
+def _record(conn: sqlite3.Connection, migration: Migration):
+    conn.execute(
+        "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, datetime('now'))",
+        (migration.version, migration.description),
+    )
+
+
+def _enable_incremental_vacuum_if_empty(conn: sqlite3.Connection):
+    """
+    En una base nueva activa auto_vacuum=INCREMENTAL, para que el archivador
+    pueda devolver al sistema las páginas que libera. En una base existente
+    requiere un VACUUM completo: `python archive.py enable-incremental-vacuum`.
+    """
+    if conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0]:
+        return
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")  # Instantáneo con la base vacía; fija el modo en el encabezado
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Aplica las migraciones pendientes; devuelve cuántas se aplicaron."""
+    if current_version(conn) >= LATEST_VERSION:
+        return 0  # Camino rápido: esquema al día
+
+    if conn.in_transaction:
+        conn.commit()
+    previous_timeout = conn.execute("PRAGMA busy_timeout").fetchone()[0]
+    conn.execute(f"PRAGMA busy_timeout={MIGRATION_LOCK_TIMEOUT_MS}")
+    applied = 0
+    try:
+        _enable_incremental_vacuum_if_empty(conn)
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT NOT NULL,
+                        applied_at TEXT NOT NULL
+                    )
+                """)
+                # Volver a leer con el lock tomado: otro worker pudo haber migrado ya
+                version = current_version(conn)
+                pending = [m for m in MIGRATIONS if m.version > version]
+                if not pending:
+                    conn.commit()
+                    return applied
+                migration = pending[0]
+                start = time.perf_counter()
+                if migration.batched:
+                    conn.commit()  # Los lotes manejan sus propias transacciones
+                else:
+                    migration.apply(conn)
+                    _record(conn, migration)
+                    conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+            if migration.batched:
+                migration.apply(conn)
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if current_version(conn) < migration.version:
+                        _record(conn, migration)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+
+            applied += 1
+            logger.info(
+                f"Migración {migration.version} aplicada ({migration.description}) "
+                f"en {(time.perf_counter() - start) * 1000:.1f} ms"
+            )
+    finally:
+        conn.execute(f"PRAGMA busy_timeout={previous_timeout}")
+
+
+# --- DATOS DE PRUEBA (opt-in) ---
+
+DEMO_USERS = [
+    # (rol, codigo, correo, nombre, apellido)
+    ("mediador", "mediador1", "mediador1@isaa.com", "Mediador", "Saul"),
+    ("mediador", "mediador2", "mediador2@isaa.com", "Mediador", "Juan"),
+    ("usuario", "222000000", "alberich@alumno.com", "Alberich", "Leal"),
+    ("admin", "admin", "admin@isaa.com", "Admin", "ISAA"),  # Futuro, sin uso actual
+]
+
+
+def seed_demo_users(conn: sqlite3.Connection, hash_password: Callable[[str], str], password: str = "a"):
+    """(Re)establece los usuarios de prueba conservando su id."""
+    common_pass_hash = hash_password(password)
+    for rol, codigo, correo, nombre, apellido in DEMO_USERS:
+        conn.execute(
+            """
+            INSERT INTO usuarios (rol, codigo, correo, contrasena, nombre, apellido)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(codigo) DO UPDATE SET
+                rol = excluded.rol,
+                correo = excluded.correo,
+                contrasena = excluded.contrasena,
+                nombre = excluded.nombre,
+                apellido = excluded.apellido
+            """,
+            (rol, codigo, correo, common_pass_hash, nombre, apellido),
+        )
+        logger.info(f"Usuario '{codigo}' restablecido.")
+    conn.commit()
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    from dotenv import load_dotenv
+    from passlib.context import CryptContext
+    from database import ConnectionPool
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv()
+    database_url = os.getenv("DATABASE_URL", "db/isaa.db")
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+
+    os.makedirs(os.path.dirname(database_url) or ".", exist_ok=True)
+    pool = ConnectionPool(database_url, max_size=1)
+    with pool.connection() as conn:
+        if command == "migrate":
+            applied = migrate(conn)
+            print(f"{applied} migraciones aplicadas; versión actual {current_version(conn)}")
+        elif command == "status":
+            print(f"Versión actual {current_version(conn)} (última disponible {LATEST_VERSION})")
+        elif command == "seed":
+            migrate(conn)
+            pwd_context = CryptContext(
+                schemes=["bcrypt"], deprecated="auto",
+                bcrypt__rounds=int(os.getenv("BCRYPT_ROUNDS", "12")),
+            )
+            seed_demo_users(conn, pwd_context.hash)
+        else:
+            print(__doc__)
+            sys.exit(1)
+    pool.close()
@@ -0,0 +1,266 @@
+"""
+Consultas de lista de tareas con paginación por cursor (keyset).
+
+En lugar de LIMIT/OFFSET, que obliga a SQLite a recorrer y descartar todas
+las filas saltadas, cada página continúa desde la última clave vista
+(`?after=<cursor>`). El costo de la página N no depende de N.
+
+El cursor es opaco para el cliente: JSON en base64url con el tipo de lista
+y la clave de la última fila.
+
+El historial de un usuario (/my-tasks/) incluye las tareas archivadas en
+`tasks_archivo` (ver archive.py): las dos tablas se leen con su índice
+(usuario_id, created_at) y SQLite las mezcla en orden, sin ordenar aparte.
+
+`python queries.py` imprime el plan de ejecución de cada consulta y termina
+con error si alguna recorre la tabla completa u ordena en un B-tree temporal.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import base64
+import binascii
+import json
+import sqlite3
+
+from timestamps import render_task_times
+
+ESTADO_ACTIVO = "Activo"
+ESTADO_COMPLETADO = "Completado"
+ARCHIVE_TABLE = "tasks_archivo"
+
+# Mismas columnas (y alias) que TaskResponse. id y created_at llevan alias
+# explícito para poder ordenar por ellos la unión con la tabla de archivo.
+_TASK_SELECT = """
+    SELECT t.id AS id, t.usuario_id,
+           u.codigo as codigo_estudiante, u.correo as correo_estudiante,
+           u.nombre as nombre_estudiante, u.apellido as apellido_estudiante,
+           t.ubicacion, t.estado, t.fecha,
+           t.hora_creacion,
+           t.hora_asignacion, t.hora_resolucion, t.hora_completado,
+           t.mediador_id, t.descripcion_final,
+           t.created_at AS created_at, t.assigned_at, t.resolved_at, t.completed_at,
+           m.nombre as mediador_nombre,
+           m.apellido as mediador_apellido
+    FROM {table} t
+    JOIN usuarios u ON t.usuario_id = u.id
+    LEFT JOIN usuarios m ON t.mediador_id = m.id
+"""
+TASK_SELECT = _TASK_SELECT.format(table="tasks")
+ARCHIVE_SELECT = _TASK_SELECT.format(table=ARCHIVE_TABLE)
+
+
+class InvalidCursor(ValueError):
+    """El cursor no es válido o pertenece a otra lista."""
+
+
+def encode_cursor(kind: str, **key: Any) -> str:
+    raw = json.dumps({"k": kind, **key}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(kind: str, cursor: str) -> Dict[str, Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(data, dict) or data.get("k") != kind:
+        raise InvalidCursor(cursor)
+    return data
+
+
+# --- CASOS ACTIVOS (FIFO: más antiguo primero) ---
+
+def _active_tasks_sql(keyset: bool) -> str:
+    return (
+        TASK_SELECT
+        + " WHERE t.estado = ?"
+        + (" AND t.id > ?" if keyset else "")
+        + " ORDER BY t.id ASC LIMIT ? OFFSET ?"
+    )
+
+
+def fetch_active_tasks(
+    conn: sqlite3.Connection, limit: int, after: Optional[str] = None, offset: int = 0
+) -> Tuple[List[dict], Optional[str]]:
+    """Devuelve (filas, cursor de la página siguiente o None)."""
+    params: List[Any] = [ESTADO_ACTIVO]
+    if after:
+        try:
+            params.append(int(decode_cursor("search", after)["id"]))
+        except (KeyError, TypeError, ValueError):
+            raise InvalidCursor(after)
+    params.extend([limit, offset])
+    rows = [dict(row) for row in conn.execute(_active_tasks_sql(bool(after)), params).fetchall()]
+    next_cursor = encode_cursor("search", id=rows[-1]["id"]) if len(rows) == limit else None
+    return [render_task_times(row) for row in rows], next_cursor
+
+
+def fetch_all_active_tasks(conn: sqlite3.Connection) -> List[dict]:
+    """La cola completa, para cargar y verificar el índice en memoria (active_index.py)."""
+    rows = conn.execute(_active_tasks_sql(False), (ESTADO_ACTIVO, -1, 0)).fetchall()
+    return [render_task_times(dict(row)) for row in rows]
+
+
+# --- TAREAS DE UN USUARIO (más reciente primero) ---
+# Orden por (created_at, id): el id desempata tareas creadas en el mismo milisegundo.
+
+def _user_tasks_sql(with_estado: bool, keyset: bool, with_archive: bool = True) -> str:
+    where = (
+        " WHERE t.usuario_id = ?"
+        + (" AND t.estado = ?" if with_estado else "")
+        + (" AND (t.created_at, t.id) < (?, ?)" if keyset else "")
+    )
+    if not with_archive:
+        return TASK_SELECT + where + " ORDER BY t.created_at DESC, t.id DESC LIMIT ? OFFSET ?"
+    # Cada parte recorre su índice en orden; ORDER BY + LIMIT sobre la unión las mezcla
+    return (
+        TASK_SELECT + where
+        + " UNION ALL "
+        + ARCHIVE_SELECT + where
+        + " ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?"
+    )
+
+
+def fetch_user_tasks(
+    conn: sqlite3.Connection,
+    usuario_id: int,
+    limit: int,
+    estado: Optional[str] = None,
+    after: Optional[str] = None,
+    offset: int = 0,
+) -> Tuple[List[dict], Optional[str]]:
+    """Devuelve (filas, cursor de la página siguiente o None)."""
+    params: List[Any] = [usuario_id]
+    if estado:
+        params.append(estado)
+    if after:
+        key = decode_cursor("my-tasks", after)
+        try:
+            params.extend([int(key["c"]), int(key["id"])])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidCursor(after)
+    # El archivo solo tiene tareas completadas
+    with_archive = not estado or estado == ESTADO_COMPLETADO
+    if with_archive:
+        params = params * 2
+    params.extend([limit, offset])
+    sql = _user_tasks_sql(bool(estado), bool(after), with_archive)
+    rows = [dict(row) for row in conn.execute(sql, params).fetchall()]
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = encode_cursor("my-tasks", c=rows[-1]["created_at"], id=rows[-1]["id"])
+    return [render_task_times(row) for row in rows], next_cursor
+
+
+# --- EXPORTACIÓN DEL HISTORIAL (orden por id) ---
+# Páginas cortas por clave en lugar de un cursor abierto durante toda la
+# descarga: cada página es su propia lectura y no retiene un snapshot que
+# impida hacer checkpoint del WAL mientras el cliente descarga.
+
+_EXPORT_SELECT = """
+    SELECT t.id AS id, t.usuario_id,
+           u.codigo AS codigo_estudiante, u.correo AS correo_estudiante,
+           u.nombre AS nombre_estudiante, u.apellido AS apellido_estudiante,
+           t.ubicacion, t.estado, t.descripcion_final,
+           t.mediador_id, m.codigo AS codigo_mediador, m.correo AS correo_mediador,
+           m.nombre AS mediador_nombre, m.apellido AS mediador_apellido,
+           t.created_at, t.assigned_at, t.resolved_at, t.completed_at,
+           {archivada} AS archivada
+    FROM {table} t
+    JOIN usuarios u ON t.usuario_id = u.id
+    LEFT JOIN usuarios m ON t.mediador_id = m.id
+"""
+
+
+def _export_sql(with_estado: bool, with_start: bool, with_end: bool, with_archive: bool) -> str:
+    where = (
+        " WHERE t.id > ?"
+        + (" AND t.estado = ?" if with_estado else "")
+        # "+" impide usar el índice (usuario_id, created_at), que obligaría a ordenar aparte
+        + (" AND +t.created_at >= ?" if with_start else "")
+        + (" AND +t.created_at < ?" if with_end else "")
+    )
+    sql = _EXPORT_SELECT.format(table="tasks", archivada=0) + where
+    if with_archive:
+        # Las dos partes recorren su clave en orden; SQLite las mezcla sin ordenar aparte
+        sql += " UNION ALL " + _EXPORT_SELECT.format(table=ARCHIVE_TABLE, archivada=1) + where
+    return sql + " ORDER BY id LIMIT ?"
+
+
+def fetch_export_page(
+    conn: sqlite3.Connection,
+    after_id: int,
+    limit: int,
+    estado: Optional[str] = None,
+    start_ms: Optional[int] = None,
+    end_ms: Optional[int] = None,
+) -> List[dict]:
+    """Siguiente página (id > after_id) de tareas de las dos tablas, con las columnas epoch sin renderizar."""
+    params: List[Any] = [after_id]
+    for value in (estado, start_ms, end_ms):
+        if value is not None:
+            params.append(value)
+    with_archive = not estado or estado == ESTADO_COMPLETADO
+    if with_archive:
+        params = params * 2
+    params.append(limit)
+    sql = _export_sql(estado is not None, start_ms is not None, end_ms is not None, with_archive)
+    return [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+
+# --- VERIFICACIÓN DE PLANES DE EJECUCIÓN ---
+
+PLAN_CHECKS = [
+    # (nombre, sql, parámetros, índice esperado para la tabla tasks o tasks_archivo)
+    ("search", _active_tasks_sql(False), (ESTADO_ACTIVO, 100, 0), "idx_tasks_estado_id"),
+    ("search_after", _active_tasks_sql(True), (ESTADO_ACTIVO, 1, 100, 0), "idx_tasks_estado_id"),
+    ("my_tasks", _user_tasks_sql(False, False), (1, 1, 100, 0), "idx_tasks_usuario_created"),
+    ("my_tasks_archivo", _user_tasks_sql(False, False), (1, 1, 100, 0), "idx_tasks_archivo_usuario_created"),
+    ("my_tasks_after", _user_tasks_sql(False, True), (1, 1, 1, 1, 1, 1, 100, 0), "idx_tasks_usuario_created"),
+    ("my_tasks_archivo_after", _user_tasks_sql(False, True), (1, 1, 1, 1, 1, 1, 100, 0),
+     "idx_tasks_archivo_usuario_created"),
+    ("my_tasks_estado_after", _user_tasks_sql(True, True, False), (1, ESTADO_ACTIVO, 1, 1, 100, 0),
+     "idx_tasks_usuario_created"),
+    ("export", _export_sql(False, True, True, True), (0, 0, 1, 0, 0, 1, 1000), "INTEGER PRIMARY KEY"),
+    ("export_estado", _export_sql(True, False, False, False), (0, ESTADO_ACTIVO, 1000), "idx_tasks_estado_id"),
+]
+
+
+def explain(conn: sqlite3.Connection, sql: str, params) -> List[str]:
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+
+def check_query_plans(conn: sqlite3.Connection) -> List[str]:
+    """Lista de problemas encontrados; vacía si todas las consultas usan sus índices."""
+    problems = []
+    for name, sql, params, index in PLAN_CHECKS:
+        plan = explain(conn, sql, params)
+        if not any(step.startswith("SEARCH t USING") and index in step for step in plan):
+            problems.append(f"{name}: no usa {index}: {plan}")
+        if any("USE TEMP B-TREE" in step for step in plan):
+            problems.append(f"{name}: ordena en un B-tree temporal: {plan}")
+        if any(step.startswith("SCAN") for step in plan):
+            problems.append(f"{name}: recorre una tabla completa: {plan}")
+    return problems
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    from dotenv import load_dotenv
+    from database import ConnectionPool
+    from migrations import migrate
+
+    load_dotenv()
+    pool = ConnectionPool(os.getenv("DATABASE_URL", "db/isaa.db"), max_size=1)
+    with pool.connection() as conn:
+        migrate(conn)
+        for name, sql, params, _ in PLAN_CHECKS:
+            print(f"{name}:")
+            for step in explain(conn, sql, params):
+                print(f"    {step}")
+        problems = check_query_plans(conn)
+    pool.close()
+    for problem in problems:
+        print(f"ERROR {problem}")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,216 @@
+"""
+Límites de carga: cubetas de fichas por usuario y un tope global de
+peticiones en curso.
+
+- TokenBucketLimiter: una cubeta por clave (el `sub` del access token) que se
+  rellena a `rate` fichas por segundo hasta `burst`. Una pestaña que consulta
+  /my-tasks/ en un bucle cerrado agota su cubeta y recibe 429 con
+  Retry-After, sin afectar a los demás usuarios. Lecturas y escrituras usan
+  cubetas separadas: el sondeo no consume el presupuesto de asignar o
+  resolver.
+- ConcurrencyLimiter: número máximo de peticiones admitidas a la vez. Pasado
+  el tope se responde 503 con Retry-After de inmediato, en lugar de dejar
+  que las peticiones esperen una conexión del pool hasta DB_POOL_TIMEOUT.
+- RateLimitMiddleware: middleware ASGI que aplica los dos.
+
+El botón de pánico (POST /my-tasks/) nunca se rechaza: no consume fichas y
+entra aunque el tope global esté lleno (cuenta como petición en curso). Las
+rutas de monitoreo (/health, /metrics) no pasan por ningún límite.
+
+Todo vive en la memoria del proceso: con varios workers (serve.py) cada uno
+lleva sus propias cubetas y su propio tope.
+"""
+from collections import OrderedDict
+from typing import Callable, Hashable, Iterable, Optional, Tuple
+import json
+import math
+import threading
+import time
+
+READ_METHODS = frozenset({"GET", "HEAD"})
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        if rate <= 0 or burst < 1 or max_keys < 1:
+            raise ValueError("Se requiere rate > 0, burst >= 1 y max_keys >= 1")
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # clave -> (fichas, instante de la última actualización), en orden de uso (LRU)
+        self._buckets: "OrderedDict[Hashable, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.allowed = 0
+        self.limited = 0
+        self.evictions = 0
+
+    def acquire(self, key: Hashable, cost: float = 1.0) -> float:
+        """Consume `cost` fichas de la cubeta. Devuelve 0 si se concede o los segundos hasta poder hacerlo."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+                self.allowed += 1
+            else:
+                wait = (cost - tokens) / self.rate
+                self.limited += 1
+            self._buckets[key] = (tokens, now)
+            # Desalojar la cubeta menos usada equivale a rellenarla: solo afecta a claves inactivas
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        return wait
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rate_per_second": self.rate,
+                "burst": self.burst,
+                "keys": len(self._buckets),
+                "max_keys": self.max_keys,
+                "allowed": self.allowed,
+                "limited": self.limited,
+                "evictions": self.evictions,
+            }
+
+
+class ConcurrencyLimiter:
+    def __init__(self, max_concurrent: int):
+        if max_concurrent < 1:
+            raise ValueError("El tope de peticiones en curso debe ser al menos 1")
+        self.max_concurrent = max_concurrent
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+        self.peak = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.over_limit = 0  # Peticiones exentas admitidas con el tope lleno
+
+    def try_acquire(self, exempt: bool = False) -> bool:
+        with self._lock:
+            if self._in_flight >= self.max_concurrent:
+                if not exempt:
+                    self.rejected += 1
+                    return False
+                self.over_limit += 1
+            self._in_flight += 1
+            self.admitted += 1
+            self.peak = max(self.peak, self._in_flight)
+            return True
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    @property
+    def in_flight(self) -> int:
+        with self._lock:
+            return self._in_flight
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "in_flight": self._in_flight,
+                "peak": self.peak,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "over_limit": self.over_limit,
+            }
+
+
+def _bearer_token(scope) -> Optional[str]:
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            return token.strip() if scheme.lower() == "bearer" and token.strip() else None
+    return None
+
+
+async def _reject(send, status: int, detail: str, retry_after: float):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class RateLimitMiddleware:
+    """
+    Middleware ASGI. Para cada petición HTTP:
+
+    1. Las rutas de `exclude` pasan sin límites.
+    2. Con un access token válido (`identify` devuelve su `sub`) se consume
+       una ficha de la cubeta de lectura (GET/HEAD) o de escritura del
+       usuario; sin ficha, 429. Sin token válido no hay cubeta: el endpoint
+       responderá 401.
+    3. Se pide un lugar en el tope global; lleno, 503. Las rutas de
+       `uncounted` no ocupan lugar: conexiones largas que casi no consultan
+       la base, o rutas con su propia cola acotada.
+
+    Las peticiones de `never_shed` (pares método, ruta) se saltan los pasos 2
+    y 3 pero ocupan lugar en el tope, así que sí cuentan para rechazar otras.
+    """
+
+    def __init__(
+        self,
+        app,
+        identify: Callable[[str], Optional[str]],
+        read_limiter: Optional[TokenBucketLimiter],
+        write_limiter: Optional[TokenBucketLimiter],
+        concurrency: Optional[ConcurrencyLimiter],
+        never_shed: Iterable[Tuple[str, str]] = (),
+        exclude: Iterable[str] = (),
+        uncounted: Iterable[str] = (),
+    ):
+        self.app = app
+        self.identify = identify
+        self.read_limiter = read_limiter
+        self.write_limiter = write_limiter
+        self.concurrency = concurrency
+        # Las rutas se comparan sin la barra final: POST /my-tasks también es el botón de pánico
+        self.never_shed = {(method, path.rstrip("/")) for method, path in never_shed}
+        self.exclude = set(exclude)
+        self.uncounted = set(uncounted)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        exempt = (method, scope["path"].rstrip("/")) in self.never_shed
+
+        if not exempt:
+            limiter = self.read_limiter if method in READ_METHODS else self.write_limiter
+            if limiter is not None:
+                token = _bearer_token(scope)
+                subject = self.identify(token) if token else None
+                if subject is not None:
+                    wait = limiter.acquire(subject)
+                    if wait > 0:
+                        await _reject(send, 429, "Demasiadas peticiones; reintente más tarde", wait)
+                        return
+
+        if self.concurrency is None or scope["path"] in self.uncounted:
+            await self.app(scope, receive, send)
+            return
+
+        if not self.concurrency.try_acquire(exempt=exempt):
+            await _reject(send, 503, "Servidor ocupado; reintente en unos segundos", 1)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.concurrency.release()
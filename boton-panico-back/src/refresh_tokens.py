@@ -0,0 +1,169 @@
+"""
+Tokens de renovación (refresh tokens) rotativos.
+
+El access token (JWT) dura ACCESS_TOKEN_EXPIRE_MINUTES. Antes, al vencer,
+la única forma de seguir era POST /token, que verifica la contraseña con
+bcrypt; con cientos de sesiones abiertas los vencimientos se volvían carga
+constante de bcrypt. Ahora el login entrega además un token de renovación, y
+POST /token/refresh lo cambia por un access token nuevo con una transacción
+corta y un SHA-256, sin bcrypt.
+
+- El token es un valor aleatorio de 256 bits; en la base solo se guarda su
+  SHA-256 (al ser aleatorio no hace falta un hash lento como bcrypt).
+- Rotación: cada uso marca el token como usado y emite otro de la misma
+  familia (la sesión iniciada en un login). El vencimiento se renueva en cada
+  uso: una sesión vence tras REFRESH_TOKEN_EXPIRE_DAYS sin actividad.
+- Detección de reúso: presentar un token ya usado significa que alguien más
+  lo tiene (o lo tuvo). Se revoca toda la familia y hay que volver a iniciar
+  sesión. Si el reúso ocurre dentro de `reuse_grace_ms` se trata como una
+  carrera entre pestañas del mismo navegador: no se revoca y el cliente
+  debe tomar el token que guardó la otra pestaña (RefreshRaced).
+- Cerrar sesión revoca la familia.
+
+    python refresh_tokens.py purge   # borra los tokens vencidos
+"""
+from typing import Optional, Tuple
+import hashlib
+import logging
+import secrets
+import sqlite3
+
+from transitions import immediate_transaction
+
+logger = logging.getLogger(__name__)
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+class RefreshTokenError(Exception):
+    """El token de renovación no se puede usar."""
+
+
+class InvalidRefreshToken(RefreshTokenError):
+    """No existe, venció o fue revocado."""
+
+
+class RefreshTokenReused(RefreshTokenError):
+    """Se presentó un token ya usado: se revocó su familia."""
+
+
+class RefreshRaced(RefreshTokenError):
+    """Otra petición acaba de rotar el mismo token (p. ej. otra pestaña)."""
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def generate_token() -> str:
+    return secrets.token_urlsafe(32)
+
+
+def generate_family_id() -> str:
+    return secrets.token_hex(8)
+
+
+def _insert(conn: sqlite3.Connection, usuario_id: int, family_id: str, ahora_ms: int, ttl_ms: int) -> str:
+    token = generate_token()
+    conn.execute(
+        """
+        INSERT INTO refresh_tokens (token_hash, usuario_id, family_id, created_at, expires_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (hash_token(token), usuario_id, family_id, ahora_ms, ahora_ms + ttl_ms),
+    )
+    return token
+
+
+def issue(conn: sqlite3.Connection, usuario_id: int, ahora_ms: int, ttl_ms: int) -> str:
+    """Token de una familia nueva (un login); devuelve el valor en claro, que no se guarda."""
+    with immediate_transaction(conn):
+        return _insert(conn, usuario_id, generate_family_id(), ahora_ms, ttl_ms)
+
+
+def rotate(
+    conn: sqlite3.Connection, token: str, ahora_ms: int, ttl_ms: int, reuse_grace_ms: int = 0
+) -> Tuple[dict, str]:
+    """Usa el token y emite el siguiente de su familia; devuelve (usuario, token nuevo)."""
+    with immediate_transaction(conn):
+        row = conn.execute(
+            """
+            SELECT r.id, r.family_id, r.expires_at, r.used_at, r.revoked_at,
+                   u.id AS usuario_id, u.codigo, u.rol
+            FROM refresh_tokens r JOIN usuarios u ON u.id = r.usuario_id
+            WHERE r.token_hash = ?
+            """,
+            (hash_token(token),),
+        ).fetchone()
+        if row is None or row["revoked_at"] is not None or row["expires_at"] <= ahora_ms:
+            raise InvalidRefreshToken()
+        if row["used_at"] is not None:
+            if ahora_ms - row["used_at"] <= reuse_grace_ms:
+                raise RefreshRaced()
+            _revoke_family(conn, row["family_id"], ahora_ms)
+            logger.warning(
+                f"Reúso de token de renovación del usuario {row['usuario_id']}: familia {row['family_id']} revocada"
+            )
+            # El raise deshace la transacción: la revocación necesita su propio COMMIT
+            conn.commit()
+            raise RefreshTokenReused()
+        conn.execute("UPDATE refresh_tokens SET used_at = ? WHERE id = ?", (ahora_ms, row["id"]))
+        new_token = _insert(conn, row["usuario_id"], row["family_id"], ahora_ms, ttl_ms)
+        return {"id": row["usuario_id"], "codigo": row["codigo"], "rol": row["rol"]}, new_token
+
+
+def _revoke_family(conn: sqlite3.Connection, family_id: str, ahora_ms: int) -> int:
+    return conn.execute(
+        "UPDATE refresh_tokens SET revoked_at = ? WHERE family_id = ? AND revoked_at IS NULL",
+        (ahora_ms, family_id),
+    ).rowcount
+
+
+def revoke(conn: sqlite3.Connection, token: str, ahora_ms: int) -> Optional[int]:
+    """Cierra la sesión del token (toda su familia); devuelve el usuario o None si no existe."""
+    with immediate_transaction(conn):
+        row = conn.execute(
+            "SELECT usuario_id, family_id FROM refresh_tokens WHERE token_hash = ?", (hash_token(token),)
+        ).fetchone()
+        if row is None:
+            return None
+        _revoke_family(conn, row["family_id"], ahora_ms)
+        return row["usuario_id"]
+
+
+def purge_expired(conn: sqlite3.Connection, ahora_ms: int, batch_size: int = 1000) -> int:
+    """Borra por lotes los tokens vencidos (un token vencido no se acepta ni cuenta como reúso)."""
+    total = 0
+    while True:
+        with immediate_transaction(conn):
+            deleted = conn.execute(
+                """
+                DELETE FROM refresh_tokens WHERE id IN (
+                    SELECT id FROM refresh_tokens WHERE expires_at <= ? LIMIT ?
+                )
+                """,
+                (ahora_ms, batch_size),
+            ).rowcount
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    from dotenv import load_dotenv
+    from database import ConnectionPool
+    from migrations import migrate
+    from timestamps import now_ms
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv()
+    if sys.argv[1:] != ["purge"]:
+        print(__doc__)
+        sys.exit(1)
+    pool = ConnectionPool(os.getenv("DATABASE_URL", "db/isaa.db"), max_size=1)
+    with pool.connection() as conn:
+        migrate(conn)
+        print(f"Tokens vencidos borrados: {purge_expired(conn, now_ms())}")
+    pool.close()
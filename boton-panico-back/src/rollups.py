@@ -0,0 +1,271 @@
+"""
+Tiempos de respuesta agregados (rollups) para los KPIs operativos.
+
+Tres métricas, cada una medida al ocurrir su transición:
+
+    asignacion   creación    -> asignación   (assign_task)
+    resolucion   asignación  -> resolución   (resolve_task)
+    formulario   resolución  -> completado   (complete_task)
+
+Cada transición suma su duración a un histograma por (métrica, mediador,
+hora) y por (métrica, mediador, día local) en la tabla `task_rollups`,
+dentro de la misma transacción que cambia el estado. /stats lee solo esas
+filas: el costo depende del rango pedido (horas o días × buckets), no del
+tamaño de `tasks`, y nunca recorre el historial.
+
+Los percentiles se estiman por interpolación lineal dentro del bucket, como
+histogram_quantile de Prometheus.
+
+El historial previo se agrega con un relleno por lotes (migración 7, o
+`python rollups.py backfill`). `rollup_estado.backfill_hasta` marca hasta qué
+id ya se procesó: mientras el relleno no termina, las transiciones de tareas
+con id mayor no se registran en vivo, porque el relleno las contará al
+llegar a ellas. `python rollups.py rebuild` borra los rollups y los rehace.
+"""
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import logging
+import sqlite3
+import time
+
+from timestamps import HOUR_MS, local_day_start
+
+logger = logging.getLogger(__name__)
+
+# métrica -> (columna de inicio, columna de fin)
+METRICS = {
+    "asignacion": ("created_at", "assigned_at"),
+    "resolucion": ("assigned_at", "resolved_at"),
+    "formulario": ("resolved_at", "completed_at"),
+}
+
+# Límites superiores de los buckets, en segundos; el último bucket es +Inf
+BUCKETS_SECONDS = (
+    1, 2, 5, 10, 15, 30, 45, 60, 90, 120, 180, 300, 450, 600, 900, 1200, 1800, 2700,
+    3600, 5400, 7200, 10800, 21600, 43200, 86400,
+)
+_BUCKETS_MS = tuple(b * 1000 for b in BUCKETS_SECONDS)
+
+BACKFILL_BATCH_SIZE = 2000
+
+_UPSERT = """
+    INSERT INTO task_rollups (metric, granularity, period_start, mediador_id, bucket, count, sum_ms)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (metric, granularity, period_start, mediador_id, bucket) DO UPDATE SET
+        count = count + excluded.count,
+        sum_ms = sum_ms + excluded.sum_ms
+"""
+
+# (métrica, granularidad, inicio del periodo, mediador, bucket) -> [conteo, suma ms]
+Key = Tuple[str, str, int, int, int]
+
+
+def bucket_index(duration_ms: int) -> int:
+    return bisect_left(_BUCKETS_MS, duration_ms)
+
+
+def _period_starts(end_ms: int) -> Tuple[Tuple[str, int], ...]:
+    return ("hora", end_ms - end_ms % HOUR_MS), ("dia", local_day_start(end_ms))
+
+
+def accumulate(totals: Dict[Key, List[int]], metric: str, task: dict):
+    """Suma la duración de `metric` de la fila `task` a `totals` (también la usa storage/memory.py)."""
+    start_column, end_column = METRICS[metric]
+    start, end = task.get(start_column), task.get(end_column)
+    # created_at = 0 marca filas heredadas con fecha ilegible
+    if not start or not end or end < start:
+        return
+    duration = end - start
+    bucket = bucket_index(duration)
+    for granularity, period_start in _period_starts(end):
+        entry = totals.setdefault((metric, granularity, period_start, task.get("mediador_id") or 0, bucket), [0, 0])
+        entry[0] += 1
+        entry[1] += duration
+
+
+def _write(conn: sqlite3.Connection, totals: Dict[Key, List[int]]):
+    conn.executemany(_UPSERT, [(*key, count, sum_ms) for key, (count, sum_ms) in totals.items()])
+
+
+# --- REGISTRO EN VIVO (dentro de la transacción de la transición) ---
+
+def record(conn: sqlite3.Connection, metric: str, task: dict):
+    """Suma la duración de `metric` de la fila `task` (columnas *_at sin renderizar)."""
+    hasta, completo = conn.execute("SELECT backfill_hasta, completo FROM rollup_estado WHERE id = 1").fetchone()
+    if not completo and task["id"] > hasta:
+        return  # El relleno todavía no llega a esta tarea y la contará él
+    totals: Dict[Key, List[int]] = {}
+    accumulate(totals, metric, task)
+    _write(conn, totals)
+
+
+# --- RELLENO DEL HISTORIAL ---
+
+def _backfill_batch(conn: sqlite3.Connection, batch_size: int) -> bool:
+    """Procesa el siguiente rango de ids en su propia transacción; True si queda trabajo."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        hasta, completo = conn.execute("SELECT backfill_hasta, completo FROM rollup_estado WHERE id = 1").fetchone()
+        if completo:
+            conn.commit()
+            return False
+        limite = hasta + batch_size
+        columns = "id, mediador_id, created_at, assigned_at, resolved_at, completed_at"
+        rows = conn.execute(
+            f"""
+            SELECT {columns} FROM tasks WHERE id > ? AND id <= ?
+            UNION ALL
+            SELECT {columns} FROM tasks_archivo WHERE id > ? AND id <= ?
+            """,
+            (hasta, limite, hasta, limite),
+        ).fetchall()
+        totals: Dict[Key, List[int]] = {}
+        for row in rows:
+            task = dict(row)
+            for metric in METRICS:
+                accumulate(totals, metric, task)
+        _write(conn, totals)
+        max_id = conn.execute(
+            "SELECT MAX(m) FROM (SELECT MAX(id) AS m FROM tasks UNION ALL SELECT MAX(id) FROM tasks_archivo)"
+        ).fetchone()[0] or 0
+        done = limite >= max_id
+        conn.execute(
+            "UPDATE rollup_estado SET backfill_hasta = ?, completo = ? WHERE id = 1",
+            (limite, int(done)),
+        )
+        conn.commit()
+        return not done
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def backfill(conn: sqlite3.Connection, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Agrega el historial pendiente por lotes; idempotente y seguro con varios workers a la vez."""
+    if conn.in_transaction:
+        conn.commit()
+    batches = 0
+    while _backfill_batch(conn, batch_size):
+        batches += 1
+        if batches % 50 == 0:
+            hasta = conn.execute("SELECT backfill_hasta FROM rollup_estado WHERE id = 1").fetchone()[0]
+            logger.info(f"Relleno de rollups: hasta la tarea {hasta}")
+        time.sleep(0.005)  # Ceder el lock de escritura entre lotes
+    return batches
+
+
+def rebuild(conn: sqlite3.Connection, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Borra los rollups y los vuelve a calcular desde tasks y tasks_archivo."""
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM task_rollups")
+        conn.execute("UPDATE rollup_estado SET backfill_hasta = 0, completo = 0 WHERE id = 1")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return backfill(conn, batch_size)
+
+
+# --- CONSULTA ---
+
+def percentile(counts: Sequence[int], q: float, sums_ms: Optional[Sequence[int]] = None) -> Optional[float]:
+    """
+    Percentil q (0-1), en segundos, de un histograma con los buckets de BUCKETS_SECONDS.
+
+    Dentro del bucket se interpola suponiendo una distribución uniforme. Con
+    `sums_ms` (suma por bucket) el intervalo se estrecha para que su media sea
+    la observada en el bucket: tareas de 0.1-0.3 s dan p50 ≈ 0.2, no 0.5 como
+    saldría de repartirlas por todo el bucket 0-1 s. La resolución sigue
+    siendo la del bucket: el resultado nunca sale de sus cotas.
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    for index, count in enumerate(counts):
+        if count and cumulative + count >= rank:
+            if index == len(BUCKETS_SECONDS):
+                return float(BUCKETS_SECONDS[-1])  # Bucket +Inf: solo se conoce la cota inferior
+            lower = BUCKETS_SECONDS[index - 1] if index else 0
+            upper = BUCKETS_SECONDS[index]
+            if sums_ms is not None:
+                mean = min(max(sums_ms[index] / count / 1000, lower), upper)
+                if mean <= (lower + upper) / 2:
+                    upper = 2 * mean - lower
+                else:
+                    lower = 2 * mean - upper
+            return round(lower + (upper - lower) * (rank - cumulative) / count, 1)
+        cumulative += count
+    return float(BUCKETS_SECONDS[-1])
+
+
+def summarize(counts: Sequence[int], sums_ms: Sequence[int], percentiles: Iterable[float]) -> dict:
+    """Conteo, media y percentiles de un histograma de aggregate() (conteos y sumas en ms por bucket)."""
+    total = sum(counts)
+    return {
+        "count": total,
+        "mean_seconds": round(sum(sums_ms) / total / 1000, 1) if total else None,
+        **{f"p{int(q * 100)}_seconds": percentile(counts, q, sums_ms) for q in percentiles},
+    }
+
+
+def query(
+    conn: sqlite3.Connection,
+    metric: str,
+    granularity: str,
+    start_ms: int,
+    end_ms: int,
+    mediador_id: Optional[int] = None,
+) -> List[dict]:
+    """Filas (period_start, mediador_id, bucket, count, sum_ms) de [start_ms, end_ms)."""
+    sql = """
+        SELECT period_start, mediador_id, bucket, count, sum_ms FROM task_rollups
+        WHERE metric = ? AND granularity = ? AND period_start >= ? AND period_start < ?
+    """
+    params: List = [metric, granularity, start_ms, end_ms]
+    if mediador_id is not None:
+        sql += " AND mediador_id = ?"
+        params.append(mediador_id)
+    return [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+
+def aggregate(rows: Iterable[dict], group_by: Optional[str]) -> Dict[Optional[int], Tuple[List[int], List[int]]]:
+    """Agrupa filas de query() por 'period_start', 'mediador_id' o nada (None): {grupo: (conteos, sumas ms) por bucket}."""
+    counts: Dict[Optional[int], List[int]] = {}
+    sums: Dict[Optional[int], List[int]] = {}
+    for row in rows:
+        group = row[group_by] if group_by else None
+        histogram = counts.setdefault(group, [0] * (len(BUCKETS_SECONDS) + 1))
+        histogram[row["bucket"]] += row["count"]
+        sums.setdefault(group, [0] * (len(BUCKETS_SECONDS) + 1))[row["bucket"]] += row["sum_ms"]
+    return {group: (histogram, sums[group]) for group, histogram in sorted(counts.items(), key=lambda i: i[0] or 0)}
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    from dotenv import load_dotenv
+    from database import ConnectionPool
+    from migrations import migrate
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv()
+    command = sys.argv[1] if len(sys.argv) > 1 else "backfill"
+    pool = ConnectionPool(os.getenv("DATABASE_URL", "db/isaa.db"), max_size=1)
+    with pool.connection() as conn:
+        migrate(conn)
+        if command == "backfill":
+            backfill(conn)
+        elif command == "rebuild":
+            rebuild(conn)
+        else:
+            print(__doc__)
+            sys.exit(1)
+        hasta, completo = conn.execute("SELECT backfill_hasta, completo FROM rollup_estado WHERE id = 1").fetchone()
+        filas = conn.execute("SELECT COUNT(*) FROM task_rollups").fetchone()[0]
+        print(f"Rollups: {filas} filas; relleno hasta la tarea {hasta} ({'completo' if completo else 'en curso'})")
+    pool.close()
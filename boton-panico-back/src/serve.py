@@ -0,0 +1,54 @@
+"""
+Arranque de producción: varios workers de uvicorn sobre la misma base WAL.
+
+`python main.py` sigue siendo el arranque de desarrollo (un proceso, con
+recarga automática). Éste aplica las migraciones una vez en el proceso
+principal y lanza WORKERS procesos que comparten el puerto; cada uno abre su
+propio pool de conexiones y se mantienen al día entre sí con el bus de
+cambios (bus.py), que main.py activa cuando WORKERS > 1.
+
+    python serve.py                      # WORKERS de .env, o un worker por núcleo
+    python serve.py --workers 4 --port 8000
+"""
+import argparse
+import logging
+import os
+
+from dotenv import load_dotenv
+import uvicorn
+
+from database import ConnectionPool
+from migrations import migrate, current_version
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Servidor de producción con varios workers")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", "0")),
+                        help="procesos (0 = uno por núcleo)")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count() or 1
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if os.getenv("STORAGE_BACKEND", "sqlite") == "sqlite":
+        database = os.getenv("DATABASE_URL", "db/isaa.db")
+        os.makedirs(os.path.dirname(database) or ".", exist_ok=True)
+        # Migrar antes de lanzar los workers para que no esperen todos el mismo lock
+        pool = ConnectionPool(database, max_size=1)
+        with pool.connection() as conn:
+            applied = migrate(conn)
+            logger.info(f"Esquema v{current_version(conn)} ({applied} migraciones aplicadas)")
+        pool.close()
+
+    # Los workers heredan el entorno: main.py lee WORKERS para activar el bus
+    os.environ["WORKERS"] = str(workers)
+    logger.info(f"Iniciando {workers} workers en {args.host}:{args.port}")
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=workers, proxy_headers=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Registro de consultas lentas con captura de EXPLAIN QUERY PLAN.
+
+Opt-in: con SLOW_QUERY_MS > 0 el pool abre sus conexiones con
+`connection_factory(log)`, cuyo cursor mide cada sentencia desde execute()
+hasta que se termina de leer (fetchall, fetchone sin más filas, close, o
+cuando el cursor se descarta). Sin SLOW_QUERY_MS el pool usa
+sqlite3.Connection tal cual y no hay ningún costo.
+
+Una sentencia que supera el umbral se registra con:
+
+- el SQL normalizado (espacios colapsados, literales reemplazados por ?);
+- la forma de los parámetros (tipos y longitudes, nunca los valores);
+- las filas leídas o afectadas;
+- el plan de EXPLAIN QUERY PLAN, capturado como máximo una vez por
+  sentencia normalizada cada `explain_ttl` segundos.
+
+Solo una fracción `sample_rate` de las sentencias lentas se escribe en el log;
+las estadísticas agregadas (para /admin/slow-queries) cuentan todas.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+import logging
+import random
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w?])-?\d+(?:\.\d+)?\b")
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+def normalize_sql(sql: str) -> str:
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def param_shapes(parameters: Any) -> List[str]:
+    """Tipo (y largo de textos/blobs) de cada parámetro, sin exponer valores."""
+    if isinstance(parameters, dict):
+        items = sorted(parameters.items())
+        return [f"{name}:{_shape(value)}" for name, value in items]
+    return [_shape(value) for value in (parameters or ())]
+
+
+def _shape(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}({len(value)})"
+    return type(value).__name__
+
+
+class _Stat:
+    __slots__ = ("sql", "count", "total", "max", "rows", "params", "plan", "plan_at", "last_seen")
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.params: List[str] = []
+        self.plan: Optional[List[str]] = None
+        self.plan_at = 0.0
+        self.last_seen = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "sql": self.sql,
+            "count": self.count,
+            "max_ms": round(self.max * 1000, 3),
+            "avg_ms": round(self.total * 1000 / self.count, 3),
+            "total_ms": round(self.total * 1000, 3),
+            "last_rows": self.rows,
+            "param_shapes": self.params,
+            "plan": self.plan,
+            "last_seen": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.last_seen)),
+        }
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms: float, sample_rate: float = 1.0, explain_ttl: float = 60.0, max_statements: int = 500):
+        self.threshold = threshold_ms / 1000
+        self.sample_rate = sample_rate
+        self.explain_ttl = explain_ttl
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _Stat] = {}
+        self.measured = 0  # Sentencias medidas (lentas o no)
+        self.slow = 0
+
+    def record(self, conn: sqlite3.Connection, sql: str, parameters: Any, seconds: float, rows: int):
+        with self._lock:
+            self.measured += 1
+        if seconds < self.threshold:
+            return
+        normalized = normalize_sql(sql)
+        now = time.time()
+        with self._lock:
+            self.slow += 1
+            stat = self._stats.get(normalized)
+            if stat is None:
+                if len(self._stats) >= self.max_statements:
+                    # Descartar la sentencia menos relevante para acotar la memoria
+                    victim = min(self._stats.values(), key=lambda s: s.max)
+                    del self._stats[victim.sql]
+                stat = self._stats[normalized] = _Stat(normalized)
+            stat.count += 1
+            stat.total += seconds
+            stat.max = max(stat.max, seconds)
+            stat.rows = rows
+            stat.params = param_shapes(parameters)
+            stat.last_seen = now
+            needs_plan = now - stat.plan_at > self.explain_ttl
+            if needs_plan:
+                stat.plan_at = now  # Un solo hilo captura el plan
+
+        if needs_plan:
+            plan = self._explain(conn, sql, parameters)
+            with self._lock:
+                stat.plan = plan
+        if random.random() < self.sample_rate:
+            logger.warning(
+                f"Consulta lenta ({seconds * 1000:.1f} ms, {rows} filas): {normalized} "
+                f"params={stat.params} plan={stat.plan}"
+            )
+
+    def _explain(self, conn: sqlite3.Connection, sql: str, parameters: Any) -> Optional[List[str]]:
+        if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+            return None
+        try:
+            # Método base: no se mide a sí mismo
+            rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, parameters or ()).fetchall()
+            return [row[3] for row in rows]
+        except sqlite3.Error as e:
+            return [f"(sin plan: {e})"]
+
+    def top(self, limit: int = 20, order_by: str = "max") -> List[dict]:
+        keys = {"max": lambda s: s.max, "total": lambda s: s.total, "count": lambda s: s.count}
+        with self._lock:
+            stats = sorted(self._stats.values(), key=keys[order_by], reverse=True)[:limit]
+            return [s.as_dict() for s in stats]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "threshold_ms": self.threshold * 1000,
+                "sample_rate": self.sample_rate,
+                "measured": self.measured,
+                "slow": self.slow,
+                "distinct_slow": len(self._stats),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.measured = 0
+            self.slow = 0
+
+
+def connection_factory(log: SlowQueryLog):
+    """Clase de conexión para sqlite3.connect(factory=...) que mide cada sentencia."""
+
+    class InstrumentedCursor(sqlite3.Cursor):
+        _pending = None  # [sql, parámetros, segundos acumulados, filas]
+
+        def _start(self, sql: str, parameters: Any, seconds: float, rows: int):
+            self._finish()
+            self._pending = [sql, parameters, seconds, rows]
+
+        def _add(self, seconds: float, rows: int):
+            if self._pending is not None:
+                self._pending[2] += seconds
+                self._pending[3] += rows
+
+        def _finish(self):
+            pending, self._pending = self._pending, None
+            if pending is not None:
+                sql, parameters, seconds, rows = pending
+                log.record(self.connection, sql, parameters, seconds, rows)
+
+        def execute(self, sql: str, parameters: Sequence = ()):
+            self._finish()
+            start = time.perf_counter()
+            try:
+                super().execute(sql, parameters)
+            finally:
+                # Si la sentencia devuelve filas se cuentan al leerlas; si no, rowcount
+                rows = 0 if self.description is not None else max(self.rowcount, 0)
+                self._start(sql, parameters, time.perf_counter() - start, rows)
+            return self
+
+        def executemany(self, sql: str, seq_of_parameters):
+            self._finish()
+            start = time.perf_counter()
+            try:
+                super().executemany(sql, seq_of_parameters)
+            finally:
+                self._start(sql, (), time.perf_counter() - start, max(self.rowcount, 0))
+                self._finish()
+            return self
+
+        def fetchone(self):
+            start = time.perf_counter()
+            row = super().fetchone()
+            self._add(time.perf_counter() - start, 1 if row is not None else 0)
+            if row is None:
+                self._finish()
+            return row
+
+        def fetchmany(self, size: int = None):
+            start = time.perf_counter()
+            rows = super().fetchmany(self.arraysize if size is None else size)
+            self._add(time.perf_counter() - start, len(rows))
+            if not rows:
+                self._finish()
+            return rows
+
+        def fetchall(self):
+            start = time.perf_counter()
+            rows = super().fetchall()
+            self._add(time.perf_counter() - start, len(rows))
+            self._finish()
+            return rows
+
+        def __next__(self):
+            start = time.perf_counter()
+            try:
+                row = super().__next__()
+            except StopIteration:
+                self._add(time.perf_counter() - start, 0)
+                self._finish()
+                raise
+            self._add(time.perf_counter() - start, 1)
+            return row
+
+        def close(self):
+            self._finish()
+            super().close()
+
+        def __del__(self):
+            self._finish()
+
+    class InstrumentedConnection(sqlite3.Connection):
+        def cursor(self, factory=InstrumentedCursor):
+            return super().cursor(factory)
+
+        def execute(self, sql: str, parameters: Sequence = ()):
+            return self.cursor().execute(sql, parameters)
+
+        def executemany(self, sql: str, seq_of_parameters):
+            return self.cursor().executemany(sql, seq_of_parameters)
+
+    return InstrumentedConnection
@@ -0,0 +1,14 @@
+"""
+Capa de almacenamiento de la API: interfaz `Storage` (storage/base.py) con
+una implementación en SQLite y otra en memoria. STORAGE_BACKEND elige cuál
+usa main.py.
+"""
+from storage.base import DuplicateUser, Page, Storage, StorageError
+from storage.memory import MemoryStorage
+from storage.sqlite import SQLiteStorage
+
+BACKENDS = ("sqlite", "memory")
+
+__all__ = [
+    "BACKENDS", "DuplicateUser", "MemoryStorage", "Page", "SQLiteStorage", "Storage", "StorageError",
+]
@@ -0,0 +1,180 @@
+"""
+Interfaz de almacenamiento de la API (repositorio de usuarios, tareas y
+transiciones).
+
+Los endpoints no escriben SQL: llaman a los métodos de un `Storage`. Hay
+dos implementaciones con el mismo comportamiento observable:
+
+- SQLiteStorage (storage/sqlite.py): la de producción. Delega en las
+  funciones ya afinadas (transitions.py, queries.py, archive.py, ...) y las
+  ejecuta en el pool de hilos de AsyncDatabase, con su tiempo máximo por
+  lectura; las escrituras nunca se interrumpen.
+- MemoryStorage (storage/memory.py): diccionarios indexados en el mismo
+  proceso, sin disco. Sirve para medir la lógica de la API sin I/O y para
+  pruebas.
+
+`python -m storage.conformance` ejecuta el mismo guion sobre las dos y
+compara sus resultados.
+
+Todos los métodos son corrutinas. Las filas de tareas tienen las columnas
+de TaskResponse con los tiempos ya renderizados (render_task_times), salvo
+export_page, que deja las columnas epoch. Los errores de dominio son los de
+transitions.py (ActorBusy, TaskNotInState), queries.InvalidCursor,
+refresh_tokens.RefreshTokenError y DuplicateUser.
+"""
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from transitions import ActorBusy, TaskNotInState, TransitionError  # noqa: F401 (reexportados)
+from queries import InvalidCursor  # noqa: F401
+
+Page = Tuple[List[dict], Optional[str]]  # (filas, cursor de la página siguiente o None)
+
+
+class StorageError(Exception):
+    """Error del almacenamiento que no es una regla de negocio."""
+
+
+class DuplicateUser(StorageError):
+    """Ya existe un usuario con ese código."""
+
+    def __init__(self, field: str):
+        super().__init__(field)
+        self.field = field
+
+
+class Storage(ABC):
+    name = "abstracto"
+
+    # --- CICLO DE VIDA ---
+
+    @abstractmethod
+    async def initialize(self, seed_password_hash: Optional[Callable[[str], str]] = None) -> str:
+        """Prepara el esquema; con `seed_password_hash` (re)crea los usuarios de prueba. Devuelve un resumen."""
+
+    def close(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+    # --- USUARIOS ---
+
+    @abstractmethod
+    async def get_user_by_codigo(self, codigo: str) -> Optional[dict]:
+        """Fila completa del usuario (incluye el hash de contraseña y caso_activo)."""
+
+    @abstractmethod
+    async def create_user(
+        self, codigo: str, correo: str, contrasena_hash: str, rol: str,
+        nombre: Optional[str], apellido: Optional[str],
+    ) -> int:
+        """Inserta el usuario y devuelve su id; DuplicateUser si el código ya existe."""
+
+    @abstractmethod
+    async def update_password_hash(self, usuario_id: int, contrasena_hash: str):
+        pass
+
+    @abstractmethod
+    async def list_mediators(self) -> List[dict]:
+        """Mediadores con los campos de UsuarioResponse, por id."""
+
+    @abstractmethod
+    async def find_existing_users(self, rows: list) -> Tuple[list, List[dict]]:
+        """Separa las filas de importación (user_import.ImportRow) cuyo código o correo ya existen."""
+
+    @abstractmethod
+    async def insert_users(self, rows: list) -> Tuple[list, List[dict]]:
+        """Inserta el lote de forma atómica; devuelve (insertadas, errores por duplicado)."""
+
+    # --- TRANSICIONES ---
+
+    @abstractmethod
+    async def create_task(self, usuario_id: int, ubicacion: str, ahora_ms: int) -> dict:
+        """Nueva tarea 'Activo' y caso_activo = 1 del usuario; ActorBusy si ya tenía caso."""
+
+    @abstractmethod
+    async def assign_task(self, task_id: int, mediador_id: int, ahora_ms: int) -> dict:
+        """Activo -> Pendiente; ActorBusy si el mediador tiene caso, TaskNotInState si la tarea no está 'Activo'."""
+
+    @abstractmethod
+    async def dispatch_next(self, mediador_id: int, ahora_ms: int) -> Optional[dict]:
+        """Asigna la tarea 'Activo' más antigua al mediador; None si no hay ninguna."""
+
+    @abstractmethod
+    async def resolve_task(self, task_id: int, mediador_id: int, ahora_ms: int) -> dict:
+        """Pendiente -> Pendiente Formulario y libera a los dos usuarios; TaskNotInState si no corresponde."""
+
+    @abstractmethod
+    async def complete_task(
+        self, task_id: int, usuario_id: int, ahora_ms: int, descripcion_final: Optional[str]
+    ) -> dict:
+        """Pendiente Formulario -> Completado; TaskNotInState si no corresponde."""
+
+    # --- LECTURAS DE TAREAS ---
+
+    @abstractmethod
+    async def get_task(self, task_id: int) -> Optional[dict]:
+        """Detalle de la tarea (activa o archivada), con el correo del mediador."""
+
+    @abstractmethod
+    async def get_mediator_active_task(self, mediador_id: int) -> Optional[dict]:
+        """La tarea 'Pendiente' del mediador, con el formato de get_task."""
+
+    @abstractmethod
+    async def list_user_tasks(
+        self, usuario_id: int, limit: int, estado: Optional[str] = None,
+        after: Optional[str] = None, offset: int = 0,
+    ) -> Page:
+        """Historial del usuario, más reciente primero, incluidas las archivadas."""
+
+    @abstractmethod
+    async def list_active_tasks(self, limit: int, after: Optional[str] = None, offset: int = 0) -> Page:
+        """Cola de tareas 'Activo', más antigua primero."""
+
+    @abstractmethod
+    async def all_active_tasks(self) -> List[dict]:
+        """La cola completa, para cargar y verificar active_index."""
+
+    @abstractmethod
+    async def count_open_queues(self) -> Dict[str, Any]:
+        """{'tasks': {estado: conteo} de los estados abiertos, 'busy_mediators': n}."""
+
+    @abstractmethod
+    async def export_page(
+        self, after_id: int, limit: int, estado: Optional[str] = None,
+        start_ms: Optional[int] = None, end_ms: Optional[int] = None,
+    ) -> List[dict]:
+        """Siguiente página por id de todas las tareas (export.py), con columnas epoch."""
+
+    @abstractmethod
+    async def response_time_rollups(
+        self, metric: str, granularity: str, start_ms: int, end_ms: int, mediador_id: Optional[int] = None,
+    ) -> List[dict]:
+        """Filas (period_start, mediador_id, bucket, count, sum_ms) para rollups.aggregate."""
+
+    # --- MANTENIMIENTO ---
+
+    @abstractmethod
+    async def archive_completed(self, cutoff_ms: int, batch_size: int) -> int:
+        """Mueve un lote de tareas completadas antes de `cutoff_ms` al archivo; devuelve cuántas."""
+
+    # --- TOKENS DE RENOVACIÓN (reglas en refresh_tokens.py) ---
+
+    @abstractmethod
+    async def issue_refresh_token(self, usuario_id: int, ahora_ms: int, ttl_ms: int) -> str:
+        pass
+
+    @abstractmethod
+    async def rotate_refresh_token(
+        self, token: str, ahora_ms: int, ttl_ms: int, reuse_grace_ms: int = 0
+    ) -> Tuple[dict, str]:
+        pass
+
+    @abstractmethod
+    async def revoke_refresh_token(self, token: str, ahora_ms: int) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    async def purge_refresh_tokens(self, ahora_ms: int) -> int:
+        pass
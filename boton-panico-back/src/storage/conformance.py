@@ -0,0 +1,417 @@
+"""
+Verificación de conformidad de los almacenamientos.
+
+Ejecuta los mismos escenarios sobre cada implementación de Storage, cada uno
+con un almacenamiento nuevo (SQLite en un archivo temporal), y comprueba dos
+cosas: las reglas que la API espera (guardas de transición, errores,
+paginación, archivo, tokens) y que todas las implementaciones devuelven
+exactamente lo mismo para las mismas llamadas.
+
+Desde boton-panico-back/src:
+
+    python -m storage.conformance
+    python -m storage.conformance --backend memory -v
+
+Termina con error si alguna comprobación falla o si las salidas difieren.
+Es el lugar para agregar un escenario cuando se agregue un método a Storage
+o una implementación nueva.
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+
+from active_index import ActiveTaskIndex
+from async_db import AsyncDatabase
+from database import ConnectionPool
+from events import EventBroker
+from versions import ChangeTracker
+from queries import InvalidCursor, encode_cursor
+from transitions import (
+    ActorBusy, TaskNotInState,
+    ESTADO_ACTIVO, ESTADO_PENDIENTE, ESTADO_PENDIENTE_FORMULARIO, ESTADO_COMPLETADO,
+)
+import refresh_tokens
+import rollups
+import user_import
+
+from storage import BACKENDS, DuplicateUser, MemoryStorage, SQLiteStorage, Storage
+
+T0 = 1_700_000_000_000  # Reloj fijo de los escenarios (ms)
+MINUTE = 60_000
+TTL = 7 * refresh_tokens.DAY_MS
+
+
+class ConformanceError(AssertionError):
+    pass
+
+
+def expect(condition: bool, message: str):
+    if not condition:
+        raise ConformanceError(message)
+
+
+async def expect_raises(error: type, call: Awaitable, message: str):
+    try:
+        await call
+    except error as e:
+        return e
+    raise ConformanceError(f"{message}: se esperaba {error.__name__}")
+
+
+async def add_users(storage: Storage, *specs: Tuple[str, str]) -> List[int]:
+    """(codigo, rol) -> ids, con correo y nombre derivados del código."""
+    return [
+        await storage.create_user(codigo, f"{codigo}@prueba.test", f"hash-{codigo}", rol, f"N{codigo}", f"A{codigo}")
+        for codigo, rol in specs
+    ]
+
+
+# --- ESCENARIOS (cada uno devuelve lo observado, para comparar entre implementaciones) ---
+
+async def scenario_users(storage: Storage) -> Dict[str, Any]:
+    est, med = await add_users(storage, ("e1", "usuario"), ("m1", "mediador"))
+    duplicate = await expect_raises(
+        DuplicateUser, storage.create_user("e1", "otro@prueba.test", "h", "usuario", None, None), "código repetido"
+    )
+    expect(duplicate.field == "codigo", "DuplicateUser debe indicar el campo 'codigo'")
+    await storage.update_password_hash(est, "hash-nuevo")
+    user = await storage.get_user_by_codigo("e1")
+    expect(user["contrasena"] == "hash-nuevo" and user["caso_activo"] == 0, "usuario leído tras cambiar el hash")
+    expect(await storage.get_user_by_codigo("nadie") is None, "usuario inexistente")
+
+    rows = [
+        user_import.ImportRow(line=2, codigo="e1", correo="x@prueba.test", contrasena="p", nombre=None, apellido=None, rol="usuario"),
+        user_import.ImportRow(line=3, codigo="e9", correo="m1@prueba.test", contrasena="p", nombre=None, apellido=None, rol="usuario"),
+        user_import.ImportRow(line=4, codigo="m2", correo="m2@prueba.test", contrasena="p", nombre="M", apellido="Dos", rol="mediador"),
+    ]
+    fresh, existing = await storage.find_existing_users(rows)
+    expect([row.codigo for row in fresh] == ["m2"], "find_existing_users descarta código y correo existentes")
+    for row in fresh:
+        row.hash = "hash-importado"
+    inserted, duplicated = await storage.insert_users(fresh)
+    expect(len(inserted) == 1 and not duplicated, "insert_users inserta el lote")
+    _, again = await storage.insert_users(fresh)
+    expect(len(again) == 1, "insert_users vuelve a verificar duplicados")
+    mediators = await storage.list_mediators()
+    expect([m["codigo"] for m in mediators] == ["m1", "m2"], "list_mediators en orden de id")
+    return {
+        "user": user, "existing": existing, "again": again, "mediators": mediators,
+        "ids": [est, med],
+    }
+
+
+async def scenario_lifecycle(storage: Storage) -> Dict[str, Any]:
+    est, est2, med, med2 = await add_users(
+        storage, ("e1", "usuario"), ("e2", "usuario"), ("m1", "mediador"), ("m2", "mediador")
+    )
+    created = await storage.create_task(est, "Biblioteca", T0)
+    expect(created["estado"] == ESTADO_ACTIVO and created["codigo_estudiante"] == "e1", "tarea creada")
+    await expect_raises(ActorBusy, storage.create_task(est, "Otra", T0 + 1), "segundo caso del mismo usuario")
+    other = await storage.create_task(est2, "Cafetería", T0 + 2)
+    expect((await storage.get_user_by_codigo("e1"))["caso_activo"] == 1, "caso_activo del estudiante")
+
+    await expect_raises(TaskNotInState, storage.assign_task(999, med, T0 + MINUTE), "asignar tarea inexistente")
+    expect((await storage.get_user_by_codigo("m1"))["caso_activo"] == 0, "guarda fallida no ocupa al mediador")
+    assigned = await storage.assign_task(created["id"], med, T0 + MINUTE)
+    expect(assigned["estado"] == ESTADO_PENDIENTE and assigned["mediador_nombre"] == "Nm1", "tarea asignada")
+    await expect_raises(ActorBusy, storage.assign_task(other["id"], med, T0 + MINUTE), "mediador ocupado")
+    await expect_raises(TaskNotInState, storage.assign_task(created["id"], med2, T0 + MINUTE), "tarea ya tomada")
+    queues = await storage.count_open_queues()
+    active_case = await storage.get_mediator_active_task(med)
+    expect(active_case["id"] == created["id"], "caso activo del mediador")
+    expect(await storage.get_mediator_active_task(med2) is None, "mediador sin caso")
+
+    await expect_raises(TaskNotInState, storage.resolve_task(created["id"], med2, T0 + 2 * MINUTE), "resolver ajena")
+    resolved = await storage.resolve_task(created["id"], med, T0 + 3 * MINUTE)
+    expect(resolved["estado"] == ESTADO_PENDIENTE_FORMULARIO, "tarea resuelta")
+    for codigo in ("e1", "m1"):
+        expect((await storage.get_user_by_codigo(codigo))["caso_activo"] == 0, f"{codigo} liberado al resolver")
+    await expect_raises(
+        TaskNotInState, storage.complete_task(created["id"], est2, T0 + 4 * MINUTE, "x"), "completar ajena"
+    )
+    completed = await storage.complete_task(created["id"], est, T0 + 5 * MINUTE, "Todo bien")
+    expect(completed["estado"] == ESTADO_COMPLETADO and completed["descripcion_final"] == "Todo bien", "completada")
+    await expect_raises(
+        TaskNotInState, storage.complete_task(created["id"], est, T0 + 6 * MINUTE, "x"), "completar dos veces"
+    )
+    return {
+        "created": created, "other": other, "assigned": assigned, "resolved": resolved, "completed": completed,
+        "queues_while_assigned": queues, "queues_after": await storage.count_open_queues(),
+        "details": await storage.get_task(created["id"]), "active_case": active_case,
+        "missing": await storage.get_task(999),
+    }
+
+
+async def scenario_dispatch(storage: Storage) -> Dict[str, Any]:
+    students = await add_users(storage, *[(f"e{i}", "usuario") for i in range(3)])
+    med, med2 = await add_users(storage, ("m1", "mediador"), ("m2", "mediador"))
+    expect(await storage.dispatch_next(med, T0) is None, "sin casos no se despacha")
+    tasks = [await storage.create_task(usuario_id, f"Lugar {i}", T0 + i) for i, usuario_id in enumerate(students)]
+    first = await storage.dispatch_next(med, T0 + MINUTE)
+    expect(first["id"] == tasks[0]["id"], "despacha la tarea más antigua")
+    await expect_raises(ActorBusy, storage.dispatch_next(med, T0 + MINUTE), "despachar a un mediador ocupado")
+    second = await storage.dispatch_next(med2, T0 + MINUTE)
+    expect(second["id"] == tasks[1]["id"], "FIFO")
+    remaining = await storage.all_active_tasks()
+    expect([task["id"] for task in remaining] == [tasks[2]["id"]], "cola tras despachar")
+    return {"first": first, "second": second, "remaining": remaining}
+
+
+async def scenario_active_index(storage: Storage) -> Dict[str, Any]:
+    """El índice de /search, cargado y verificado desde el almacenamiento, con la reacción de main.py a una corrección."""
+    students = await add_users(storage, *[(f"e{i}", "usuario") for i in range(3)])
+    versions, events = ChangeTracker(), EventBroker()
+
+    def corrected(differences: int):  # Lo mismo que main.on_active_index_corrected
+        versions.bump()
+        events.resync_all()
+
+    index = ActiveTaskIndex(on_corrected=corrected)
+    first = await storage.create_task(students[0], "Lugar 0", T0)
+    index.add(first)
+    expect(index.reconcile(await storage.all_active_tasks(), index.generation) == 0, "la carga inicial no es corrección")
+    etag = versions.etag("search", versions.global_version, 100, 0, None)
+    sub = events.subscribe()
+
+    # Escrituras que el índice no vio (otro proceso, cambios manuales)
+    await storage.create_task(students[1], "Lugar 1", T0 + 1)
+    await storage.create_task(students[2], "Lugar 2", T0 + 2)
+    differences = index.reconcile(await storage.all_active_tasks(), index.generation)
+    expect(differences == 2, "la verificación detecta las dos tareas faltantes")
+    rows, _ = index.fetch(100)
+    expect([row["id"] for row in rows] == [task["id"] for task in await storage.all_active_tasks()], "índice corregido")
+    expect(versions.etag("search", versions.global_version, 100, 0, None) != etag,
+           "un índice corregido cambia el ETag de /search")
+    await asyncio.sleep(0)  # resync_all entrega por call_soon_threadsafe
+    expect(sub.overflowed and not sub.queue.empty(), "un índice corregido fuerza un snapshot en el stream")
+    expect(events.events_since(0) is None, "tras corregir, un Last-Event-ID anterior no se reanuda")
+    return {"differences": differences, "rows": rows}
+
+
+async def scenario_pagination(storage: Storage) -> Dict[str, Any]:
+    est, med = await add_users(storage, ("e1", "usuario"), ("m1", "mediador"))
+    others = await add_users(storage, *[(f"o{i}", "usuario") for i in range(5)])
+    # Historial del estudiante: 6 tareas completadas, dos en el mismo milisegundo
+    for i, ahora in enumerate((T0, T0 + 1, T0 + 1, T0 + 5, T0 + 9, T0 + 12)):
+        task = await storage.create_task(est, f"Lugar {i}", ahora)
+        await storage.assign_task(task["id"], med, ahora + 1)
+        await storage.resolve_task(task["id"], med, ahora + 2)
+        await storage.complete_task(task["id"], est, ahora + 3, f"d{i}")
+    open_task = await storage.create_task(est, "Abierta", T0 + 20)
+    for i, usuario_id in enumerate(others):
+        await storage.create_task(usuario_id, f"Cola {i}", T0 + 30 + i)
+
+    pages, after = [], None
+    while True:
+        rows, after = await storage.list_user_tasks(est, 3, after=after)
+        pages.append([row["id"] for row in rows])
+        if after is None:
+            break
+    history = [task_id for page in pages for task_id in page]
+    expect(history[0] == open_task["id"] and len(history) == 7, "historial completo, más reciente primero")
+    by_offset, _ = await storage.list_user_tasks(est, 3, offset=3)
+    expect([row["id"] for row in by_offset] == history[3:6], "offset y cursor coinciden")
+    completed, _ = await storage.list_user_tasks(est, 10, estado=ESTADO_COMPLETADO)
+    expect(len(completed) == 6, "filtro por estado")
+    await expect_raises(InvalidCursor, storage.list_user_tasks(est, 3, after="no-es-un-cursor"), "cursor inválido")
+    await expect_raises(
+        InvalidCursor, storage.list_user_tasks(est, 3, after=encode_cursor("search", id=1)), "cursor de otra lista"
+    )
+
+    active_pages, after = [], None
+    while True:
+        rows, after = await storage.list_active_tasks(2, after=after)
+        active_pages.append([row["id"] for row in rows])
+        if after is None:
+            break
+    queue = await storage.all_active_tasks()
+    expect([task_id for page in active_pages for task_id in page] == [row["id"] for row in queue], "cola paginada")
+    expect([row["id"] for row in queue] == sorted(row["id"] for row in queue), "cola en orden FIFO")
+    await expect_raises(
+        InvalidCursor, storage.list_active_tasks(2, after=encode_cursor("my-tasks", c=1, id=1)), "cursor ajeno"
+    )
+    first_page, cursor = await storage.list_user_tasks(est, 3)
+    return {
+        "pages": pages, "active_pages": active_pages, "first_page": first_page, "cursor": cursor,
+        "completed": completed, "queue": queue, "offset_page": await storage.list_active_tasks(2, offset=4),
+    }
+
+
+async def scenario_archive_export(storage: Storage) -> Dict[str, Any]:
+    est, est2, med = await add_users(storage, ("e1", "usuario"), ("e2", "usuario"), ("m1", "mediador"))
+    ids = []
+    for day in range(4):
+        ahora = T0 + day * refresh_tokens.DAY_MS
+        task = await storage.create_task(est, f"Día {day}", ahora)
+        await storage.assign_task(task["id"], med, ahora + MINUTE)
+        await storage.resolve_task(task["id"], med, ahora + 2 * MINUTE)
+        await storage.complete_task(task["id"], est, ahora + 3 * MINUTE, f"d{day}")
+        ids.append(task["id"])
+    pending = await storage.create_task(est2, "Abierta", T0 + 4 * refresh_tokens.DAY_MS)
+
+    cutoff = T0 + 2 * refresh_tokens.DAY_MS
+    moved = [await storage.archive_completed(cutoff, 1), await storage.archive_completed(cutoff, 10)]
+    expect(moved == [1, 1] and await storage.archive_completed(cutoff, 10) == 0, "archivo por lotes")
+    archived = await storage.get_task(ids[0])
+    expect(archived is not None and archived["estado"] == ESTADO_COMPLETADO, "detalle de una tarea archivada")
+    history, _ = await storage.list_user_tasks(est, 10)
+    expect([row["id"] for row in history] == ids[::-1], "historial incluye el archivo")
+
+    export_all, after_id = [], 0
+    while True:
+        page = await storage.export_page(after_id, 2)
+        export_all.extend(page)
+        if len(page) < 2:
+            break
+        after_id = page[-1]["id"]
+    expect([row["id"] for row in export_all] == ids + [pending["id"]], "exportación en orden de id")
+    expect([row["archivada"] for row in export_all] == [1, 1, 0, 0, 0], "marca de archivada")
+    return {
+        "archived": archived, "history": history, "export": export_all,
+        "export_estado": await storage.export_page(0, 10, ESTADO_ACTIVO),
+        "export_range": await storage.export_page(
+            0, 10, ESTADO_COMPLETADO, T0 + refresh_tokens.DAY_MS, T0 + 3 * refresh_tokens.DAY_MS
+        ),
+    }
+
+
+async def scenario_rollups(storage: Storage) -> Dict[str, Any]:
+    students = await add_users(storage, *[(f"e{i}", "usuario") for i in range(4)])
+    mediators = await add_users(storage, ("m1", "mediador"), ("m2", "mediador"))
+    for i, usuario_id in enumerate(students):
+        mediador_id = mediators[i % 2]
+        ahora = T0 + i * 3_600_000
+        task = await storage.create_task(usuario_id, "Lugar", ahora)
+        await storage.assign_task(task["id"], mediador_id, ahora + (i + 1) * 7_000)
+        await storage.resolve_task(task["id"], mediador_id, ahora + (i + 1) * 90_000)
+        await storage.complete_task(task["id"], usuario_id, ahora + (i + 1) * 200_000, None)
+    result = {}
+    for metric in rollups.METRICS:
+        for granularity in ("hora", "dia"):
+            rows = await storage.response_time_rollups(metric, granularity, T0 - refresh_tokens.DAY_MS, T0 + 2 * refresh_tokens.DAY_MS)
+            result[f"{metric}-{granularity}"] = {
+                group: summary for group, summary in rollups.aggregate(rows, "mediador_id").items()
+            }
+            expect(sum(sum(counts) for counts, _ in result[f"{metric}-{granularity}"].values()) == 4, f"{metric}: 4 muestras")
+    only = await storage.response_time_rollups("asignacion", "dia", T0 - refresh_tokens.DAY_MS, T0 + 2 * refresh_tokens.DAY_MS, mediators[0])
+    result["mediador"] = rollups.aggregate(only, None)
+    return result
+
+
+async def scenario_refresh_tokens(storage: Storage) -> Dict[str, Any]:
+    (est,) = await add_users(storage, ("e1", "usuario"))
+    token = await storage.issue_refresh_token(est, T0, TTL)
+    user, second = await storage.rotate_refresh_token(token, T0 + 1000, TTL, 10_000)
+    expect(user == {"id": est, "codigo": "e1", "rol": "usuario"} and second != token, "rotación")
+    await expect_raises(refresh_tokens.RefreshRaced, storage.rotate_refresh_token(token, T0 + 5000, TTL, 10_000), "carrera")
+    await expect_raises(
+        refresh_tokens.RefreshTokenReused, storage.rotate_refresh_token(token, T0 + 60_000, TTL, 10_000), "reúso"
+    )
+    await expect_raises(
+        refresh_tokens.InvalidRefreshToken, storage.rotate_refresh_token(second, T0 + 61_000, TTL, 10_000),
+        "familia revocada tras el reúso",
+    )
+    await expect_raises(
+        refresh_tokens.InvalidRefreshToken, storage.rotate_refresh_token("desconocido", T0, TTL), "token desconocido"
+    )
+    session = await storage.issue_refresh_token(est, T0, TTL)
+    expect(await storage.revoke_refresh_token(session, T0 + 1) == est, "revocar devuelve el usuario")
+    expect(await storage.revoke_refresh_token("desconocido", T0) is None, "revocar token desconocido")
+    await expect_raises(refresh_tokens.InvalidRefreshToken, storage.rotate_refresh_token(session, T0 + 2, TTL), "revocado")
+    expiring = await storage.issue_refresh_token(est, T0, 1000)
+    await expect_raises(refresh_tokens.InvalidRefreshToken, storage.rotate_refresh_token(expiring, T0 + 1000, TTL), "vencido")
+    purged = await storage.purge_refresh_tokens(T0 + 1000)
+    expect(purged == 1, "purga de vencidos")
+    return {"user": user, "purged": purged, "purged_again": await storage.purge_refresh_tokens(T0 + 1000)}
+
+
+SCENARIOS: List[Tuple[str, Callable[[Storage], Awaitable[Dict[str, Any]]]]] = [
+    ("usuarios", scenario_users),
+    ("transiciones", scenario_lifecycle),
+    ("despacho", scenario_dispatch),
+    ("índice de casos activos", scenario_active_index),
+    ("paginación", scenario_pagination),
+    ("archivo y exportación", scenario_archive_export),
+    ("rollups", scenario_rollups),
+    ("tokens de renovación", scenario_refresh_tokens),
+]
+
+
+# --- EJECUCIÓN ---
+
+class _SQLiteFactory:
+    """Un archivo nuevo por escenario, con el mismo pool y executor que la API."""
+
+    def __init__(self):
+        self.workdir = tempfile.mkdtemp(prefix="isaa-conformidad-")
+        self.count = 0
+
+    def __call__(self) -> Storage:
+        self.count += 1
+        pool = ConnectionPool(os.path.join(self.workdir, f"escenario{self.count}.db"), max_size=2)
+        return SQLiteStorage(AsyncDatabase(pool, max_workers=2))
+
+    def cleanup(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def _differences(a: Any, b: Any, path: str = "") -> List[str]:
+    if isinstance(a, dict) and isinstance(b, dict):
+        found = [f"{path}.{key}: solo en una implementación" for key in a.keys() ^ b.keys()]
+        for key in a.keys() & b.keys():
+            found += _differences(a[key], b[key], f"{path}.{key}")
+        return found
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)) and len(a) == len(b):
+        return [d for i, (x, y) in enumerate(zip(a, b)) for d in _differences(x, y, f"{path}[{i}]")]
+    if hasattr(a, "__dict__") and hasattr(b, "__dict__"):
+        return _differences(vars(a), vars(b), path)
+    return [] if a == b else [f"{path}: {a!r} != {b!r}"]
+
+
+async def run(backends: List[str], verbose: bool = False) -> List[str]:
+    factories: Dict[str, Callable[[], Storage]] = {"memory": MemoryStorage}
+    sqlite_factory = _SQLiteFactory()
+    factories["sqlite"] = sqlite_factory
+    problems = []
+    try:
+        for name, scenario in SCENARIOS:
+            observed = {}
+            for backend in backends:
+                storage = factories[backend]()
+                try:
+                    await storage.initialize()
+                    observed[backend] = await scenario(storage)
+                    if verbose:
+                        print(f"  {backend:<8}{name}: ok")
+                except ConformanceError as e:
+                    problems.append(f"{backend} / {name}: {e}")
+                finally:
+                    storage.close()
+            passed = [b for b in backends if b in observed]
+            for backend in passed[1:]:
+                for difference in _differences(observed[passed[0]], observed[backend]):
+                    problems.append(f"{name}: {passed[0]} y {backend} difieren en {difference}")
+    finally:
+        sqlite_factory.cleanup()
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Conformidad de los almacenamientos")
+    parser.add_argument("--backend", choices=BACKENDS, action="append", help="Por defecto, todos")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    backends = args.backend or list(BACKENDS)
+    problems = asyncio.run(run(backends, args.verbose))
+    for problem in problems:
+        print(f"ERROR {problem}")
+    print(f"{len(SCENARIOS)} escenarios en {', '.join(backends)}: {'fallos' if problems else 'sin diferencias'}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
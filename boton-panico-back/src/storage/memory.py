@@ -0,0 +1,438 @@
+"""
+Almacenamiento en memoria, con diccionarios indexados.
+
+Mismo comportamiento observable que SQLiteStorage (mismas filas, mismos
+cursores, mismas reglas de transición y de tokens), sin disco ni hilos:
+sirve para medir la lógica de la API sin I/O (benchmarks/loadtest.py
+--storage memory) y para pruebas. Los datos se pierden al detener el
+proceso y no se comparten entre workers, así que main.py no lo acepta con
+WORKERS > 1.
+
+Índices que reemplazan a los de SQLite:
+
+- usuarios por id y por código; conteo de correos (importación);
+- tareas vivas y archivadas por id, y todos los ids en orden (exportación);
+- por usuario, las claves (created_at, id) ordenadas (/my-tasks/);
+- ids en estado 'Activo' ordenados (cola FIFO) y ids 'Completado' (archivo);
+- mediador -> su tarea 'Pendiente';
+- rollups con la misma clave que task_rollups (rollups.accumulate).
+
+Cada método corre completo en el event loop, sin puntos de espera, así que
+es atómico respecto de las demás peticiones (el equivalente de BEGIN
+IMMEDIATE). No es seguro llamarlo desde otros hilos.
+"""
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+
+from migrations import DEMO_USERS
+from queries import InvalidCursor, decode_cursor, encode_cursor
+from timestamps import format_local, render_task_times
+from transitions import (
+    ActorBusy, TaskNotInState,
+    ESTADO_ACTIVO, ESTADO_PENDIENTE, ESTADO_PENDIENTE_FORMULARIO, ESTADO_COMPLETADO,
+)
+import refresh_tokens
+import rollups
+import user_import
+
+from storage.base import DuplicateUser, Page, Storage
+
+logger = logging.getLogger(__name__)
+
+OPEN_ESTADOS = (ESTADO_ACTIVO, ESTADO_PENDIENTE, ESTADO_PENDIENTE_FORMULARIO)
+
+
+class MemoryStorage(Storage):
+    name = "memory"
+
+    def __init__(self):
+        self._users: Dict[int, dict] = {}
+        self._user_ids_by_codigo: Dict[str, int] = {}
+        self._correos: Counter = Counter()
+        self._mediator_ids = set()
+        self._next_user_id = 1
+
+        self._tasks: Dict[int, dict] = {}  # Tabla viva (columnas de tasks, tiempos epoch)
+        self._archive: Dict[int, dict] = {}  # Equivalente de tasks_archivo
+        self._task_ids: List[int] = []  # Todos, en orden (los ids solo crecen)
+        self._user_keys: Dict[int, List[Tuple[int, int]]] = {}  # usuario -> [(created_at, id)] ascendente
+        self._active_ids: List[int] = []
+        self._completed_ids: List[int] = []
+        self._pending_by_mediator: Dict[int, int] = {}
+        self._estado_counts: Counter = Counter()
+        self._next_task_id = 1
+
+        self._rollups: Dict[rollups.Key, List[int]] = {}
+
+        self._refresh: Dict[str, dict] = {}  # hash del token -> fila
+        self._families: Dict[str, List[str]] = {}
+        self._next_refresh_id = 1
+
+    # --- CICLO DE VIDA ---
+
+    async def initialize(self, seed_password_hash: Optional[Callable[[str], str]] = None) -> str:
+        if seed_password_hash:
+            common_pass_hash = seed_password_hash("a")
+            for rol, codigo, correo, nombre, apellido in DEMO_USERS:
+                user_id = self._user_ids_by_codigo.get(codigo)
+                if user_id is None:
+                    self._insert_user(codigo, correo, common_pass_hash, rol, nombre, apellido)
+                    continue
+                user = self._users[user_id]
+                self._correos[user["correo"]] -= 1
+                self._correos[correo] += 1
+                self._mediator_ids.discard(user_id)
+                user.update(rol=rol, correo=correo, contrasena=common_pass_hash, nombre=nombre, apellido=apellido)
+                if rol == "mediador":
+                    self._mediator_ids.add(user_id)
+        return f"en memoria, {len(self._users)} usuarios"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "users": len(self._users),
+            "tasks": len(self._tasks),
+            "archived": len(self._archive),
+            "active": len(self._active_ids),
+            "refresh_tokens": len(self._refresh),
+            "rollup_keys": len(self._rollups),
+        }
+
+    # --- USUARIOS ---
+
+    def _insert_user(self, codigo, correo, contrasena_hash, rol, nombre, apellido) -> int:
+        user_id = self._next_user_id
+        self._next_user_id += 1
+        # Mismas columnas y orden que SELECT * FROM usuarios
+        self._users[user_id] = {
+            "id": user_id, "rol": rol, "codigo": codigo, "correo": correo, "contrasena": contrasena_hash,
+            "nombre": nombre, "apellido": apellido, "caso_activo": 0,
+        }
+        self._user_ids_by_codigo[codigo] = user_id
+        self._correos[correo] += 1
+        if rol == "mediador":
+            self._mediator_ids.add(user_id)
+        return user_id
+
+    async def get_user_by_codigo(self, codigo: str) -> Optional[dict]:
+        user_id = self._user_ids_by_codigo.get(codigo)
+        return dict(self._users[user_id]) if user_id is not None else None
+
+    async def create_user(self, codigo, correo, contrasena_hash, rol, nombre, apellido) -> int:
+        if codigo in self._user_ids_by_codigo:
+            raise DuplicateUser("codigo")
+        return self._insert_user(codigo, correo, contrasena_hash, rol, nombre, apellido)
+
+    async def update_password_hash(self, usuario_id: int, contrasena_hash: str):
+        user = self._users.get(usuario_id)
+        if user is not None:
+            user["contrasena"] = contrasena_hash
+
+    async def list_mediators(self) -> List[dict]:
+        return [
+            {key: self._users[user_id][key] for key in ("id", "codigo", "correo", "rol", "nombre", "apellido", "caso_activo")}
+            for user_id in sorted(self._mediator_ids)
+        ]
+
+    def _split_existing(self, rows: list) -> Tuple[list, List[dict]]:
+        codigos = {row.codigo for row in rows if row.codigo in self._user_ids_by_codigo}
+        correos = {row.correo for row in rows if self._correos[row.correo] > 0}
+        return user_import.split_rows(rows, codigos, correos)
+
+    async def find_existing_users(self, rows: list) -> Tuple[list, List[dict]]:
+        return self._split_existing(rows)
+
+    async def insert_users(self, rows: list) -> Tuple[list, List[dict]]:
+        if not rows:
+            return [], []
+        fresh, errors = self._split_existing(rows)
+        for row in fresh:
+            self._insert_user(row.codigo, row.correo, row.hash, row.rol, row.nombre, row.apellido)
+        return fresh, errors
+
+    # --- FILAS DE TAREAS (mismas columnas que las consultas de SQLite) ---
+
+    def _find(self, task_id: int) -> Optional[dict]:
+        task = self._tasks.get(task_id)
+        return task if task is not None else self._archive.get(task_id)
+
+    def _task_row(self, task: dict) -> dict:
+        """Columnas de TaskResponse con los tiempos epoch (queries.TASK_SELECT, transitions.TASK_RETURNING)."""
+        student = self._users[task["usuario_id"]]
+        mediator = self._users.get(task["mediador_id"]) if task["mediador_id"] is not None else None
+        return {
+            "id": task["id"], "usuario_id": task["usuario_id"],
+            "codigo_estudiante": student["codigo"], "correo_estudiante": student["correo"],
+            "nombre_estudiante": student["nombre"], "apellido_estudiante": student["apellido"],
+            "ubicacion": task["ubicacion"], "estado": task["estado"], "fecha": task["fecha"],
+            "hora_creacion": task["hora_creacion"], "hora_asignacion": task["hora_asignacion"],
+            "hora_resolucion": task["hora_resolucion"], "hora_completado": task["hora_completado"],
+            "mediador_id": task["mediador_id"], "descripcion_final": task["descripcion_final"],
+            "created_at": task["created_at"], "assigned_at": task["assigned_at"],
+            "resolved_at": task["resolved_at"], "completed_at": task["completed_at"],
+            "mediador_nombre": mediator["nombre"] if mediator else None,
+            "mediador_apellido": mediator["apellido"] if mediator else None,
+        }
+
+    def _details_row(self, task: dict) -> dict:
+        """Columnas de storage.sqlite.get_task_details: sin nombre del mediador, con su correo."""
+        row = self._task_row(task)
+        del row["mediador_nombre"], row["mediador_apellido"]
+        mediator = self._users.get(task["mediador_id"]) if task["mediador_id"] is not None else None
+        row["mediador_correo"] = mediator["correo"] if mediator else None
+        return render_task_times(row)
+
+    def _export_row(self, task: dict, archivada: int) -> dict:
+        """Columnas de queries.fetch_export_page (tiempos epoch sin renderizar)."""
+        student = self._users[task["usuario_id"]]
+        mediator = self._users.get(task["mediador_id"]) if task["mediador_id"] is not None else None
+        return {
+            "id": task["id"], "usuario_id": task["usuario_id"],
+            "codigo_estudiante": student["codigo"], "correo_estudiante": student["correo"],
+            "nombre_estudiante": student["nombre"], "apellido_estudiante": student["apellido"],
+            "ubicacion": task["ubicacion"], "estado": task["estado"], "descripcion_final": task["descripcion_final"],
+            "mediador_id": task["mediador_id"],
+            "codigo_mediador": mediator["codigo"] if mediator else None,
+            "correo_mediador": mediator["correo"] if mediator else None,
+            "mediador_nombre": mediator["nombre"] if mediator else None,
+            "mediador_apellido": mediator["apellido"] if mediator else None,
+            "created_at": task["created_at"], "assigned_at": task["assigned_at"],
+            "resolved_at": task["resolved_at"], "completed_at": task["completed_at"],
+            "archivada": archivada,
+        }
+
+    def _set_estado(self, task: dict, estado: str):
+        self._estado_counts[task["estado"]] -= 1
+        self._estado_counts[estado] += 1
+        task["estado"] = estado
+
+    # --- TRANSICIONES (mismas guardas que transitions.py) ---
+
+    def _mark_busy(self, usuario_id: int):
+        user = self._users.get(usuario_id)
+        if user is None or user["caso_activo"] != 0:
+            raise ActorBusy(usuario_id)
+        user["caso_activo"] = 1
+
+    async def create_task(self, usuario_id: int, ubicacion: str, ahora_ms: int) -> dict:
+        self._mark_busy(usuario_id)
+        task_id = self._next_task_id
+        self._next_task_id += 1
+        fecha, hora = format_local(ahora_ms)
+        task = {
+            "id": task_id, "usuario_id": usuario_id, "ubicacion": ubicacion, "estado": ESTADO_ACTIVO,
+            "fecha": fecha, "hora_creacion": hora, "hora_asignacion": None, "hora_resolucion": None,
+            "hora_completado": None, "mediador_id": None, "descripcion_final": None,
+            "created_at": ahora_ms, "assigned_at": None, "resolved_at": None, "completed_at": None,
+        }
+        self._tasks[task_id] = task
+        self._task_ids.append(task_id)
+        insort(self._user_keys.setdefault(usuario_id, []), (ahora_ms, task_id))
+        self._active_ids.append(task_id)
+        self._estado_counts[ESTADO_ACTIVO] += 1
+        return render_task_times(self._task_row(task))
+
+    def _assign(self, task_id: int, mediador_id: int, ahora_ms: int) -> dict:
+        mediator = self._users.get(mediador_id)
+        if mediator is None or mediator["caso_activo"] != 0:
+            raise ActorBusy(mediador_id)
+        task = self._tasks.get(task_id)
+        if task is None or task["estado"] != ESTADO_ACTIVO:
+            raise TaskNotInState(task_id)
+        mediator["caso_activo"] = 1
+        self._set_estado(task, ESTADO_PENDIENTE)
+        task.update(mediador_id=mediador_id, hora_asignacion=format_local(ahora_ms)[1], assigned_at=ahora_ms)
+        del self._active_ids[bisect_left(self._active_ids, task_id)]
+        self._pending_by_mediator[mediador_id] = task_id
+        rollups.accumulate(self._rollups, "asignacion", task)
+        return render_task_times(self._task_row(task))
+
+    async def assign_task(self, task_id: int, mediador_id: int, ahora_ms: int) -> dict:
+        return self._assign(task_id, mediador_id, ahora_ms)
+
+    async def dispatch_next(self, mediador_id: int, ahora_ms: int) -> Optional[dict]:
+        if not self._active_ids:
+            return None
+        return self._assign(self._active_ids[0], mediador_id, ahora_ms)
+
+    async def resolve_task(self, task_id: int, mediador_id: int, ahora_ms: int) -> dict:
+        task = self._tasks.get(task_id)
+        if task is None or task["estado"] != ESTADO_PENDIENTE or task["mediador_id"] != mediador_id:
+            raise TaskNotInState(task_id)
+        self._set_estado(task, ESTADO_PENDIENTE_FORMULARIO)
+        task.update(hora_resolucion=format_local(ahora_ms)[1], resolved_at=ahora_ms)
+        self._pending_by_mediator.pop(mediador_id, None)
+        rollups.accumulate(self._rollups, "resolucion", task)
+        # Liberar al mediador y al usuario
+        for usuario_id in (mediador_id, task["usuario_id"]):
+            self._users[usuario_id]["caso_activo"] = 0
+        return render_task_times(self._task_row(task))
+
+    async def complete_task(self, task_id, usuario_id, ahora_ms, descripcion_final) -> dict:
+        task = self._tasks.get(task_id)
+        if task is None or task["estado"] != ESTADO_PENDIENTE_FORMULARIO or task["usuario_id"] != usuario_id:
+            raise TaskNotInState(task_id)
+        self._set_estado(task, ESTADO_COMPLETADO)
+        task.update(
+            hora_completado=format_local(ahora_ms)[1], completed_at=ahora_ms, descripcion_final=descripcion_final,
+        )
+        insort(self._completed_ids, task_id)
+        rollups.accumulate(self._rollups, "formulario", task)
+        return render_task_times(self._task_row(task))
+
+    # --- LECTURAS DE TAREAS ---
+
+    async def get_task(self, task_id: int) -> Optional[dict]:
+        task = self._find(task_id)
+        return self._details_row(task) if task is not None else None
+
+    async def get_mediator_active_task(self, mediador_id: int) -> Optional[dict]:
+        task_id = self._pending_by_mediator.get(mediador_id)
+        return self._details_row(self._tasks[task_id]) if task_id is not None else None
+
+    async def list_user_tasks(self, usuario_id, limit, estado=None, after=None, offset=0) -> Page:
+        keys = self._user_keys.get(usuario_id, [])
+        end = len(keys)
+        if after:
+            key = decode_cursor("my-tasks", after)
+            try:
+                end = bisect_left(keys, (int(key["c"]), int(key["id"])))
+            except (KeyError, TypeError, ValueError):
+                raise InvalidCursor(after)
+        rows = []
+        skipped = 0
+        # Más reciente primero: (created_at, id) descendente, como el ORDER BY de queries.py
+        for index in range(end - 1, -1, -1):
+            task = self._find(keys[index][1])
+            if estado and task["estado"] != estado:
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            rows.append(self._task_row(task))
+            if len(rows) == limit:
+                break
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = encode_cursor("my-tasks", c=rows[-1]["created_at"], id=rows[-1]["id"])
+        return [render_task_times(row) for row in rows], next_cursor
+
+    async def list_active_tasks(self, limit, after=None, offset=0) -> Page:
+        start = 0
+        if after:
+            try:
+                start = bisect_right(self._active_ids, int(decode_cursor("search", after)["id"]))
+            except (KeyError, TypeError, ValueError):
+                raise InvalidCursor(after)
+        start += offset
+        rows = [render_task_times(self._task_row(self._tasks[task_id])) for task_id in self._active_ids[start:start + limit]]
+        next_cursor = encode_cursor("search", id=rows[-1]["id"]) if len(rows) == limit else None
+        return rows, next_cursor
+
+    async def all_active_tasks(self) -> List[dict]:
+        return [render_task_times(self._task_row(self._tasks[task_id])) for task_id in self._active_ids]
+
+    async def count_open_queues(self) -> Dict[str, Any]:
+        return {
+            "tasks": {estado: self._estado_counts[estado] for estado in OPEN_ESTADOS},
+            "busy_mediators": sum(1 for user_id in self._mediator_ids if self._users[user_id]["caso_activo"] == 1),
+        }
+
+    async def export_page(self, after_id, limit, estado=None, start_ms=None, end_ms=None) -> List[dict]:
+        rows = []
+        for index in range(bisect_right(self._task_ids, after_id), len(self._task_ids)):
+            task_id = self._task_ids[index]
+            task = self._tasks.get(task_id)
+            archivada = 0
+            if task is None:
+                task, archivada = self._archive[task_id], 1
+            if estado is not None and task["estado"] != estado:
+                continue
+            if start_ms is not None and task["created_at"] < start_ms:
+                continue
+            if end_ms is not None and task["created_at"] >= end_ms:
+                continue
+            rows.append(self._export_row(task, archivada))
+            if len(rows) == limit:
+                break
+        return rows
+
+    async def response_time_rollups(self, metric, granularity, start_ms, end_ms, mediador_id=None) -> List[dict]:
+        return [
+            {"period_start": period_start, "mediador_id": mediador, "bucket": bucket, "count": count, "sum_ms": sum_ms}
+            for (key_metric, key_granularity, period_start, mediador, bucket), (count, sum_ms) in self._rollups.items()
+            if key_metric == metric and key_granularity == granularity and start_ms <= period_start < end_ms
+            and (mediador_id is None or mediador == mediador_id)
+        ]
+
+    # --- MANTENIMIENTO ---
+
+    async def archive_completed(self, cutoff_ms: int, batch_size: int) -> int:
+        moved = [
+            task_id for task_id in self._completed_ids
+            if (self._tasks[task_id]["completed_at"] or self._tasks[task_id]["created_at"]) < cutoff_ms
+        ][:batch_size]
+        for task_id in moved:
+            self._archive[task_id] = self._tasks.pop(task_id)
+            self._estado_counts[ESTADO_COMPLETADO] -= 1
+        if moved:
+            archived = set(moved)
+            self._completed_ids = [task_id for task_id in self._completed_ids if task_id not in archived]
+        return len(moved)
+
+    # --- TOKENS DE RENOVACIÓN (mismas reglas que refresh_tokens.py) ---
+
+    def _insert_refresh(self, usuario_id: int, family_id: str, ahora_ms: int, ttl_ms: int) -> str:
+        token = refresh_tokens.generate_token()
+        token_hash = refresh_tokens.hash_token(token)
+        self._refresh[token_hash] = {
+            "id": self._next_refresh_id, "usuario_id": usuario_id, "family_id": family_id,
+            "created_at": ahora_ms, "expires_at": ahora_ms + ttl_ms, "used_at": None, "revoked_at": None,
+        }
+        self._next_refresh_id += 1
+        self._families.setdefault(family_id, []).append(token_hash)
+        return token
+
+    def _revoke_family(self, family_id: str, ahora_ms: int):
+        for token_hash in self._families.get(family_id, ()):
+            row = self._refresh[token_hash]
+            if row["revoked_at"] is None:
+                row["revoked_at"] = ahora_ms
+
+    async def issue_refresh_token(self, usuario_id: int, ahora_ms: int, ttl_ms: int) -> str:
+        return self._insert_refresh(usuario_id, refresh_tokens.generate_family_id(), ahora_ms, ttl_ms)
+
+    async def rotate_refresh_token(self, token, ahora_ms, ttl_ms, reuse_grace_ms=0) -> Tuple[dict, str]:
+        row = self._refresh.get(refresh_tokens.hash_token(token))
+        user = self._users.get(row["usuario_id"]) if row is not None else None
+        if user is None or row["revoked_at"] is not None or row["expires_at"] <= ahora_ms:
+            raise refresh_tokens.InvalidRefreshToken()
+        if row["used_at"] is not None:
+            if ahora_ms - row["used_at"] <= reuse_grace_ms:
+                raise refresh_tokens.RefreshRaced()
+            self._revoke_family(row["family_id"], ahora_ms)
+            logger.warning(
+                f"Reúso de token de renovación del usuario {user['id']}: familia {row['family_id']} revocada"
+            )
+            raise refresh_tokens.RefreshTokenReused()
+        row["used_at"] = ahora_ms
+        new_token = self._insert_refresh(user["id"], row["family_id"], ahora_ms, ttl_ms)
+        return {"id": user["id"], "codigo": user["codigo"], "rol": user["rol"]}, new_token
+
+    async def revoke_refresh_token(self, token: str, ahora_ms: int) -> Optional[int]:
+        row = self._refresh.get(refresh_tokens.hash_token(token))
+        if row is None:
+            return None
+        self._revoke_family(row["family_id"], ahora_ms)
+        return row["usuario_id"]
+
+    async def purge_refresh_tokens(self, ahora_ms: int) -> int:
+        expired = [token_hash for token_hash, row in self._refresh.items() if row["expires_at"] <= ahora_ms]
+        for token_hash in expired:
+            family_id = self._refresh.pop(token_hash)["family_id"]
+            self._families[family_id].remove(token_hash)
+            if not self._families[family_id]:
+                del self._families[family_id]
+        return len(expired)
@@ -0,0 +1,242 @@
+"""
+Almacenamiento en SQLite (el de producción).
+
+Las consultas son las de siempre: transitions.py, queries.py, archive.py,
+rollups.py, refresh_tokens.py y user_import.py, más las de usuarios y
+detalle de tarea que antes estaban en main.py. Cada método ejecuta una
+función `fn(conn, ...)` en el pool de hilos de AsyncDatabase, así que las
+métricas por consulta conservan sus nombres (select_user, fetch_user_tasks,
+create_task, ...).
+
+Las lecturas usan el tiempo máximo de AsyncDatabase (DB_QUERY_TIMEOUT_SECONDS);
+las escrituras pasan timeout=None para no interrumpir una transacción que ya
+hizo COMMIT. Los errores de la base (PoolTimeoutError, QueryTimeoutError,
+sqlite3.Error) se propagan tal cual: main.run_db los traduce a 503/500.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import os
+import sqlite3
+
+from async_db import AsyncDatabase
+from migrations import current_version, migrate, seed_demo_users
+from queries import ARCHIVE_TABLE, fetch_active_tasks, fetch_all_active_tasks, fetch_export_page, fetch_user_tasks
+from timestamps import render_task_times
+import archive
+import refresh_tokens
+import rollups
+import transitions
+import user_import
+
+from storage.base import DuplicateUser, Page, Storage
+
+
+# --- USUARIOS ---
+
+def select_user(conn: sqlite3.Connection, codigo: str) -> Optional[dict]:
+    user = conn.execute("SELECT * FROM usuarios WHERE codigo = ?", (codigo,)).fetchone()
+    return dict(user) if user else None
+
+
+def insert_user(
+    conn: sqlite3.Connection, codigo: str, correo: str, contrasena_hash: str, rol: str,
+    nombre: Optional[str], apellido: Optional[str],
+) -> int:
+    try:
+        cursor = conn.execute(
+            """
+            INSERT INTO usuarios (codigo, correo, contrasena, rol, nombre, apellido, caso_activo)
+            VALUES (?, ?, ?, ?, ?, ?, 0)
+            """,
+            (codigo, correo, contrasena_hash, rol, nombre, apellido),
+        )
+        conn.commit()
+    except sqlite3.IntegrityError as e:
+        conn.rollback()
+        for field in ("codigo", "correo"):
+            if f"UNIQUE constraint failed: usuarios.{field}" in str(e):
+                raise DuplicateUser(field)
+        raise
+    return cursor.lastrowid
+
+
+def store_password_hash(conn: sqlite3.Connection, usuario_id: int, new_hash: str):
+    conn.execute("UPDATE usuarios SET contrasena = ? WHERE id = ?", (new_hash, usuario_id))
+    conn.commit()
+
+
+def select_mediadores(conn: sqlite3.Connection) -> List[dict]:
+    rows = conn.execute(
+        "SELECT id, codigo, correo, rol, nombre, apellido, caso_activo FROM usuarios WHERE rol = 'mediador'"
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+# --- DETALLE DE TAREAS ---
+
+_TASK_DETAILS = """
+    SELECT
+        t.id, t.usuario_id,
+        u.codigo as codigo_estudiante, u.correo as correo_estudiante,
+        u.nombre as nombre_estudiante, u.apellido as apellido_estudiante,
+        t.ubicacion, t.estado, t.fecha, t.hora_creacion,
+        t.hora_asignacion, t.hora_resolucion, t.hora_completado,
+        t.mediador_id, t.descripcion_final,
+        t.created_at, t.assigned_at, t.resolved_at, t.completed_at,
+        m.correo as mediador_correo
+    FROM {table} t
+    JOIN usuarios u ON t.usuario_id = u.id
+    LEFT JOIN usuarios m ON t.mediador_id = m.id
+"""
+
+
+def get_task_details(conn: sqlite3.Connection, task_id: int) -> Optional[dict]:
+    """La tarea con los datos del estudiante y el correo del mediador."""
+    # Primero la tabla viva; si no está, puede haberse archivado (archive.py)
+    for table in ("tasks", ARCHIVE_TABLE):
+        task_data = conn.execute(_TASK_DETAILS.format(table=table) + " WHERE t.id = ?", (task_id,)).fetchone()
+        if task_data:
+            return render_task_times(dict(task_data))
+    return None
+
+
+def get_mediator_active_task(conn: sqlite3.Connection, mediador_id: int) -> Optional[dict]:
+    """La tarea 'Pendiente' asignada al mediador; por definición, su caso activo."""
+    # Una sola consulta por idx_tasks_mediador_id; una tarea 'Pendiente' nunca está archivada
+    row = conn.execute(
+        _TASK_DETAILS.format(table="tasks") + " WHERE t.mediador_id = ? AND t.estado = ?",
+        (mediador_id, transitions.ESTADO_PENDIENTE),
+    ).fetchone()
+    return render_task_times(dict(row)) if row else None
+
+
+def count_open_queues(conn: sqlite3.Connection) -> Dict[str, Any]:
+    estados = (
+        transitions.ESTADO_ACTIVO, transitions.ESTADO_PENDIENTE, transitions.ESTADO_PENDIENTE_FORMULARIO,
+    )
+    counts = {estado: 0 for estado in estados}
+    rows = conn.execute(
+        "SELECT estado, COUNT(*) FROM tasks WHERE estado IN (?, ?, ?) GROUP BY estado", estados
+    ).fetchall()
+    counts.update({row[0]: row[1] for row in rows})
+    busy = conn.execute(
+        "SELECT COUNT(*) FROM usuarios WHERE rol = 'mediador' AND caso_activo = 1"
+    ).fetchone()[0]
+    return {"tasks": counts, "busy_mediators": busy}
+
+
+def initialize_schema(conn: sqlite3.Connection, seed_password_hash: Optional[Callable[[str], str]]) -> str:
+    applied = migrate(conn)
+    if seed_password_hash:
+        seed_demo_users(conn, seed_password_hash)
+    return f"esquema v{current_version(conn)}, {applied} migraciones aplicadas"
+
+
+# --- IMPLEMENTACIÓN ---
+
+class SQLiteStorage(Storage):
+    name = "sqlite"
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+
+    async def _read(self, fn, *args):
+        return await self.db.run(fn, *args)
+
+    async def _write(self, fn, *args):
+        return await self.db.run(fn, *args, timeout=None)
+
+    # --- CICLO DE VIDA ---
+
+    async def initialize(self, seed_password_hash: Optional[Callable[[str], str]] = None) -> str:
+        os.makedirs(os.path.dirname(self.db.pool.database) or ".", exist_ok=True)
+        return await self._write(initialize_schema, seed_password_hash)
+
+    def close(self):
+        self.db.shutdown()
+        self.db.pool.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "database": self.db.pool.database}
+
+    # --- USUARIOS ---
+
+    async def get_user_by_codigo(self, codigo: str) -> Optional[dict]:
+        return await self._read(select_user, codigo)
+
+    async def create_user(self, codigo, correo, contrasena_hash, rol, nombre, apellido) -> int:
+        return await self._write(insert_user, codigo, correo, contrasena_hash, rol, nombre, apellido)
+
+    async def update_password_hash(self, usuario_id: int, contrasena_hash: str):
+        await self._write(store_password_hash, usuario_id, contrasena_hash)
+
+    async def list_mediators(self) -> List[dict]:
+        return await self._read(select_mediadores)
+
+    async def find_existing_users(self, rows: list) -> Tuple[list, List[dict]]:
+        return await self._read(user_import.find_existing, rows)
+
+    async def insert_users(self, rows: list) -> Tuple[list, List[dict]]:
+        return await self._write(user_import.insert_rows, rows)
+
+    # --- TRANSICIONES ---
+
+    async def create_task(self, usuario_id: int, ubicacion: str, ahora_ms: int) -> dict:
+        return await self._write(transitions.create_task, usuario_id, ubicacion, ahora_ms)
+
+    async def assign_task(self, task_id: int, mediador_id: int, ahora_ms: int) -> dict:
+        return await self._write(transitions.assign_task, task_id, mediador_id, ahora_ms)
+
+    async def dispatch_next(self, mediador_id: int, ahora_ms: int) -> Optional[dict]:
+        return await self._write(transitions.dispatch_next, mediador_id, ahora_ms)
+
+    async def resolve_task(self, task_id: int, mediador_id: int, ahora_ms: int) -> dict:
+        return await self._write(transitions.resolve_task, task_id, mediador_id, ahora_ms)
+
+    async def complete_task(self, task_id, usuario_id, ahora_ms, descripcion_final) -> dict:
+        return await self._write(transitions.complete_task, task_id, usuario_id, ahora_ms, descripcion_final)
+
+    # --- LECTURAS DE TAREAS ---
+
+    async def get_task(self, task_id: int) -> Optional[dict]:
+        return await self._read(get_task_details, task_id)
+
+    async def get_mediator_active_task(self, mediador_id: int) -> Optional[dict]:
+        return await self._read(get_mediator_active_task, mediador_id)
+
+    async def list_user_tasks(self, usuario_id, limit, estado=None, after=None, offset=0) -> Page:
+        return await self._read(fetch_user_tasks, usuario_id, limit, estado, after, offset)
+
+    async def list_active_tasks(self, limit, after=None, offset=0) -> Page:
+        return await self._read(fetch_active_tasks, limit, after, offset)
+
+    async def all_active_tasks(self) -> List[dict]:
+        return await self._read(fetch_all_active_tasks)
+
+    async def count_open_queues(self) -> Dict[str, Any]:
+        return await self._read(count_open_queues)
+
+    async def export_page(self, after_id, limit, estado=None, start_ms=None, end_ms=None) -> List[dict]:
+        return await self._read(fetch_export_page, after_id, limit, estado, start_ms, end_ms)
+
+    async def response_time_rollups(self, metric, granularity, start_ms, end_ms, mediador_id=None) -> List[dict]:
+        return await self._read(rollups.query, metric, granularity, start_ms, end_ms, mediador_id)
+
+    # --- MANTENIMIENTO ---
+
+    async def archive_completed(self, cutoff_ms: int, batch_size: int) -> int:
+        # Un lote por llamada: la conexión vuelve al pool entre lotes
+        return await self._write(archive.archive_step, cutoff_ms, batch_size)
+
+    # --- TOKENS DE RENOVACIÓN ---
+
+    async def issue_refresh_token(self, usuario_id: int, ahora_ms: int, ttl_ms: int) -> str:
+        return await self._write(refresh_tokens.issue, usuario_id, ahora_ms, ttl_ms)
+
+    async def rotate_refresh_token(self, token, ahora_ms, ttl_ms, reuse_grace_ms=0) -> Tuple[dict, str]:
+        return await self._write(refresh_tokens.rotate, token, ahora_ms, ttl_ms, reuse_grace_ms)
+
+    async def revoke_refresh_token(self, token: str, ahora_ms: int) -> Optional[int]:
+        return await self._write(refresh_tokens.revoke, token, ahora_ms)
+
+    async def purge_refresh_tokens(self, ahora_ms: int) -> int:
+        return await self._write(refresh_tokens.purge_expired, ahora_ms)
@@ -0,0 +1,91 @@
+"""
+Marcas de tiempo de las tareas.
+
+Los tiempos se guardan como milisegundos desde epoch (UTC) en las columnas
+created_at, assigned_at, resolved_at y completed_at, que se pueden ordenar
+e indexar. La API sigue mostrando los textos de siempre ('fecha' dd/mm/YYYY
+y horas HH:MM en hora de Ciudad de México), ahora derivados de esas columnas.
+"""
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Optional, Tuple
+import logging
+import time
+import zoneinfo
+
+logger = logging.getLogger(__name__)
+
+try:
+    LOCAL_TZ = zoneinfo.ZoneInfo("America/Mexico_City")
+except Exception as e:
+    logger.warning(f"Error al obtener fecha con ZoneInfo (fallback a UTC-6): {e}")
+    LOCAL_TZ = timezone(timedelta(hours=-6))
+
+# columna epoch -> columna de texto heredada
+TIME_COLUMNS = {
+    "created_at": "hora_creacion",
+    "assigned_at": "hora_asignacion",
+    "resolved_at": "hora_resolucion",
+    "completed_at": "hora_completado",
+}
+
+
+def now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+@lru_cache(maxsize=4096)
+def _format_minute(minute: int) -> Tuple[str, str]:
+    local = datetime.fromtimestamp(minute * 60, LOCAL_TZ)
+    return local.strftime("%d/%m/%Y"), local.strftime("%H:%M")
+
+
+def format_local(ms: int) -> Tuple[str, str]:
+    """(fecha, hora) en hora local para un instante en milisegundos."""
+    return _format_minute(ms // 60000)
+
+
+HOUR_MS = 60 * 60 * 1000
+
+
+@lru_cache(maxsize=4096)
+def _local_day_start(hour: int) -> int:
+    local = datetime.fromtimestamp(hour * 3600, LOCAL_TZ)
+    return int(local.replace(hour=0, minute=0, second=0, microsecond=0).timestamp() * 1000)
+
+
+def local_day_start(ms: int) -> int:
+    """Inicio (ms) del día en hora local que contiene el instante `ms`."""
+    return _local_day_start(ms // HOUR_MS)
+
+
+def local_date_start(day: date) -> int:
+    """Inicio (ms) de una fecha en hora local."""
+    return int(datetime(day.year, day.month, day.day, tzinfo=LOCAL_TZ).timestamp() * 1000)
+
+
+def parse_legacy(fecha: Optional[str], hora: Optional[str]) -> Optional[int]:
+    """Convierte 'dd/mm/YYYY' + 'HH:MM' (hora local) a milisegundos, o None si no se puede."""
+    if not fecha or not hora:
+        return None
+    try:
+        local = datetime.strptime(f"{fecha} {hora}", "%d/%m/%Y %H:%M").replace(tzinfo=LOCAL_TZ)
+    except ValueError:
+        return None
+    return int(local.timestamp() * 1000)
+
+
+def render_task_times(task: dict) -> dict:
+    """
+    Reemplaza las columnas epoch de una fila de tarea por los textos que
+    espera la API. Si una columna epoch está vacía se conserva el texto guardado
+    (created_at = 0 marca filas heredadas cuya fecha no se pudo interpretar).
+    """
+    created_at = task.pop("created_at", None)
+    if created_at:
+        task["fecha"], task["hora_creacion"] = format_local(created_at)
+    for column in ("assigned_at", "resolved_at", "completed_at"):
+        value = task.pop(column, None)
+        if value is not None:
+            task[TIME_COLUMNS[column]] = format_local(value)[1]
+    return task
@@ -0,0 +1,184 @@
+"""
+Transiciones de estado de las tareas en una sola transacción corta.
+
+Cada transición es un UPDATE condicionado al estado actual
+(`WHERE id = ? AND estado = ?`) dentro de BEGIN IMMEDIATE. Si otro mediador
+ganó la carrera el UPDATE no afecta filas y se aborta. Los flags
+`caso_activo` se actualizan en la misma transacción, y la fila resultante
+(con los datos del estudiante y del mediador) sale del propio UPDATE vía
+RETURNING, sin una lectura adicional.
+
+Los tiempos se reciben en milisegundos desde epoch y se guardan tanto en las
+columnas *_at como en los textos heredados (fecha, hora_*). Asignar, resolver
+y completar suman además su tiempo de respuesta a los rollups (rollups.py)
+en la misma transacción.
+
+    Activo --asignar--> Pendiente --resolver--> Pendiente Formulario --completar--> Completado
+"""
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+import sqlite3
+
+from timestamps import format_local, render_task_times
+import rollups
+
+ESTADO_ACTIVO = "Activo"
+ESTADO_PENDIENTE = "Pendiente"
+ESTADO_PENDIENTE_FORMULARIO = "Pendiente Formulario"
+ESTADO_COMPLETADO = "Completado"
+
+# Mismas columnas (y alias) que TaskResponse
+TASK_RETURNING = """
+    RETURNING id, usuario_id,
+        (SELECT codigo FROM usuarios WHERE id = tasks.usuario_id) AS codigo_estudiante,
+        (SELECT correo FROM usuarios WHERE id = tasks.usuario_id) AS correo_estudiante,
+        (SELECT nombre FROM usuarios WHERE id = tasks.usuario_id) AS nombre_estudiante,
+        (SELECT apellido FROM usuarios WHERE id = tasks.usuario_id) AS apellido_estudiante,
+        ubicacion, estado, fecha, hora_creacion,
+        hora_asignacion, hora_resolucion, hora_completado,
+        mediador_id, descripcion_final,
+        created_at, assigned_at, resolved_at, completed_at,
+        (SELECT nombre FROM usuarios WHERE id = tasks.mediador_id) AS mediador_nombre,
+        (SELECT apellido FROM usuarios WHERE id = tasks.mediador_id) AS mediador_apellido
+"""
+
+
+class TransitionError(Exception):
+    """La transición no puede aplicarse."""
+
+
+class TaskNotInState(TransitionError):
+    """La tarea no existe, no está en el estado esperado o no pertenece al actor."""
+
+
+class ActorBusy(TransitionError):
+    """El usuario ya tiene un caso activo."""
+
+
+@contextmanager
+def immediate_transaction(conn: sqlite3.Connection):
+    """Toma el lock de escritura al inicio para no fallar a mitad de la transacción."""
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def _update_task(
+    conn: sqlite3.Connection,
+    task_id: int,
+    from_estado: str,
+    changes: Dict[str, Any],
+    guards: Optional[Dict[str, Any]] = None,
+) -> Optional[dict]:
+    """UPDATE condicionado; devuelve la fila nueva (sin renderizar) o None si ninguna fila cumplió la guarda."""
+    set_clause = ", ".join(f"{column} = ?" for column in changes)
+    where = ["id = ?", "estado = ?"]
+    params = list(changes.values()) + [task_id, from_estado]
+    for column, value in (guards or {}).items():
+        where.append(f"{column} = ?")
+        params.append(value)
+    row = conn.execute(
+        f"UPDATE tasks SET {set_clause} WHERE {' AND '.join(where)} {TASK_RETURNING}",
+        params,
+    ).fetchone()
+    return dict(row) if row else None
+
+
+def _mark_busy(conn: sqlite3.Connection, usuario_id: int):
+    cursor = conn.execute(
+        "UPDATE usuarios SET caso_activo = 1 WHERE id = ? AND caso_activo = 0",
+        (usuario_id,),
+    )
+    if cursor.rowcount != 1:
+        raise ActorBusy(usuario_id)
+
+
+def create_task(conn: sqlite3.Connection, usuario_id: int, ubicacion: str, ahora_ms: int) -> dict:
+    fecha, hora = format_local(ahora_ms)
+    with immediate_transaction(conn):
+        _mark_busy(conn, usuario_id)
+        row = conn.execute(
+            f"""
+            INSERT INTO tasks (usuario_id, ubicacion, estado, fecha, hora_creacion, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            {TASK_RETURNING}
+            """,
+            (usuario_id, ubicacion, ESTADO_ACTIVO, fecha, hora, ahora_ms),
+        ).fetchone()
+        return render_task_times(dict(row))
+
+
+def _assign(conn: sqlite3.Connection, task_id: int, mediador_id: int, ahora_ms: int) -> dict:
+    _mark_busy(conn, mediador_id)
+    task = _update_task(
+        conn, task_id, ESTADO_ACTIVO,
+        {
+            "estado": ESTADO_PENDIENTE, "mediador_id": mediador_id,
+            "hora_asignacion": format_local(ahora_ms)[1], "assigned_at": ahora_ms,
+        },
+    )
+    if task is None:
+        raise TaskNotInState(task_id)
+    rollups.record(conn, "asignacion", task)
+    return render_task_times(task)
+
+
+def assign_task(conn: sqlite3.Connection, task_id: int, mediador_id: int, ahora_ms: int) -> dict:
+    with immediate_transaction(conn):
+        return _assign(conn, task_id, mediador_id, ahora_ms)
+
+
+def dispatch_next(conn: sqlite3.Connection, mediador_id: int, ahora_ms: int) -> Optional[dict]:
+    """Asigna al mediador la tarea 'Activo' más antigua; None si no hay ninguna (dispatcher.py)."""
+    with immediate_transaction(conn):
+        row = conn.execute(
+            "SELECT id FROM tasks WHERE estado = ? ORDER BY id LIMIT 1", (ESTADO_ACTIVO,)
+        ).fetchone()
+        if row is None:
+            return None
+        return _assign(conn, row[0], mediador_id, ahora_ms)
+
+
+def resolve_task(conn: sqlite3.Connection, task_id: int, mediador_id: int, ahora_ms: int) -> dict:
+    with immediate_transaction(conn):
+        task = _update_task(
+            conn, task_id, ESTADO_PENDIENTE,
+            {
+                "estado": ESTADO_PENDIENTE_FORMULARIO,
+                "hora_resolucion": format_local(ahora_ms)[1], "resolved_at": ahora_ms,
+            },
+            guards={"mediador_id": mediador_id},
+        )
+        if task is None:
+            raise TaskNotInState(task_id)
+        rollups.record(conn, "resolucion", task)
+        # Liberar al mediador y al usuario
+        conn.execute(
+            "UPDATE usuarios SET caso_activo = 0 WHERE id IN (?, ?)",
+            (mediador_id, task["usuario_id"]),
+        )
+        return render_task_times(task)
+
+
+def complete_task(
+    conn: sqlite3.Connection, task_id: int, usuario_id: int, ahora_ms: int, descripcion_final: Optional[str]
+) -> dict:
+    with immediate_transaction(conn):
+        task = _update_task(
+            conn, task_id, ESTADO_PENDIENTE_FORMULARIO,
+            {
+                "estado": ESTADO_COMPLETADO, "hora_completado": format_local(ahora_ms)[1],
+                "completed_at": ahora_ms, "descripcion_final": descripcion_final,
+            },
+            guards={"usuario_id": usuario_id},
+        )
+        if task is None:
+            raise TaskNotInState(task_id)
+        rollups.record(conn, "formulario", task)
+        return render_task_times(task)
@@ -0,0 +1,372 @@
+"""
+Importación masiva de usuarios desde CSV o NDJSON.
+
+Dar de alta un semestre con POST /usuarios/ son miles de peticiones, cada
+una con su bcrypt y su transacción de una fila. Aquí el archivo se lee como
+stream y se procesa por lotes:
+
+1. cada registro se valida (mismas reglas que el modelo Usuario) y se
+   descartan códigos o correos repetidos dentro del archivo;
+2. una consulta por lote descarta los que ya existen en la base, antes de
+   gastar bcrypt en ellos;
+3. las contraseñas se hashean en un pool de procesos (bcrypt es CPU puro y
+   con hilos no escala más allá de unos pocos núcleos);
+4. el lote se inserta con executemany en una transacción BEGIN IMMEDIATE,
+   volviendo a verificar duplicados con el lock tomado.
+
+Un registro inválido o duplicado se reporta con su número de línea y no
+aborta el lote. El CSV requiere encabezado con `codigo`, `correo` y
+`contrasena`; `nombre`, `apellido` y `rol` ('usuario' o 'mediador') son
+opcionales. En NDJSON cada línea es un objeto con esas mismas claves.
+
+    python user_import.py alumnos.csv
+    python user_import.py alumnos.ndjson --batch-size 1000 --workers 8
+
+bcrypt domina el tiempo total (unos 0.3 s por contraseña con costo 12 en un
+núcleo): el pool usa todos los núcleos. IMPORT_BCRYPT_ROUNDS permite
+importar con un costo menor; esos hashes se re-hashean con BCRYPT_ROUNDS en
+el primer inicio de sesión.
+
+La API expone lo mismo en POST /admin/usuarios/import (ver main.py).
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import csv
+import json
+import logging
+import math
+import multiprocessing
+import sqlite3
+import time
+
+from transitions import immediate_transaction
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "ndjson")
+REQUIRED_FIELDS = ("codigo", "correo", "contrasena")
+OPTIONAL_FIELDS = ("nombre", "apellido", "rol")
+IMPORTABLE_ROLES = ("usuario", "mediador")
+DEFAULT_BATCH_SIZE = 500
+
+
+class ImportFormatError(ValueError):
+    """El archivo no se puede importar (encabezado o formato inválido)."""
+
+
+@dataclass
+class ImportRow:
+    line: int
+    codigo: str
+    correo: str
+    contrasena: str
+    nombre: Optional[str]
+    apellido: Optional[str]
+    rol: str
+    hash: Optional[str] = None
+
+
+@dataclass
+class ImportStats:
+    processed: int = 0
+    inserted: int = 0
+    errors: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    def as_dict(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            "processed": self.processed,
+            "inserted": self.inserted,
+            "errors": self.errors,
+            "elapsed_seconds": round(elapsed, 1),
+            "rows_per_second": round(self.processed / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+def row_error(line: int, codigo: Optional[str], detail: str) -> dict:
+    return {"line": line, "codigo": codigo, "error": detail}
+
+
+# --- LECTURA ---
+
+class UserImporter:
+    """
+    Estado de una importación: convierte líneas en registros, valida y
+    descarta duplicados dentro del archivo, y lleva las estadísticas. Las
+    etapas que tocan la base o el pool de procesos son funciones aparte
+    (find_existing, hash_passwords, insert_rows) para que el llamador decida
+    dónde ejecutarlas.
+    """
+
+    def __init__(self, fmt: str):
+        if fmt not in FORMATS:
+            raise ImportFormatError(f"Formato no soportado: {fmt}")
+        self.fmt = fmt
+        self.header: Optional[List[str]] = None
+        self.stats = ImportStats()
+        self._line = 0
+        self._pending: List[str] = []  # Líneas de un registro CSV con un campo entre comillas abierto
+        self._pending_start = 0
+        self._codigos: Set[str] = set()
+        self._correos: Set[str] = set()
+
+    @property
+    def ready(self) -> bool:
+        """True cuando ya se leyó (y validó) el encabezado, o si el formato no lleva."""
+        return self.fmt != "csv" or self.header is not None
+
+    def feed(self, line: str) -> List[Tuple[int, object]]:
+        """Consume una línea; devuelve los registros completos como (línea, dict o mensaje de error)."""
+        self._line += 1
+        line = line.rstrip("\r")
+        if self.fmt == "ndjson":
+            if not line.strip():
+                return []
+            try:
+                record = json.loads(line)
+            except ValueError:
+                return [(self._line, "JSON inválido")]
+            return [(self._line, record if isinstance(record, dict) else "Se esperaba un objeto JSON")]
+
+        if not self._pending:
+            self._pending_start = self._line
+        self._pending.append(line)
+        text = "\n".join(self._pending)
+        if text.count('"') % 2:
+            return []  # Campo entre comillas que continúa en la línea siguiente
+        self._pending = []
+        if not text.strip():
+            return []
+        values = next(csv.reader([text]))
+        if self.header is None:
+            self.header = [name.strip().lower() for name in values]
+            missing = [name for name in REQUIRED_FIELDS if name not in self.header]
+            if missing:
+                raise ImportFormatError(f"Faltan columnas en el encabezado: {', '.join(missing)}")
+            return []
+        if len(values) != len(self.header):
+            return [(self._pending_start, f"Se esperaban {len(self.header)} columnas y hay {len(values)}")]
+        return [(self._pending_start, dict(zip(self.header, values)))]
+
+    def finish(self) -> List[Tuple[int, object]]:
+        if self._pending:
+            self._pending = []
+            return [(self._pending_start, "Comillas sin cerrar al final del archivo")]
+        return []
+
+    def prepare(self, records: Iterable[Tuple[int, object]]) -> Tuple[List[ImportRow], List[dict]]:
+        """Valida un lote de registros y descarta los repetidos dentro del archivo."""
+        rows, errors = [], []
+        for line, record in records:
+            self.stats.processed += 1
+            if isinstance(record, str):
+                errors.append(row_error(line, None, record))
+                continue
+            row = _clean(line, record)
+            if isinstance(row, dict):
+                errors.append(row)
+            elif row.codigo in self._codigos:
+                errors.append(row_error(line, row.codigo, "Código repetido en el archivo"))
+            elif row.correo in self._correos:
+                errors.append(row_error(line, row.codigo, "Correo repetido en el archivo"))
+            else:
+                self._codigos.add(row.codigo)
+                self._correos.add(row.correo)
+                rows.append(row)
+        return rows, errors
+
+    def count(self, inserted: int, errors: int):
+        self.stats.inserted += inserted
+        self.stats.errors += errors
+
+
+def _text(record: dict, name: str) -> str:
+    value = record.get(name)
+    return "" if value is None else str(value).strip()
+
+
+def _clean(line: int, record: dict):
+    codigo = _text(record, "codigo")
+    correo = _text(record, "correo").lower()
+    contrasena = record.get("contrasena")
+    if not codigo:
+        return row_error(line, None, "El código no puede estar vacío")
+    if not correo:
+        return row_error(line, codigo, "El formato del correo no es válido")
+    if not contrasena or not str(contrasena).strip():
+        return row_error(line, codigo, "La contraseña no puede estar vacía")
+    rol = _text(record, "rol") or "usuario"
+    if rol not in IMPORTABLE_ROLES:
+        return row_error(line, codigo, f"Rol no permitido: {rol}")
+    return ImportRow(
+        line=line,
+        codigo=codigo,
+        correo=correo,
+        contrasena=str(contrasena),
+        nombre=_text(record, "nombre") or None,
+        apellido=_text(record, "apellido") or None,
+        rol=rol,
+    )
+
+
+# --- BASE DE DATOS ---
+
+def _existing(conn: sqlite3.Connection, column: str, values: List[str]) -> Set[str]:
+    if not values:
+        return set()
+    placeholders = ", ".join("?" * len(values))
+    return {row[0] for row in conn.execute(f"SELECT {column} FROM usuarios WHERE {column} IN ({placeholders})", values)}
+
+
+def split_rows(rows: List[ImportRow], codigos: Set[str], correos: Set[str]) -> Tuple[List[ImportRow], List[dict]]:
+    """Separa las filas cuyo código o correo ya está en `codigos` / `correos`."""
+    fresh, errors = [], []
+    for row in rows:
+        if row.codigo in codigos:
+            errors.append(row_error(row.line, row.codigo, "El código de usuario ya está registrado."))
+        elif row.correo in correos:
+            errors.append(row_error(row.line, row.codigo, "El correo electrónico ya está registrado."))
+        else:
+            fresh.append(row)
+    return fresh, errors
+
+
+def _split_existing(conn: sqlite3.Connection, rows: List[ImportRow]) -> Tuple[List[ImportRow], List[dict]]:
+    codigos = _existing(conn, "codigo", [row.codigo for row in rows])
+    correos = _existing(conn, "correo", [row.correo for row in rows])
+    return split_rows(rows, codigos, correos)
+
+
+def find_existing(conn: sqlite3.Connection, rows: List[ImportRow]) -> Tuple[List[ImportRow], List[dict]]:
+    """Separa los usuarios que ya existen, antes de hashear (solo lectura)."""
+    return _split_existing(conn, rows)
+
+
+def insert_rows(conn: sqlite3.Connection, rows: List[ImportRow]) -> Tuple[List[ImportRow], List[dict]]:
+    """Inserta el lote en una transacción; devuelve (insertados, errores por duplicado)."""
+    if not rows:
+        return [], []
+    with immediate_transaction(conn):
+        # Con el lock tomado nadie más puede insertar entre esta verificación y el INSERT
+        fresh, errors = _split_existing(conn, rows)
+        conn.executemany(
+            """
+            INSERT INTO usuarios (codigo, correo, contrasena, rol, nombre, apellido, caso_activo)
+            VALUES (?, ?, ?, ?, ?, ?, 0)
+            """,
+            [(row.codigo, row.correo, row.hash, row.rol, row.nombre, row.apellido) for row in fresh],
+        )
+    return fresh, errors
+
+
+# --- HASH EN PARALELO ---
+
+_contexts: Dict[int, object] = {}
+
+
+def _hash_chunk(passwords: List[str], rounds: int) -> List[str]:
+    """Se ejecuta en un proceso del pool: un CryptContext por proceso y costo."""
+    context = _contexts.get(rounds)
+    if context is None:
+        from passlib.context import CryptContext
+        context = _contexts[rounds] = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+    return [context.hash(password) for password in passwords]
+
+
+def create_hash_executor(workers: int) -> ProcessPoolExecutor:
+    # spawn: el proceso padre tiene hilos (executors, conexiones) que fork no copia de forma segura
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def hash_passwords(executor: Executor, rows: List[ImportRow], rounds: int, workers: int):
+    """Llena row.hash repartiendo el lote entre los procesos del pool."""
+    if not rows:
+        return
+    size = math.ceil(len(rows) / workers)
+    chunks = [rows[i:i + size] for i in range(0, len(rows), size)]
+    results = executor.map(_hash_chunk, [[row.contrasena for row in chunk] for chunk in chunks], [rounds] * len(chunks))
+    for chunk, hashes in zip(chunks, results):
+        for row, hashed in zip(chunk, hashes):
+            row.hash = hashed
+
+
+# --- IMPORTACIÓN DESDE LA LÍNEA DE COMANDOS ---
+
+def import_file(
+    conn: sqlite3.Connection,
+    lines: Iterable[str],
+    fmt: str,
+    executor: Executor,
+    workers: int,
+    rounds: int,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    on_error=None,
+    on_progress=None,
+) -> ImportStats:
+    importer = UserImporter(fmt)
+    pending: List[Tuple[int, object]] = []
+
+    def flush():
+        rows, errors = importer.prepare(pending)
+        pending.clear()
+        rows, existing = find_existing(conn, rows)
+        hash_passwords(executor, rows, rounds, workers)
+        inserted, duplicated = insert_rows(conn, rows)
+        errors += existing + duplicated
+        importer.count(len(inserted), len(errors))
+        for error in errors:
+            if on_error:
+                on_error(error)
+        if on_progress:
+            on_progress(importer.stats.as_dict())
+
+    for line in lines:
+        pending.extend(importer.feed(line.rstrip("\n")))
+        if len(pending) >= batch_size:
+            flush()
+    pending.extend(importer.finish())
+    if pending or not importer.stats.processed:
+        flush()
+    return importer.stats
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
+    from dotenv import load_dotenv
+    from database import ConnectionPool
+    from migrations import migrate
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Importación masiva de usuarios")
+    parser.add_argument("path", help="Archivo .csv o .ndjson ('-' para stdin)")
+    parser.add_argument("--format", choices=FORMATS, help="Por defecto, según la extensión")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("IMPORT_BATCH_SIZE", DEFAULT_BATCH_SIZE)))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("IMPORT_HASH_WORKERS", "0")) or os.cpu_count() or 1,
+        help="Procesos para bcrypt",
+    )
+    args = parser.parse_args()
+
+    fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    rounds = int(os.getenv("IMPORT_BCRYPT_ROUNDS", "0")) or int(os.getenv("BCRYPT_ROUNDS", "12"))
+    pool = ConnectionPool(os.getenv("DATABASE_URL", "db/isaa.db"), max_size=1)
+    source = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8-sig", newline="")
+    try:
+        with pool.connection() as conn, create_hash_executor(args.workers) as executor:
+            migrate(conn)
+            stats = import_file(
+                conn, source, fmt, executor, args.workers, rounds, args.batch_size,
+                on_error=lambda error: print(json.dumps(error, ensure_ascii=False)),
+                on_progress=lambda progress: logger.info(f"Importación: {progress}"),
+            )
+    except ImportFormatError as e:
+        raise SystemExit(f"Error: {e}")
+    finally:
+        source.close()
+        pool.close()
+    logger.info(f"Importación terminada: {stats.as_dict()}")
@@ -0,0 +1,70 @@
+"""
+Contadores de versión de la tabla de tareas para respuestas condicionales (ETag).
+
+Cada endpoint de escritura incrementa la versión global y la de los usuarios
+involucrados. Las lecturas construyen su ETag a partir de esas versiones, así
+que pueden responder 304 sin consultar SQLite cuando el cliente ya está al día.
+"""
+from typing import Dict, Optional
+import hashlib
+import os
+import threading
+import time
+
+
+def _new_epoch() -> str:
+    # Incluye el pid: con varios workers cada uno tiene sus propios contadores
+    return f"{int(time.time() * 1000):x}{os.getpid():x}"
+
+
+class ChangeTracker:
+    def __init__(self):
+        # El epoch invalida los ETag emitidos antes de un reinicio del proceso
+        self.epoch = _new_epoch()
+        self._global = 0
+        self._per_user: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def bump(self, *usuario_ids: Optional[int]) -> int:
+        """Registra un cambio en tareas de los usuarios dados; devuelve la nueva versión global."""
+        with self._lock:
+            self._global += 1
+            for usuario_id in usuario_ids:
+                if usuario_id is not None:
+                    self._per_user[usuario_id] = self._global
+            return self._global
+
+    def reset(self):
+        """Invalida todos los ETag emitidos (p. ej. si se perdieron cambios de otro worker)."""
+        with self._lock:
+            self.epoch = _new_epoch()
+
+    @property
+    def global_version(self) -> int:
+        with self._lock:
+            return self._global
+
+    def user_version(self, usuario_id: int) -> int:
+        with self._lock:
+            return self._per_user.get(usuario_id, 0)
+
+    def etag(self, scope: str, version: int, *params) -> str:
+        """ETag débil para `scope` en `version`; `params` distingue variantes de la misma lista."""
+        tag = f"{self.epoch}-{scope}-{version}"
+        if params:
+            digest = hashlib.blake2s(repr(params).encode(), digest_size=6).hexdigest()
+            tag = f"{tag}-{digest}"
+        return f'W/"{tag}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Compara If-None-Match con un ETag usando comparación débil (RFC 9110)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == opaque
+        for candidate in if_none_match.split(",")
+    )
@@ -0,0 +1,83 @@
+"""
+Pool de hilos acotado para trabajo de CPU que no debe correr en el event loop
+(hash y verificación de contraseñas con bcrypt).
+
+Además del número de hilos, limita cuántas tareas pueden estar pendientes: si
+la cola está llena se rechaza de inmediato en lugar de encolar sin límite.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+import asyncio
+import threading
+import time
+
+
+class WorkerPoolSaturated(Exception):
+    """La cola de trabajo está llena; el llamador debe reintentar más tarde."""
+
+
+class BoundedWorkerPool:
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_pending: int = 32,
+        name: str = "worker",
+        on_complete: Optional[Callable[[str, float], None]] = None,
+    ):
+        if max_workers < 1 or max_pending < max_workers:
+            raise ValueError("Se requiere max_workers >= 1 y max_pending >= max_workers")
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.on_complete = on_complete  # Recibe (nombre de la función, segundos) de cada tarea (métricas)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+
+    async def run(self, fn: Callable[..., Any], *args) -> Any:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise WorkerPoolSaturated(f"Cola '{self.name}' llena ({self.max_pending} pendientes)")
+            self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._timed, fn, args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _timed(self, fn: Callable[..., Any], args: tuple) -> Any:
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.completed += 1
+                self.total_seconds += elapsed
+            if self.on_complete:
+                self.on_complete(getattr(fn, "__name__", "desconocida"), elapsed)
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_ms": round(self.total_seconds * 1000 / self.completed, 3) if self.completed else 0.0,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -35,6 +35,7 @@ function login() {
   clearError();
 
   localStorage.removeItem("access_token");
+  localStorage.removeItem("refresh_token");
 
   if (!codigo || !password) {
     showError("Por favor, complete todos los campos");
@@ -69,6 +70,7 @@ function login() {
     .then((data) => {
       console.log("Login exitoso:", data);
       localStorage.setItem("access_token", data.access_token);
+      localStorage.setItem("refresh_token", data.refresh_token);
 
       // Redirige al dashboard principal independientemente del rol,
       // la lógica de qué mostrar se manejará en dashboard.html
@@ -13,11 +13,56 @@ let currentUserRole = ""        // Rol del usuario actual
 
 // --- FUNCIONES DE AUTENTICACIÓN Y SEGURIDAD ---
 
+let refreshPromise = null
+
+/**
+ * Cambia el refresh token por un access token nuevo sin pedir la contraseña.
+ * Las peticiones que reciben 401 a la vez comparten una sola renovación.
+ * Retorna true si hay un access token nuevo en localStorage.
+ */
+function refreshAccessToken() {
+  if (!refreshPromise) {
+    refreshPromise = doRefreshAccessToken().finally(() => {
+      refreshPromise = null
+    })
+  }
+  return refreshPromise
+}
+
+async function doRefreshAccessToken() {
+  const refreshToken = localStorage.getItem("refresh_token")
+  if (!refreshToken) return false
+
+  try {
+    const response = await fetch(`${API_URL}/token/refresh`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ refresh_token: refreshToken }),
+    })
+
+    if (response.status === 409) {
+      // Otra pestaña acaba de renovar la sesión: usar el token que guardó
+      await new Promise((resolve) => setTimeout(resolve, 500))
+      return localStorage.getItem("refresh_token") !== refreshToken
+    }
+    if (!response.ok) return false
+
+    const data = await response.json()
+    localStorage.setItem("access_token", data.access_token)
+    localStorage.setItem("refresh_token", data.refresh_token)
+    return true
+  } catch (error) {
+    console.error("Error renovando la sesión:", error)
+    return false
+  }
+}
+
 /**
  * Realiza peticiones HTTP autenticadas con token JWT
- * Maneja automáticamente la autorización y errores de autenticación
+ * Maneja automáticamente la autorización y errores de autenticación;
+ * si el access token venció, lo renueva y repite la petición una vez
  */
-async function authenticatedFetch(url, options = {}) {
+async function authenticatedFetch(url, options = {}, retried = false) {
   const token = localStorage.getItem("access_token")
 
   if (!token) {
@@ -41,6 +86,10 @@ async function authenticatedFetch(url, options = {}) {
   try {
     const response = await fetch(url, finalOptions)
 
+    if (response.status === 401 && !retried && (await refreshAccessToken())) {
+      return authenticatedFetch(url, options, true)
+    }
+
     if (response.status === 401 || response.status === 403) {
       console.warn("Token expirado o inválido, cerrando sesión...")
       handleAuthError()
@@ -74,6 +123,7 @@ async function authenticatedFetch(url, options = {}) {
  */
 function handleAuthError() {
   localStorage.removeItem("access_token")
+  localStorage.removeItem("refresh_token")
   alert("Tu sesión ha expirado. Serás redirigido al login.")
   window.location.href = "index.html"
 }
@@ -94,14 +144,31 @@ async function verifyTokenValidity() {
 
 /**
  * Cierra la sesión del usuario
- * Elimina el token y redirige al login
+ * Revoca el refresh token, elimina los tokens y redirige al login
  */
 function logout() {
+  revokeRefreshToken()
   localStorage.removeItem("access_token")
+  localStorage.removeItem("refresh_token")
   window.location.href = "index.html"
 }
 
 
+/**
+ * Avisa a la API que la sesión terminó; si falla, el token vence solo
+ */
+function revokeRefreshToken() {
+  const refreshToken = localStorage.getItem("refresh_token")
+  if (!refreshToken) return
+  fetch(`${API_URL}/token/revoke`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ refresh_token: refreshToken }),
+    keepalive: true,
+  }).catch(() => {})
+}
+
+
 // --- FUNCIONES DE GESTIÓN DE MODALES ---
 
 function disableBodyScroll() {
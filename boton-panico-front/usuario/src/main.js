@@ -57,6 +57,7 @@ function login() {
     clearError();
 
     localStorage.removeItem('access_token');
+    localStorage.removeItem('refresh_token');
 
     if (!codigo || !password) {
         showError('Por favor, complete todos los campos');
@@ -91,6 +92,7 @@ function login() {
     .then(data => {
         console.log('Login exitoso:', data);
         localStorage.setItem('access_token', data.access_token);
+        localStorage.setItem('refresh_token', data.refresh_token);
         window.location.href = 'dashboard.html';
     })
     .catch(error => {